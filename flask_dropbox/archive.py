@@ -0,0 +1,202 @@
+"""
+=====================
+flask_dropbox.archive
+=====================
+
+Build ZIP archives on the fly, without knowing CRC of files in advance and
+without seeking, so archive could be streamed to the client while files are
+downloaded from Dropbox.
+
+"""
+
+import struct
+import zlib
+
+
+__all__ = ('iter_zip', )
+
+
+#: Sizes and offsets starting from this limit are stored in ZIP64 extra
+#: fields, while 32-bit fields are set to ``0xFFFFFFFF``
+ZIP64_LIMIT = 0xFFFFFFFF
+
+#: Number of entries starting from which ZIP64 end of central directory
+#: record is used, while 16-bit fields are set to ``0xFFFF``
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+#: General purpose flags: sizes and CRC follow file data, UTF-8 names
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+#: Version needed to extract stored entries and ZIP64 ones
+VERSION = 20
+VERSION_ZIP64 = 45
+
+#: Version made by, high byte means Unix, so file modes are respected
+MADE_BY_UNIX = 3 << 8
+
+#: External attributes with Unix modes of files and directories
+FILE_ATTRS = 0100644 << 16
+DIR_ATTRS = (040755 << 16) | 0x10
+
+
+def iter_zip(entries, chunk_size):
+    """
+    Yield chunks of ZIP archive for ``entries``.
+
+    Each entry is ``(name, date_time, file_obj, size)`` tuple, where
+    ``date_time`` is ``datetime`` instance or ``None``, ``file_obj`` is
+    file-like object to read content from in chunks of ``chunk_size`` bytes
+    or ``None`` for directory and ``size`` is expected content size, used
+    only to decide whether entry needs ZIP64 extensions. Directory names
+    should end with slash.
+
+    Entries are stored without compression and are read only while archive
+    is iterated, so only one chunk of content is kept in memory.
+    """
+    central = []
+    offset = 0
+
+    for name, date_time, file_obj, size in entries:
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+
+        is_dir = file_obj is None
+        zip64 = not is_dir and size >= ZIP64_LIMIT
+        dos_time, dos_date = get_dos_date_time(date_time)
+        flags = FLAG_UTF8 if is_dir else FLAG_UTF8 | FLAG_DATA_DESCRIPTOR
+
+        # CRC and sizes are not known yet, ZIP64 entries put placeholders
+        # to sizes and extra field
+        extra = struct.pack('<HHQQ', 1, 16, 0, 0) if zip64 else ''
+        header = struct.pack('<IHHHHHIIIHH',
+                             0x04034b50,
+                             VERSION_ZIP64 if zip64 else VERSION,
+                             flags,
+                             0,
+                             dos_time,
+                             dos_date,
+                             0,
+                             0xFFFFFFFF if zip64 else 0,
+                             0xFFFFFFFF if zip64 else 0,
+                             len(name),
+                             len(extra)) + name + extra
+
+        header_offset = offset
+        offset += len(header)
+        yield header
+
+        crc, length = 0, 0
+
+        if not is_dir:
+            while True:
+                chunk = file_obj.read(chunk_size)
+
+                if not chunk:
+                    break
+
+                crc = zlib.crc32(chunk, crc)
+                length += len(chunk)
+                yield chunk
+
+            crc &= 0xFFFFFFFF
+            descriptor = struct.pack('<IIQQ' if zip64 else '<IIII',
+                                     0x08074b50,
+                                     crc,
+                                     length,
+                                     length)
+
+            offset += length + len(descriptor)
+            yield descriptor
+
+        central.append((name, flags, dos_time, dos_date, crc, length,
+                        header_offset, is_dir))
+
+    directory_offset = offset
+
+    for item in central:
+        record = get_central_record(*item)
+        offset += len(record)
+        yield record
+
+    count = len(central)
+    directory_size = offset - directory_offset
+
+    zip64 = count >= ZIP64_COUNT_LIMIT or \
+        directory_offset >= ZIP64_LIMIT or \
+        directory_size >= ZIP64_LIMIT
+
+    if zip64:
+        yield struct.pack('<IQHHIIQQQQ',
+                          0x06064b50,
+                          44,
+                          MADE_BY_UNIX | VERSION_ZIP64,
+                          VERSION_ZIP64,
+                          0,
+                          0,
+                          count,
+                          count,
+                          directory_size,
+                          directory_offset)
+        yield struct.pack('<IIQI', 0x07064b50, 0, offset, 1)
+
+    yield struct.pack('<IHHHHIIH',
+                      0x06054b50,
+                      0,
+                      0,
+                      0xFFFF if zip64 else count,
+                      0xFFFF if zip64 else count,
+                      0xFFFFFFFF if zip64 else directory_size,
+                      0xFFFFFFFF if zip64 else directory_offset,
+                      0)
+
+
+def get_central_record(name, flags, dos_time, dos_date, crc, length,
+                       header_offset, is_dir):
+    """
+    Build central directory record of archive entry.
+    """
+    zip64 = length >= ZIP64_LIMIT or header_offset >= ZIP64_LIMIT
+    extra = ''
+
+    if zip64:
+        extra = struct.pack('<HHQQQ', 1, 24, length, length, header_offset)
+        length = header_offset = 0xFFFFFFFF
+
+    version = VERSION_ZIP64 if zip64 else VERSION
+
+    return struct.pack('<IHHHHHHIIIHHHHHII',
+                       0x02014b50,
+                       MADE_BY_UNIX | version,
+                       version,
+                       flags,
+                       0,
+                       dos_time,
+                       dos_date,
+                       crc,
+                       length,
+                       length,
+                       len(name),
+                       len(extra),
+                       0,
+                       0,
+                       0,
+                       DIR_ATTRS if is_dir else FILE_ATTRS,
+                       header_offset) + name + extra
+
+
+def get_dos_date_time(date_time):
+    """
+    Convert ``datetime`` instance to ``(time, date)`` pair in MS-DOS format.
+    MS-DOS dates start from 1980, so earlier or missed dates are stored as
+    1980-01-01.
+    """
+    if date_time is None or date_time.year < 1980:
+        return 0, (1 << 5) | 1
+
+    return ((date_time.hour << 11) |
+            (date_time.minute << 5) |
+            (date_time.second // 2),
+            ((date_time.year - 1980) << 9) |
+            (date_time.month << 5) |
+            date_time.day)
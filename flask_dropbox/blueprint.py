@@ -7,7 +7,8 @@ except ImportError:
 else:
     BABEL_SUPPORTED = True
 
-from .views import callback, logout
+from .views import (archive, callback, login, logout, search, stats,
+                    thumbnail, upload_status)
 
 
 __all__ = ('DropboxBlueprint', )
@@ -30,11 +31,23 @@ class DropboxBlueprint(Blueprint):
         super(DropboxBlueprint, self).__init__(**defaults)
 
         # Add URLs to the blueprint
-        url_map = {'/callback': callback, '/logout': logout}
+        url_map = {'/archive/<path:path>': archive,
+                   '/callback': callback,
+                   '/login': login,
+                   '/logout': logout,
+                   '/search': search,
+                   '/stats': stats,
+                   '/thumbnails/<path:path>': thumbnail,
+                   '/uploads/<job_id>': upload_status}
 
         for url, view_func in url_map.items():
             self.add_url_rule(url, view_func=view_func)
 
+        # Allow to archive the whole Dropbox
+        self.add_url_rule('/archive/',
+                          defaults={'path': '/'},
+                          view_func=archive)
+
         if not BABEL_SUPPORTED:
             @self.app_context_processor
             def inject_underscore():
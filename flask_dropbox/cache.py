@@ -0,0 +1,414 @@
+"""
+===================
+flask_dropbox.cache
+===================
+
+Cache backends to store account info, Dropbox clients and other values
+between calls.
+
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from werkzeug.local import LocalProxy
+
+try:
+    from werkzeug.contrib.cache import BaseCache as WerkzeugBaseCache
+except ImportError:
+    WerkzeugBaseCache = None
+
+from .utils import make_private_dir
+
+
+__all__ = ('BaseCache', 'FileSystemCache', 'MemoryCache', 'ObjectCache',
+           'WerkzeugCache', 'make_cache')
+
+
+class BaseCache(object):
+    """
+    Base class for all cache backends.
+
+    Timeout for all methods is number of seconds value should be stored in
+    cache. ``None`` means use ``default_timeout`` of backend, ``0`` means
+    value would never expire.
+    """
+    #: Flag shows that backend stores values in current process without any
+    #: serialization, so it is safe to keep live objects there.
+    local = True
+
+    def __init__(self, default_timeout=0):
+        self.default_timeout = default_timeout
+
+    def bind(self):
+        """
+        Return backend which could be used outside of current request
+        context, e.g. in background threads.
+        """
+        return self
+
+    def clear(self):
+        """
+        Remove all values from cache.
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """
+        Remove value for ``key`` from cache.
+        """
+        raise NotImplementedError
+
+    def delete_many(self, *keys):
+        """
+        Remove values for all ``keys`` from cache.
+        """
+        for key in keys:
+            self.delete(key)
+
+    def get(self, key):
+        """
+        Return value for ``key`` or ``None`` if value is missed or expired.
+        """
+        raise NotImplementedError
+
+    def get_many(self, *keys):
+        """
+        Return list of values for all ``keys``.
+        """
+        return [self.get(key) for key in keys]
+
+    def has(self, key):
+        """
+        Check whether cache contains value for ``key``.
+        """
+        return self.get(key) is not None
+
+    def set(self, key, value, timeout=None):
+        """
+        Store ``value`` for ``key`` in cache.
+        """
+        raise NotImplementedError
+
+    def set_many(self, mapping, timeout=None):
+        """
+        Store all values from ``mapping`` in cache.
+        """
+        for key, value in mapping.items():
+            self.set(key, value, timeout)
+
+    def _expires(self, timeout):
+        """
+        Convert ``timeout`` to expiration timestamp, ``0`` for never.
+        """
+        if timeout is None:
+            timeout = self.default_timeout
+        return time.time() + timeout if timeout else 0
+
+
+class ObjectCache(BaseCache):
+    """
+    Store values as attributes of any object, like ``flask.g``. Values are
+    stored with their expiration timestamps and expired values are removed
+    on access, but live no longer than object lives.
+    """
+    def __init__(self, obj, default_timeout=0):
+        super(ObjectCache, self).__init__(default_timeout)
+        self.obj = obj
+
+    def bind(self):
+        if isinstance(self.obj, LocalProxy):
+            return ObjectCache(self.obj._get_current_object(),
+                               self.default_timeout)
+        return self
+
+    def clear(self):
+        pass
+
+    def delete(self, key):
+        if hasattr(self.obj, key):
+            delattr(self.obj, key)
+
+    def get(self, key):
+        item = getattr(self.obj, key, None)
+
+        if item is None:
+            return None
+
+        value, expires = item
+
+        if expires and expires <= time.time():
+            self.delete(key)
+            return None
+
+        return value
+
+    def set(self, key, value, timeout=None):
+        setattr(self.obj, key, (value, self._expires(timeout)))
+
+
+class MemoryCache(BaseCache):
+    """
+    Thread-safe in-memory cache bounded by number of items. Least recently
+    used values are evicted first.
+    """
+    def __init__(self, max_size=1024, default_timeout=0):
+        super(MemoryCache, self).__init__(default_timeout)
+        self.max_size = max_size
+
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def get(self, key):
+        now = time.time()
+
+        with self._lock:
+            item = self._data.get(key)
+
+            if item is None:
+                return None
+
+            value, expires, _ = item
+
+            if expires and expires <= now:
+                del self._data[key]
+                return None
+
+            self._data[key] = (value, expires, now)
+            return value
+
+    def has(self, key):
+        return self.get(key) is not None
+
+    def set(self, key, value, timeout=None):
+        now = time.time()
+
+        with self._lock:
+            self._data[key] = (value, self._expires(timeout), now)
+            self._evict(now)
+
+    def _evict(self, now):
+        """
+        Remove expired values and then least recently used ones until cache
+        fits ``max_size``. Should be called only with acquired lock.
+        """
+        if not self.max_size or len(self._data) <= self.max_size:
+            return
+
+        for key, (_, expires, _) in list(self._data.items()):
+            if expires and expires <= now:
+                del self._data[key]
+
+        while len(self._data) > self.max_size:
+            key = min(self._data, key=lambda key: self._data[key][2])
+            del self._data[key]
+
+
+class WerkzeugCache(BaseCache):
+    """
+    Adapter for any ``werkzeug.contrib.cache`` backend, like ``SimpleCache``,
+    ``MemcachedCache`` or ``RedisCache``.
+    """
+    local = False
+
+    def __init__(self, cache, default_timeout=None):
+        super(WerkzeugCache, self).__init__(default_timeout)
+        self.cache = cache
+
+    def clear(self):
+        self.cache.clear()
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def delete_many(self, *keys):
+        self.cache.delete_many(*keys)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def get_many(self, *keys):
+        return self.cache.get_many(*keys)
+
+    def set(self, key, value, timeout=None):
+        self.cache.set(key, value, self._timeout(timeout))
+
+    def set_many(self, mapping, timeout=None):
+        self.cache.set_many(mapping, self._timeout(timeout))
+
+    def _timeout(self, timeout):
+        """
+        Werkzeug backends use their own default timeout for ``None`` and do
+        not support never expired values, so use their default in such case.
+        """
+        if timeout is None:
+            timeout = self.default_timeout
+        return timeout or None
+
+
+class FileSystemCache(BaseCache):
+    """
+    Store pickled values in files of ``cache_dir`` directory. Useful for
+    sharing cache between processes on the same host.
+
+    Unpickling file could execute arbitrary code, so ``cache_dir`` is
+    created accessible only by current user and ``ValueError`` is raised if
+    existing directory could be written by other users.
+    """
+    local = False
+
+    def __init__(self, cache_dir, threshold=1024, default_timeout=0):
+        super(FileSystemCache, self).__init__(default_timeout)
+        self.cache_dir = cache_dir
+        self.threshold = threshold
+
+        make_private_dir(cache_dir)
+
+    def clear(self):
+        for filename in self._list_dir():
+            self._remove(filename)
+
+    def delete(self, key):
+        self._remove(self._filename(key))
+
+    def get(self, key):
+        try:
+            with open(self._filename(key), 'rb') as handler:
+                expires = pickle.load(handler)
+
+                if expires and expires <= time.time():
+                    return None
+
+                return pickle.load(handler)
+        except (IOError, OSError, EOFError, pickle.PickleError):
+            return None
+
+    def set(self, key, value, timeout=None):
+        self._prune()
+        filename = self._filename(key)
+
+        try:
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+
+            with os.fdopen(fd, 'wb') as handler:
+                pickle.dump(self._expires(timeout), handler, 1)
+                pickle.dump(value, handler, pickle.HIGHEST_PROTOCOL)
+
+            os.rename(tmp, filename)
+        except (IOError, OSError):
+            pass
+
+    def _filename(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return os.path.join(self.cache_dir, hashlib.md5(key).hexdigest())
+
+    def _list_dir(self):
+        return [os.path.join(self.cache_dir, filename)
+                for filename in os.listdir(self.cache_dir)
+                if not filename.endswith('.tmp')]
+
+    def _prune(self):
+        """
+        Remove expired values and then oldest ones if number of files in
+        cache directory exceeds ``threshold``.
+        """
+        filenames = self._list_dir()
+
+        if not self.threshold or len(filenames) < self.threshold:
+            return
+
+        now = time.time()
+        alive = []
+
+        for filename in filenames:
+            try:
+                with open(filename, 'rb') as handler:
+                    expires = pickle.load(handler)
+            except (IOError, OSError, EOFError, pickle.PickleError):
+                expires = now
+
+            if expires and expires <= now:
+                self._remove(filename)
+            else:
+                alive.append(filename)
+
+        if len(alive) < self.threshold:
+            return
+
+        alive.sort(key=self._mtime)
+
+        for filename in alive[:len(alive) - self.threshold + 1]:
+            self._remove(filename)
+
+    def _mtime(self, filename):
+        try:
+            return os.path.getmtime(filename)
+        except OSError:
+            return 0
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
+def make_cache(storage, obj=None, cache_dir=None, max_size=None,
+               default_timeout=None):
+    """
+    Create cache backend from ``DROPBOX_CACHE_STORAGE`` value.
+
+    Value could be ``'memory'``, ``'filesystem'``, cache backend instance,
+    ``werkzeug.contrib.cache`` backend instance or any other object which
+    would be used as attributes storage.
+
+    ``'self'`` means values live as long as extension instance, so they are
+    kept in bounded ``MemoryCache`` instead of attributes of ``obj``, which
+    would never be evicted.
+    """
+    options = {}
+
+    if default_timeout is not None:
+        options['default_timeout'] = default_timeout
+
+    if storage in ('memory', 'self'):
+        if max_size is not None:
+            options['max_size'] = max_size
+        return MemoryCache(**options)
+
+    if storage == 'filesystem':
+        if max_size is not None:
+            options['threshold'] = max_size
+
+        cache_dir = \
+            cache_dir or os.path.join(tempfile.gettempdir(), 'flask_dropbox')
+        return FileSystemCache(cache_dir, **options)
+
+    if isinstance(storage, BaseCache):
+        return storage
+
+    if WerkzeugBaseCache is not None and \
+       isinstance(storage, WerkzeugBaseCache):
+        return WerkzeugCache(storage, default_timeout)
+
+    return ObjectCache(storage, **options)
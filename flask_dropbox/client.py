@@ -0,0 +1,337 @@
+"""
+====================
+flask_dropbox.client
+====================
+
+Instrumented proxy for Dropbox client. Each Dropbox API call made through
+proxy is timed, recorded in extension stats and sent as ``api_call`` signal.
+Identical concurrent calls are coalesced into one.
+
+"""
+
+import copy
+import sys
+import threading
+import time
+
+from dropbox.rest import ErrorResponse
+from flask import has_request_context
+
+from .cache import ObjectCache
+from .exceptions import CallBudgetExceeded
+from .executor import Future
+from .signals import api_call
+
+
+__all__ = ('DropboxClientProxy', 'SingleFlight', 'call_api')
+
+
+#: ``DropboxClient`` methods which make requests to Dropbox API
+API_METHODS = ('account_info', 'add_copy_ref', 'create_copy_ref', 'delta',
+               'file_copy', 'file_create_folder', 'file_delete', 'file_move',
+               'get_file', 'get_file_and_metadata', 'media', 'metadata',
+               'put_file', 'restore', 'revisions', 'search', 'share',
+               'thumbnail', 'thumbnail_and_metadata', 'upload_chunk')
+
+#: Methods which first argument is not Dropbox path
+PATHLESS_METHODS = ('add_copy_ref', 'delta')
+
+#: Methods which are safe to call again after temporary errors. Uploads are
+#: not retried here, as file object is already read by failed call, chunked
+#: uploads retry their chunks by themselves
+IDEMPOTENT_METHODS = ('account_info', 'delta', 'get_file',
+                      'get_file_and_metadata', 'media', 'metadata',
+                      'obtain_request_token', 'revisions', 'search', 'share',
+                      'thumbnail', 'thumbnail_and_metadata')
+
+#: Methods which create or replace files and folders, with position and name
+#: of their target path argument
+WRITE_METHODS = {'file_copy': (1, 'to_path'),
+                 'file_create_folder': (0, 'path'),
+                 'file_move': (1, 'to_path'),
+                 'put_file': (0, 'full_path'),
+                 'restore': (0, 'path')}
+
+#: Methods which change used quota of account
+QUOTA_METHODS = ('add_copy_ref', 'file_copy', 'file_delete', 'put_file',
+                 'restore')
+
+#: Methods which results are safe to share between concurrent callers with
+#: the same arguments
+COALESCED_METHODS = ('account_info', 'media', 'metadata', 'revisions',
+                     'search', 'share')
+
+
+class DropboxClientProxy(object):
+    """
+    Wrap ``DropboxClient`` instance and pass calls of its API methods through
+    ``call_api``. All other attributes are taken from wrapped client as is.
+    """
+    def __init__(self, client, extension):
+        self.client = client
+        self.extension = extension
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+
+        if name not in API_METHODS:
+            return attr
+
+        def method(*args, **kwargs):
+            path = args[0] if args else kwargs.get('path')
+
+            if not isinstance(path, basestring) or name in PATHLESS_METHODS:
+                path = None
+
+            single_flight = self.extension.single_flight
+
+            if single_flight is not None and name in COALESCED_METHODS:
+                return self._coalesced_call(single_flight, name, path, attr,
+                                            args, kwargs)
+
+            result = call_api(self.extension, name, path, attr, *args,
+                              **kwargs)
+
+            if name in WRITE_METHODS or name in QUOTA_METHODS:
+                self._forget_written(name, args, kwargs)
+
+            return result
+
+        method.__name__ = name
+        return method
+
+    def _coalesced_call(self, single_flight, name, path, func, args,
+                        kwargs):
+        """
+        Make API call or wait for identical call already in flight. Waiting
+        is counted in Dropbox API calls of current request as well, so call
+        budget and N+1 detection see the same calls as without coalescing.
+        """
+        extension = self.extension
+        calls = extension.request_calls
+        key = (self.client.session.token.key,
+               name,
+               args,
+               tuple(sorted(kwargs.items())))
+        called = []
+
+        def call():
+            called.append(True)
+            return call_api(extension, name, path, func, *args, **kwargs)
+
+        check_budget(extension, calls)
+        start = time.time()
+
+        try:
+            return single_flight.do(key, call)
+        finally:
+            if not called and calls is not None:
+                calls.add(name, time.time() - start)
+
+    def _forget_written(self, name, args, kwargs):
+        """
+        Target path of write method exists now and quota could be changed,
+        so remove them from not found paths and account info caches of
+        extension.
+        """
+        storage = self.extension.cache_storage
+        token_key = self.client.session.token.key
+
+        # Per request storage is not available outside of request
+        if isinstance(storage, ObjectCache) and not has_request_context():
+            return
+
+        if name in QUOTA_METHODS:
+            self.extension._forget_account_info(storage, token_key)
+
+        if name not in WRITE_METHODS:
+            return
+
+        index, arg = WRITE_METHODS[name]
+        target = args[index] if len(args) > index else kwargs.get(arg)
+
+        if isinstance(target, basestring):
+            self.extension._forget_missing(storage, token_key, [target])
+
+
+class SingleFlight(object):
+    """
+    Coalesce concurrent calls with the same key: while call is in flight,
+    other callers with the same key don't make their own calls, but wait
+    for its result or exception. Each caller gets its own deep copy of
+    shared result, so callers could modify results in place.
+    """
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._calls)
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Call ``func(*args, **kwargs)`` or wait for result of call with the
+        same ``key`` already in flight. Calls with unhashable keys are never
+        coalesced.
+        """
+        try:
+            hash(key)
+        except TypeError:
+            return func(*args, **kwargs)
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+
+            # Future of call and number of callers waiting for it
+            if leader:
+                call = self._calls[key] = [Future(), 0]
+            else:
+                call[1] += 1
+
+        future = call[0]
+
+        if not leader:
+            return copy.deepcopy(future.result())
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            future.set_exc_info(sys.exc_info())
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+        # Nobody else could get the result now, copy it only if shared
+        return copy.deepcopy(result) if call[1] else result
+
+
+def call_api(extension, method, path, func, *args, **kwargs):
+    """
+    Call ``func`` which makes request to Dropbox API ``method`` for ``path``
+    and record its duration. For file downloads duration is time to receive
+    response headers, not whole file content.
+
+    Call is also counted in Dropbox API calls of current request. If number
+    of calls already reached ``DROPBOX_MAX_CALLS_PER_REQUEST`` and
+    ``DROPBOX_MAX_CALLS_ACTION`` is ``'raise'``, ``CallBudgetExceeded`` is
+    raised instead of making the call.
+
+    Calls of idempotent methods failed with temporary errors are retried by
+    extension retry policy. While circuit breaker of extension is open, calls
+    fail with ``CircuitOpenError`` without touching Dropbox API.
+    """
+    calls = extension.request_calls
+    check_budget(extension, calls)
+
+    breaker = extension.circuit_breaker
+    policy = extension.retry_policy
+    attempt = 0
+
+    while True:
+        if breaker is not None:
+            breaker.before_call()
+
+        try:
+            result = _call(extension, calls, method, path, func, args, kwargs)
+        except Exception as err:
+            exc_info = sys.exc_info()
+            failed = policy.is_retryable(err)
+
+            if breaker is not None:
+                if failed:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+
+            delay = None
+
+            # Do not retry when circuit breaker just opened
+            if method in IDEMPOTENT_METHODS and \
+               (breaker is None or breaker.state == 'closed'):
+                delay = policy.delay(attempt, err)
+
+            if delay is None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+            time.sleep(delay)
+            attempt += 1
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            return result
+
+
+def check_budget(extension, calls):
+    """
+    Raise ``CallBudgetExceeded`` if request with ``calls`` already made
+    ``DROPBOX_MAX_CALLS_PER_REQUEST`` calls and ``DROPBOX_MAX_CALLS_ACTION``
+    is ``'raise'``.
+    """
+    limit = extension.DROPBOX_MAX_CALLS_PER_REQUEST
+
+    if calls is not None and limit and calls.count >= limit and \
+       extension.DROPBOX_MAX_CALLS_ACTION == 'raise':
+        raise CallBudgetExceeded(
+            'Request already made {0} Dropbox API calls, while only {1} '
+            'allowed: {2}'.format(calls.count, limit, calls.summary())
+        )
+
+
+def _call(extension, calls, method, path, func, args, kwargs):
+    """
+    Make single call to Dropbox API and record it.
+    """
+    result, status = None, None
+    start = time.time()
+
+    try:
+        result = func(*args, **kwargs)
+        status = getattr(result, 'status', None)
+        status = status if isinstance(status, int) else 200
+        return result
+    except ErrorResponse as err:
+        status = err.status
+        raise
+    finally:
+        duration = time.time() - start
+        error = status is None or status >= 400
+
+        extension.stats.add(method, duration, error)
+
+        if calls is not None:
+            calls.add(method, duration)
+
+        api_call.send(extension,
+                      method=method,
+                      path=path,
+                      status=status,
+                      bytes=get_transfer_bytes(method, args, result),
+                      duration=duration)
+
+
+def get_transfer_bytes(method, args, result):
+    """
+    Return number of file content bytes transferred by API call or ``None``
+    if call doesn't transfer file content.
+    """
+    if isinstance(result, tuple) and result:
+        result = result[0]
+
+    if hasattr(result, 'getheader'):
+        length = result.getheader('content-length')
+
+        if isinstance(length, basestring) and length.isdigit():
+            return int(length)
+        return None
+
+    if method == 'put_file' and isinstance(result, dict):
+        return result.get('bytes')
+
+    if method == 'upload_chunk' and len(args) > 1:
+        return args[1]
+
+    return None
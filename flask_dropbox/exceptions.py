@@ -0,0 +1,51 @@
+"""
+========================
+flask_dropbox.exceptions
+========================
+
+Exceptions raised by Flask-Dropbox.
+
+"""
+
+import math
+
+from werkzeug.exceptions import ServiceUnavailable
+
+
+__all__ = ('CallBudgetExceeded', 'CircuitOpenError')
+
+
+class CallBudgetExceeded(RuntimeError):
+    """
+    Raised when request tries to make more Dropbox API calls than allowed by
+    ``DROPBOX_MAX_CALLS_PER_REQUEST`` setting.
+    """
+
+
+class CircuitOpenError(ServiceUnavailable):
+    """
+    Raised instead of calling Dropbox API while it is degraded. If not
+    handled, results in ``503 Service Unavailable`` response with
+    ``Retry-After`` header.
+    """
+    description = ('Dropbox API is temporarily unavailable. Please, try '
+                   'again later.')
+
+    def __init__(self, retry_after=None):
+        super(CircuitOpenError, self).__init__()
+        self.retry_after = retry_after
+
+    def get_headers(self, environ=None):
+        headers = super(CircuitOpenError, self).get_headers(environ)
+
+        if self.retry_after:
+            headers.append(('Retry-After',
+                            str(int(math.ceil(self.retry_after)))))
+
+        return headers
+
+    def __str__(self):
+        return self.description
+
+    def __unicode__(self):
+        return unicode(self.description)
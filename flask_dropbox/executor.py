@@ -0,0 +1,165 @@
+"""
+======================
+flask_dropbox.executor
+======================
+
+Minimal bounded thread pool for running Dropbox calls in background.
+
+"""
+
+import sys
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+__all__ = ('Executor', 'Future')
+
+
+class Future(object):
+    """
+    Result of call submitted to executor.
+    """
+    def __init__(self):
+        self._callbacks = []
+        self._event = threading.Event()
+        self._exc_info = None
+        self._lock = threading.Lock()
+        self._result = None
+
+    def add_done_callback(self, func):
+        """
+        Call ``func`` with future instance when call is finished.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def done(self):
+        """
+        Check whether call is finished.
+        """
+        return self._event.is_set()
+
+    def exception(self, timeout=None):
+        """
+        Wait for call and return exception raised by it or ``None``.
+        """
+        self._wait(timeout)
+        return self._exc_info[1] if self._exc_info else None
+
+    def result(self, timeout=None):
+        """
+        Wait for call and return its result or reraise its exception.
+        """
+        self._wait(timeout)
+
+        if self._exc_info:
+            exc_type, exc_value, exc_tb = self._exc_info
+            raise exc_type, exc_value, exc_tb
+
+        return self._result
+
+    def set_exc_info(self, exc_info):
+        self._finish(None, exc_info)
+
+    def set_result(self, result):
+        self._finish(result, None)
+
+    def _finish(self, result, exc_info):
+        with self._lock:
+            self._result = result
+            self._exc_info = exc_info
+            self._event.set()
+
+            callbacks, self._callbacks = self._callbacks, []
+
+        for func in callbacks:
+            func(self)
+
+    def _wait(self, timeout):
+        if not self._event.wait(timeout) and not self._event.is_set():
+            raise RuntimeError('Timeout waiting for result.')
+
+
+class Executor(object):
+    """
+    Run calls in pool of at most ``max_workers`` daemon threads. Threads are
+    started on demand.
+    """
+    def __init__(self, max_workers):
+        assert max_workers > 0, 'Number of workers should be positive.'
+        self.max_workers = max_workers
+
+        self._idle = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._shutdown = False
+        self._threads = []
+
+    def map(self, func, *iterables):
+        """
+        Submit ``func`` for each set of arguments and return list of futures.
+        """
+        return [self.submit(func, *args) for args in zip(*iterables)]
+
+    def shutdown(self, wait=True):
+        """
+        Stop all worker threads after finishing already submitted calls.
+        """
+        with self._lock:
+            self._shutdown = True
+            threads = list(self._threads)
+
+        for _ in threads:
+            self._queue.put(None)
+
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Schedule ``func(*args, **kwargs)`` call and return its future.
+        """
+        future = Future()
+
+        with self._lock:
+            assert not self._shutdown, 'Executor is already shutdown.'
+
+            self._queue.put((future, func, args, kwargs))
+
+            # Start new worker only if idle ones couldn't take all calls
+            if self._queue.qsize() > self._idle and \
+               len(self._threads) < self.max_workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+        return future
+
+    def _work(self):
+        while True:
+            with self._lock:
+                self._idle += 1
+
+            item = self._queue.get()
+
+            with self._lock:
+                self._idle -= 1
+
+            if item is None:
+                return
+
+            future, func, args, kwargs = item
+
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception:
+                future.set_exc_info(sys.exc_info())
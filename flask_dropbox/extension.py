@@ -1,23 +1,80 @@
+import calendar
+import copy
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
 from dropbox.client import DropboxClient
+from dropbox.rest import ErrorResponse
 from dropbox.session import DropboxSession
-from flask import g, request, session as flask_session, url_for
+from flask import (current_app, g, has_request_context, request,
+                   session as flask_session, url_for)
+from werkzeug.http import parse_date
 from werkzeug.utils import cached_property, import_string
 
 from .blueprint import DropboxBlueprint
+from .cache import MemoryCache, ObjectCache, make_cache
+from .client import DropboxClientProxy, SingleFlight, call_api
 from .compat import OAuthToken
+from .executor import Executor
+from .futures import FutureClient
+from .index import MetadataIndex, normalize_path, parent_path
+from .pool import ClientPool
+from .retry import CircuitBreaker, RetryPolicy
 from .settings import (
-    ACCOUNT_INFO_CACHE_KEY, CLIENT_CACHE_KEY, DROPBOX_ACCESS_TOKEN_KEY,
-    DROPBOX_REQUEST_TOKEN_KEY, SESSION_CACHE_KEY
+    ACCOUNT_INFO_CACHE_KEY, ACCOUNT_INFO_TTL, CIRCUIT_BREAKER_THRESHOLD,
+    CIRCUIT_BREAKER_TIMEOUT, CLIENT_CACHE_KEY, CLIENT_POOL_SIZE,
+    CLIENT_POOL_TTL, DROPBOX_ACCESS_TOKEN_EXPIRES_KEY,
+    DROPBOX_ACCESS_TOKEN_KEY, DROPBOX_REQUEST_TOKEN_EXPIRES_KEY,
+    DROPBOX_REQUEST_TOKEN_KEY, FUTURES_WORKERS, INDEX_POOL_SIZE,
+    INDEX_SYNC_INTERVAL, LINK_CACHE_KEY, LINK_EXPIRES_MARGIN,
+    METADATA_CACHE_KEY, MISSING_CACHE_KEY, MISSING_TTL, REQUEST_CALLS_KEY,
+    REQUEST_TOKEN_TTL, RETRIES, RETRY_BACKOFF, RETRY_MAX_DELAY, SEARCH_LIMIT,
+    THUMBNAIL_CACHE_KEY, THUMBNAIL_CACHE_MAX_SIZE, TOKENS_CACHE_KEY,
+    UPLOAD_CACHE_KEY, UPLOAD_CHUNK_SIZE, UPLOAD_CONCURRENCY, UPLOAD_JOBS_SIZE,
+    UPLOAD_JOB_CACHE_KEY, UPLOAD_JOB_TTL, UPLOAD_QUEUE_PRUNE_INTERVAL,
+    UPLOAD_RETRIES, UPLOAD_STATE_TTL
 )
+from .stats import CallStats, RequestCalls
+from .thumbnails import ThumbnailCache
+from .tokens import make_token_store
+from .upload import ChunkedUpload, get_file_length, is_client_error
+from .utils import (dump_error_response, get_error_message,
+                    load_error_response, make_private_dir)
 
 
 __all__ = ('Dropbox', )
 
 
 DROPBOX_CONFIGS = ('*DROPBOX_KEY', '*DROPBOX_SECRET', '*DROPBOX_ACCESS_TYPE',
+                   'DROPBOX_ACCESS_TOKEN_TTL', 'DROPBOX_ACCOUNT_INFO_TTL',
+                   'DROPBOX_ARCHIVE_PREFETCH',
                    'DROPBOX_CALLBACK_TEMPLATE', 'DROPBOX_CALLBACK_URL',
+                   'DROPBOX_CIRCUIT_BREAKER_THRESHOLD',
+                   'DROPBOX_CIRCUIT_BREAKER_TIMEOUT', 'DROPBOX_COALESCE_CALLS',
+                   'DROPBOX_DOWNLOAD_CHUNK_SIZE', 'DROPBOX_FUTURES_WORKERS',
+                   'DROPBOX_INDEX_DIR', 'DROPBOX_INDEX_SYNC_INTERVAL',
                    'DROPBOX_LOGIN_REDIRECT', 'DROPBOX_LOGOUT_REDIRECT',
-                   'DROPBOX_CACHE_STORAGE')
+                   'DROPBOX_MAX_CALLS_ACTION', 'DROPBOX_MAX_CALLS_PER_REQUEST',
+                   'DROPBOX_METADATA_TTL', 'DROPBOX_MISSING_TTL',
+                   'DROPBOX_REQUEST_TOKEN_TTL',
+                   'DROPBOX_RETRIES', 'DROPBOX_RETRY_BACKOFF',
+                   'DROPBOX_RETRY_MAX_DELAY',
+                   'DROPBOX_THUMBNAIL_CACHE_DIR',
+                   'DROPBOX_THUMBNAIL_CACHE_MAX_SIZE',
+                   'DROPBOX_THUMBNAIL_MAX_AGE',
+                   'DROPBOX_TOKEN_STORE', 'DROPBOX_TOKEN_STORE_PATH',
+                   'DROPBOX_CACHE_STORAGE', 'DROPBOX_CACHE_DIR',
+                   'DROPBOX_CACHE_MAX_SIZE', 'DROPBOX_CACHE_TIMEOUT',
+                   'DROPBOX_CLIENT_POOL',
+                   'DROPBOX_CLIENT_POOL_SIZE', 'DROPBOX_CLIENT_POOL_TTL',
+                   'DROPBOX_DEBUG_STATS',
+                   'DROPBOX_UPLOAD_CHUNK_SIZE', 'DROPBOX_UPLOAD_CONCURRENCY',
+                   'DROPBOX_UPLOAD_QUEUE_DIR', 'DROPBOX_UPLOAD_QUEUE_WORKERS',
+                   'DROPBOX_UPLOAD_RETRIES')
 
 
 class Dropbox(object):
@@ -32,46 +89,378 @@ class Dropbox(object):
         if app:
             self.init_app(app)
 
+    @property
+    def access_token(self):
+        """
+        Access token of current Dropbox user or ``None`` if user is not logged
+        in.
+
+        When token store is enabled, access token expires in store after
+        ``DROPBOX_ACCESS_TOKEN_TTL`` seconds without use, so tokens of
+        abandoned sessions are pruned.
+        """
+        try:
+            token = self.get_token(DROPBOX_ACCESS_TOKEN_KEY)
+        except ValueError:
+            return None
+
+        if token is not None:
+            self._refresh_access_token()
+
+        return token
+
+    def _get_access_token_ttl(self):
+        """
+        Number of seconds to keep access token in token store, by default
+        lifetime of permanent Flask session. ``0`` means forever.
+        """
+        ttl = self.DROPBOX_ACCESS_TOKEN_TTL
+
+        if ttl is None:
+            ttl = int(current_app.permanent_session_lifetime.total_seconds())
+
+        return ttl
+
+    def _refresh_access_token(self):
+        """
+        Extend access token lifetime in token store once half of its TTL
+        passed, so tokens of active users don't expire, but store is written
+        rarely.
+        """
+        if self.token_store is None:
+            return
+
+        ttl = self._get_access_token_ttl()
+
+        if not ttl:
+            return
+
+        now = time.time()
+        expires = flask_session.get(DROPBOX_ACCESS_TOKEN_EXPIRES_KEY) or 0
+
+        if expires - now > ttl / 2.0:
+            return
+
+        self.token_store.touch(flask_session[DROPBOX_ACCESS_TOKEN_KEY], ttl)
+        flask_session[DROPBOX_ACCESS_TOKEN_EXPIRES_KEY] = now + ttl
+
     @property
     def account_info(self):
         """
         Shortcut to ``self.client.account_info()`` method.
 
-        Also stores result in instance cache to reduce network connections.
+        Also stores result in cache storage for ``DROPBOX_ACCOUNT_INFO_TTL``
+        seconds to reduce network connections. Cached info is removed after
+        uploading or deleting files through extension, call
+        ``invalidate_account_info`` to refresh it after other changes.
         """
-        if not hasattr(self.cache_storage, ACCOUNT_INFO_CACHE_KEY):
+        key = self.cache_key(ACCOUNT_INFO_CACHE_KEY)
+        account_info = self.cache_storage.get(key)
+
+        if account_info is None:
+            ttl = self.DROPBOX_ACCOUNT_INFO_TTL
             account_info = self.client.account_info()
-            setattr(self.cache_storage, ACCOUNT_INFO_CACHE_KEY, account_info)
-        return getattr(self.cache_storage, ACCOUNT_INFO_CACHE_KEY)
+            self.cache_storage.set(key,
+                                   account_info,
+                                   ACCOUNT_INFO_TTL if ttl is None else ttl)
+
+        return account_info
+
+    @property
+    def authorize_url(self):
+        """
+        Generate Dropbox authorization URL for current request token.
+        """
+        host_url = request.host_url
+        callback_url = self.DROPBOX_CALLBACK_URL or url_for('dropbox.callback')
+
+        if not callback_url.startswith(host_url):
+            callback_url = '%s%s' % (host_url.rstrip('/'), callback_url)
+
+        return self.session.build_authorize_url(self.request_token,
+                                                oauth_callback=callback_url)
+
+    def bind_session(self, token=None):
+        """
+        Return copy of shared ``DropboxSession`` instance bound to given
+        access ``token``.
+
+        Shared session is never modified, so it is safe to use it from any
+        thread, while copying it is much cheaper than building new session.
+        """
+        session = copy.copy(self.session)
+        session.token = token
+        session.request_token = None
+        return session
+
+    def cache_key(self, name, *args):
+        """
+        Build cache key for ``name`` scoped to current Dropbox user, so values
+        of different users never mix in shared cache storages. Extra ``args``
+        (e.g. Dropbox path) are hashed to key as well.
+        """
+        parts = list(args)
+
+        if has_request_context():
+            token = self.access_token
+
+            if token is not None:
+                parts.insert(0, token.key)
+
+        return self._make_key(name, parts)
+
+    def _make_key(self, name, parts):
+        """
+        Build cache key for ``name`` from hash of ``parts``.
+        """
+        if not parts:
+            return name
+
+        data = '\0'.join([part.encode('utf-8')
+                          if isinstance(part, unicode)
+                          else str(part) for part in parts])
+        return '{0}:{1}'.format(name, hashlib.sha1(data).hexdigest())
 
     @cached_property
     def cache_storage(self):
         """
         Cache storage. For versions 0.2 this storage was self, for later
         versions it should be configurable, but ``flask.g`` by default.
+
+        From 0.4 cache storage is always cache backend instance, see
+        ``flask_dropbox.cache`` module for available backends.
         """
-        if self.DROPBOX_CACHE_STORAGE:
-            if self.DROPBOX_CACHE_STORAGE == 'self':
-                return self
-            return (import_string(self.DROPBOX_CACHE_STORAGE)
-                    if isinstance(self.DROPBOX_CACHE_STORAGE, basestring)
-                    else self.DROPBOX_CACHE_STORAGE)
-        return g
+        storage = self.DROPBOX_CACHE_STORAGE
+
+        if not storage:
+            return ObjectCache(g)
+
+        if isinstance(storage, basestring) and \
+           storage not in ('filesystem', 'memory', 'self'):
+            storage = import_string(storage)
+
+        return make_cache(storage,
+                          self,
+                          cache_dir=self.DROPBOX_CACHE_DIR,
+                          max_size=self.DROPBOX_CACHE_MAX_SIZE,
+                          default_timeout=self.DROPBOX_CACHE_TIMEOUT)
 
     @property
     def client(self):
         """
         Initialize Dropbox client instance or return it from instance cache.
         """
-        if not hasattr(self.cache_storage, CLIENT_CACHE_KEY):
-            assert self.is_authenticated, 'Please, login with Dropbox first.'
+        client_key = self.cache_key(CLIENT_CACHE_KEY)
+        client = self.objects_storage.get(client_key)
+
+        if client is None:
+            token = self.access_token
+            assert token is not None, 'Please, login with Dropbox first.'
+
+            key, secret = token.key, token.secret
+
+            if self.client_pool is not None:
+                client = self.client_pool.get(
+                    (key, secret), lambda: self._create_client(key, secret)
+                )
+            else:
+                client = self._create_client(key, secret)
+
+            self.objects_storage.set(client_key, client)
+
+        return client
+
+    def _create_client(self, key, secret):
+        """
+        Create new Dropbox client with its own session bound to given access
+        token. Client is wrapped with proxy which records all API calls.
+        """
+        client = DropboxClient(self.bind_session(OAuthToken(key, secret)))
+        return DropboxClientProxy(client, self)
+
+    def delete_token(self, name):
+        """
+        Remove token stored under ``name`` key of Flask session, and from
+        token store if it is enabled.
+        """
+        value = flask_session.pop(name, None)
+
+        if self.token_store is not None and isinstance(value, basestring):
+            self.token_store.delete(value)
+            getattr(g, TOKENS_CACHE_KEY, {}).pop(value, None)
+
+    def enqueue_upload(self, file_obj, path, overwrite=False):
+        """
+        Upload file to Dropbox in background and return id of upload job.
+
+        File content is copied to ``DROPBOX_UPLOAD_QUEUE_DIR`` first, so
+        ``file_obj`` could be closed right after the call, then the file is
+        uploaded by pool of ``DROPBOX_UPLOAD_QUEUE_WORKERS`` threads. Use
+        ``upload_job`` method or ``dropbox.upload_status`` view to check job
+        progress and result.
+
+        Job state is kept in cache storage for ``UPLOAD_JOB_TTL`` seconds, so
+        with storage shared by several processes (e.g. ``'filesystem'`` or
+        memcached) it could be checked by any of them, while the file is
+        uploaded by the process which accepted it. With per request storage
+        jobs are kept in memory of current process.
+        """
+        client = self.client
+        token = self.access_token
+
+        dirname = self.DROPBOX_UPLOAD_QUEUE_DIR or \
+            os.path.join(tempfile.gettempdir(), 'flask_dropbox_uploads')
+
+        make_private_dir(dirname)
+        self._prune_upload_queue(dirname)
+
+        fd, filename = tempfile.mkstemp(suffix='.upload', dir=dirname)
+
+        try:
+            with os.fdopen(fd, 'wb') as handler:
+                shutil.copyfileobj(file_obj, handler)
+        except Exception:
+            os.remove(filename)
+            raise
+
+        length = os.path.getsize(filename)
+        job = {'bytes': length,
+               'error': None,
+               'id': uuid.uuid4().hex,
+               'metadata': None,
+               'path': path,
+               'status': 'queued',
+               'uploaded': 0}
+
+        jobs_storage = self.upload_jobs_storage.bind()
+        self._save_upload_job(jobs_storage, token.key, job)
+
+        self.upload_executor.submit(
+            self._run_upload_job,
+            client,
+            self.cache_storage.bind(),
+            jobs_storage,
+            job,
+            filename,
+            overwrite
+        )
+
+        return job['id']
+
+    def _prune_upload_queue(self, dirname):
+        """
+        Remove files spooled more than ``UPLOAD_JOB_TTL`` seconds ago, e.g.
+        left by jobs of restarted process. Directory is listed at most once in
+        ``UPLOAD_QUEUE_PRUNE_INTERVAL`` seconds.
+        """
+        now = time.time()
+
+        if self._upload_queue_pruned + UPLOAD_QUEUE_PRUNE_INTERVAL > now:
+            return
+
+        self._upload_queue_pruned = now
+        expires = now - UPLOAD_JOB_TTL
 
-            key, secret = flask_session[DROPBOX_ACCESS_TOKEN_KEY]
-            self.session.set_token(key, secret)
-            client = DropboxClient(self.session)
+        for filename in os.listdir(dirname):
+            filename = os.path.join(dirname, filename)
+
+            try:
+                if filename.endswith('.upload') and \
+                   os.path.getmtime(filename) < expires:
+                    os.remove(filename)
+            except OSError:
+                pass
+
+    @property
+    def futures(self):
+        """
+        Non-blocking facade for Dropbox client of current user, see
+        ``flask_dropbox.futures.FutureClient``.
 
-            setattr(self.cache_storage, CLIENT_CACHE_KEY, client)
-        return getattr(self.cache_storage, CLIENT_CACHE_KEY)
+        Its methods return futures instead of waiting for Dropbox API
+        responses. Calls are run in process-wide pool of
+        ``DROPBOX_FUTURES_WORKERS`` threads.
+        """
+        client = self.client if self.is_authenticated else None
+        return FutureClient(self, client, self.executor)
+
+    def get_token(self, name):
+        """
+        Return token stored under ``name`` key of Flask session, like
+        ``DROPBOX_ACCESS_TOKEN_KEY`` or ``DROPBOX_REQUEST_TOKEN_KEY``, or
+        ``None`` if there is no such token. Raise ``ValueError`` if stored
+        value is broken.
+
+        When token store is enabled, session contains only token id and the
+        token is fetched from store once per request.
+        """
+        value = flask_session.get(name)
+
+        if value is None:
+            return None
+
+        if self.token_store is not None:
+            if not isinstance(value, basestring):
+                raise ValueError('Broken token id: {0!r}'.format(value))
+
+            cache = getattr(g, TOKENS_CACHE_KEY, None)
+
+            if cache is None:
+                cache = {}
+                setattr(g, TOKENS_CACHE_KEY, cache)
+
+            if value not in cache:
+                cache[value] = self.token_store.get(value)
+
+            value = cache[value]
+
+            if value is None:
+                return None
+
+        try:
+            key, secret = value
+        except (TypeError, ValueError):
+            raise ValueError('Broken token: {0!r}'.format(value))
+
+        return OAuthToken(key, secret)
+
+    @property
+    def index(self):
+        """
+        Local metadata index of current user's Dropbox, see
+        ``flask_dropbox.index.MetadataIndex``.
+
+        Index is stored in SQLite database in ``DROPBOX_INDEX_DIR`` per access
+        token. It is built by first access, which could take a while for large
+        Dropbox, and then updated through delta API at most once in
+        ``DROPBOX_INDEX_SYNC_INTERVAL`` seconds.
+        """
+        token = self.access_token
+        assert token is not None, 'Please, login with Dropbox first.'
+
+        dirname = self.DROPBOX_INDEX_DIR or \
+            os.path.join(tempfile.gettempdir(), 'flask_dropbox_index')
+        digest = hashlib.sha1('\0'.join((token.key, token.secret)))
+        filename = os.path.join(dirname, digest.hexdigest() + '.db')
+
+        index = self.indexes.get(filename)
+
+        if index is None:
+            make_private_dir(dirname)
+            index = MetadataIndex(filename)
+            self.indexes.set(filename, index)
+
+        interval = self.DROPBOX_INDEX_SYNC_INTERVAL
+        interval = INDEX_SYNC_INTERVAL if interval is None else interval
+        synced = index.synced
+
+        if synced is None or synced + interval <= time.time():
+            changes = index.sync(self.client)
+
+            if changes:
+                self._forget_missing(self.cache_storage, token.key, changes)
+
+        return index
 
     def init_app(self, app):
         """
@@ -89,6 +478,109 @@ class Dropbox(object):
 
             setattr(self, real_name, value)
 
+        # Setup server-side token store if enabled
+        store = self.DROPBOX_TOKEN_STORE
+        self.token_store = None
+
+        if store:
+            if isinstance(store, basestring) and \
+               store not in ('filesystem', 'memory', 'sqlite'):
+                store = import_string(store)
+
+            self.token_store = \
+                make_token_store(store, self.DROPBOX_TOKEN_STORE_PATH)
+
+        # Shared Dropbox session is initialized on first access
+        self._session = None
+
+        # Setup process-wide client pool if enabled
+        self.client_pool = None
+
+        if self.DROPBOX_CLIENT_POOL:
+            ttl = self.DROPBOX_CLIENT_POOL_TTL
+
+            self.client_pool = ClientPool(
+                self.DROPBOX_CLIENT_POOL_SIZE or CLIENT_POOL_SIZE,
+                CLIENT_POOL_TTL if ttl is None else ttl
+            )
+
+        # Setup retry policy and process-wide circuit breaker
+        retries = self.DROPBOX_RETRIES
+        threshold = self.DROPBOX_CIRCUIT_BREAKER_THRESHOLD
+
+        self.retry_policy = RetryPolicy(
+            RETRIES if retries is None else retries,
+            self.DROPBOX_RETRY_BACKOFF or RETRY_BACKOFF,
+            self.DROPBOX_RETRY_MAX_DELAY or RETRY_MAX_DELAY
+        )
+        self.circuit_breaker = None
+
+        if threshold is None or threshold:
+            self.circuit_breaker = CircuitBreaker(
+                threshold or CIRCUIT_BREAKER_THRESHOLD,
+                self.DROPBOX_CIRCUIT_BREAKER_TIMEOUT or CIRCUIT_BREAKER_TIMEOUT
+            )
+
+        # Coalesce identical concurrent Dropbox API calls if enabled
+        coalesce = self.DROPBOX_COALESCE_CALLS
+        self.single_flight = \
+            SingleFlight() if coalesce is None or coalesce else None
+
+        # Process-wide thread pool for non-blocking Dropbox API calls
+        self.executor = Executor(
+            self.DROPBOX_FUTURES_WORKERS or FUTURES_WORKERS
+        )
+
+        # Thread pool and jobs of background uploads
+        self.upload_executor = Executor(
+            self.DROPBOX_UPLOAD_QUEUE_WORKERS or UPLOAD_CONCURRENCY
+        )
+        self.upload_jobs = MemoryCache(UPLOAD_JOBS_SIZE, UPLOAD_JOB_TTL)
+        self._upload_queue_pruned = 0
+
+        # Open metadata indexes of recently active users
+        self.indexes = MemoryCache(INDEX_POOL_SIZE)
+
+        # Setup on-disk thumbnails cache
+        max_size = self.DROPBOX_THUMBNAIL_CACHE_MAX_SIZE
+
+        self.thumbnail_cache = ThumbnailCache(
+            self.DROPBOX_THUMBNAIL_CACHE_DIR or
+            os.path.join(tempfile.gettempdir(), 'flask_dropbox_thumbnails'),
+            THUMBNAIL_CACHE_MAX_SIZE if max_size is None else max_size
+        )
+
+        # Latency histograms of Dropbox API calls
+        self.stats = CallStats()
+
+        # Count Dropbox API calls made while processing each request
+        @app.before_request
+        def start_request_calls():
+            setattr(g, REQUEST_CALLS_KEY, RequestCalls())
+
+        @app.after_request
+        def finish_request_calls(response):
+            calls = self.request_calls
+
+            if calls is None:
+                return response
+
+            limit = self.DROPBOX_MAX_CALLS_PER_REQUEST
+
+            if limit and calls.count > limit:
+                app.logger.warning(
+                    '%s %s made %d Dropbox API calls, while only %d allowed: '
+                    '%s', request.method, request.path, calls.count, limit,
+                    calls.summary()
+                )
+
+            if app.debug or self.DROPBOX_DEBUG_STATS:
+                response.headers['X-Dropbox-Calls'] = str(calls.count)
+                response.headers['X-Dropbox-Time'] = \
+                    '{0:.0f}'.format(calls.duration * 1000)
+
+            return response
+
         # Register context processor
         @app.context_processor
         def inject_dropbox():
@@ -98,51 +590,83 @@ class Dropbox(object):
         app.extensions['dropbox'] = self
         self.app = app
 
+    def invalidate_account_info(self):
+        """
+        Remove cached account info of current user, so it would be fetched
+        from Dropbox API on next access. Useful after uploading or deleting
+        files, when quota info changes.
+        """
+        self.cache_storage.delete(self.cache_key(ACCOUNT_INFO_CACHE_KEY))
+
+    def _forget_account_info(self, storage, token_key):
+        """
+        Remove cached account info of user with ``token_key`` from
+        ``storage``. Unlike ``invalidate_account_info`` doesn't need request
+        context, so could be called from background threads.
+        """
+        storage.delete(self._make_key(ACCOUNT_INFO_CACHE_KEY, [token_key]))
+
     @property
     def is_authenticated(self):
         """
         Check if current user logged in with Dropbox or not.
         """
-        return DROPBOX_ACCESS_TOKEN_KEY in flask_session
+        return self.access_token is not None
 
     def login(self, request_token):
         """
         Grant access for Dropbox user to the site.
+
+        Request token could be exchanged only once, so concurrent logins with
+        the same request token (e.g. double-submitted callback) share one
+        exchange call.
         """
         # Generate access token for current user
-        access_token = self.session.obtain_access_token(request_token)
-        flask_session[DROPBOX_ACCESS_TOKEN_KEY] = [access_token.key,
-                                                   access_token.secret]
+        args = (self,
+                'obtain_access_token',
+                None,
+                self.bind_session().obtain_access_token,
+                request_token)
+
+        if self.single_flight is not None:
+            key = ('obtain_access_token', request_token.key)
+            access_token = self.single_flight.do(key, call_api, *args)
+        else:
+            access_token = call_api(*args)
+
+        ttl = self._get_access_token_ttl()
+        self.set_token(DROPBOX_ACCESS_TOKEN_KEY, access_token, ttl)
+        flask_session[DROPBOX_ACCESS_TOKEN_EXPIRES_KEY] = time.time() + ttl
 
         # Remove available request token
-        del flask_session[DROPBOX_REQUEST_TOKEN_KEY]
+        self.delete_token(DROPBOX_REQUEST_TOKEN_KEY)
+        flask_session.pop(DROPBOX_REQUEST_TOKEN_EXPIRES_KEY, None)
 
     @property
     def login_url(self):
         """
         Generate "Login with Dropbox" URL.
-        """
-        host_url = request.host_url
-        callback_url = self.DROPBOX_CALLBACK_URL or url_for('dropbox.callback')
-
-        if not callback_url.startswith(host_url):
-            callback_url = '%s%s' % (host_url.rstrip('/'), callback_url)
 
-        return self.session.build_authorize_url(self.request_token,
-                                                oauth_callback=callback_url)
+        .. versionchanged:: 0.4
+           URL points to ``dropbox.login`` view, which redirects user to
+           ``authorize_url``, so rendering the link doesn't make any requests
+           to Dropbox API.
+        """
+        return url_for('dropbox.login')
 
     def logout(self):
         """
         Revoke access for Dropbox user to the site.
         """
-        if hasattr(self.cache_storage, ACCOUNT_INFO_CACHE_KEY):
-            delattr(self.cache_storage, ACCOUNT_INFO_CACHE_KEY)
-        if hasattr(self.cache_storage, CLIENT_CACHE_KEY):
-            delattr(self.cache_storage, CLIENT_CACHE_KEY)
-        if hasattr(self.cache_storage, SESSION_CACHE_KEY):
-            delattr(self.cache_storage, SESSION_CACHE_KEY)
-        if DROPBOX_ACCESS_TOKEN_KEY in flask_session:
-            del flask_session[DROPBOX_ACCESS_TOKEN_KEY]
+        self.invalidate_account_info()
+        self.objects_storage.delete(self.cache_key(CLIENT_CACHE_KEY))
+
+        token = self.access_token
+        self.delete_token(DROPBOX_ACCESS_TOKEN_KEY)
+        flask_session.pop(DROPBOX_ACCESS_TOKEN_EXPIRES_KEY, None)
+
+        if token is not None and self.client_pool is not None:
+            self.client_pool.remove((token.key, token.secret))
 
     @property
     def logout_url(self):
@@ -151,6 +675,126 @@ class Dropbox(object):
         """
         return url_for('dropbox.logout')
 
+    def media_url(self, path):
+        """
+        Return direct URL to stream media file at ``path``, see
+        ``DropboxClient.media``.
+
+        URL is stored in cache storage until shortly before it expires, so
+        repeated calls for the same file don't make requests to Dropbox API.
+        """
+        return self._get_link('media', path)
+
+    def _get_link(self, method, path):
+        """
+        Return URL of ``method`` (``'media'`` or ``'share'``) link to
+        ``path`` from cache storage or request it from Dropbox API and cache
+        it until ``LINK_EXPIRES_MARGIN`` seconds before it expires.
+        """
+        key = self.cache_key(LINK_CACHE_KEY, method, path.lower())
+        url = self.cache_storage.get(key)
+
+        if url is not None:
+            return url
+
+        data = getattr(self.client, method)(path)
+        expires = parse_date(data.get('expires'))
+
+        if expires is not None:
+            timeout = calendar.timegm(expires.utctimetuple()) - \
+                time.time() - LINK_EXPIRES_MARGIN
+
+            if timeout >= 1:
+                self.cache_storage.set(key, data['url'], int(timeout))
+
+        return data['url']
+
+    def metadata(self, path, list=True):
+        """
+        Shortcut to ``self.client.metadata()`` method.
+
+        Stores listing in cache storage for ``DROPBOX_METADATA_TTL`` seconds.
+        Cached listing is revalidated by sending its ``hash`` to Dropbox API,
+        so not modified folder costs only empty response.
+        """
+        key = self.cache_key(METADATA_CACHE_KEY, path.lower(), list)
+        cached = self.cache_storage.get(key)
+
+        ttl = self.DROPBOX_MISSING_TTL
+        ttl = MISSING_TTL if ttl is None else ttl
+        token = self.access_token
+        missing_key = None
+
+        # Path was not found recently
+        if ttl and token is not None:
+            missing_key = self._missing_key(token.key, path)
+            error = self.cache_storage.get(missing_key)
+
+            if error is not None:
+                raise load_error_response(error)
+
+        try:
+            if cached is not None and cached.get('hash'):
+                try:
+                    data = self.client.metadata(path,
+                                                list,
+                                                hash=cached['hash'])
+                except ErrorResponse as err:
+                    if err.status != 304:
+                        raise
+                    return cached
+            else:
+                data = self.client.metadata(path, list)
+        except ErrorResponse as err:
+            if err.status == 404 and missing_key is not None:
+                self.cache_storage.set(missing_key,
+                                       dump_error_response(err),
+                                       ttl)
+            raise
+
+        self.cache_storage.set(key, data, self.DROPBOX_METADATA_TTL)
+        return data
+
+    def _missing_key(self, token_key, path):
+        """
+        Build key of not found ``path`` in cache storage. Unlike
+        ``cache_key`` doesn't need request context, so paths could be
+        forgotten from background threads.
+        """
+        return self._make_key(MISSING_CACHE_KEY,
+                              [token_key, normalize_path(path)])
+
+    def _forget_missing(self, storage, token_key, paths):
+        """
+        Remove ``paths`` and all their parent folders from not found paths
+        cache, as they exist now.
+        """
+        keys = set()
+
+        for path in paths:
+            path = normalize_path(path)
+
+            while True:
+                keys.add(self._missing_key(token_key, path))
+
+                if path == '/':
+                    break
+
+                path = parent_path(path)
+
+        storage.delete_many(*keys)
+
+    @property
+    def objects_storage(self):
+        """
+        Storage for live objects, like Dropbox client instances.
+        Same as ``cache_storage`` when it keeps values in current process,
+        otherwise ``flask.g``.
+        """
+        if self.cache_storage.local:
+            return self.cache_storage
+        return ObjectCache(g)
+
     def register_blueprint(self, *args, **kwargs):
         """
         Initialize and register dropbox blueprint for current application.
@@ -158,38 +802,340 @@ class Dropbox(object):
         blueprint = DropboxBlueprint()
         self.app.register_blueprint(blueprint, *args, **kwargs)
 
+    @property
+    def request_calls(self):
+        """
+        Dropbox API calls made while processing current request, as
+        ``flask_dropbox.stats.RequestCalls`` instance. ``None`` outside of
+        request context or background threads.
+        """
+        if not has_request_context():
+            return None
+        return getattr(g, REQUEST_CALLS_KEY, None)
+
     @property
     def request_token(self):
         """
         Generate Dropbox session request token and place it to Flask session.
+
+        Token is reused for ``DROPBOX_REQUEST_TOKEN_TTL`` seconds, so several
+        accesses don't make several requests to Dropbox API and don't
+        invalidate already generated authorization URLs.
         """
-        request_token = self.session.obtain_request_token()
-        flask_session[DROPBOX_REQUEST_TOKEN_KEY] = [request_token.key,
-                                                    request_token.secret]
+        try:
+            token = self.get_token(DROPBOX_REQUEST_TOKEN_KEY)
+        except ValueError:
+            token = None
+
+        expires = flask_session.get(DROPBOX_REQUEST_TOKEN_EXPIRES_KEY) or 0
+
+        if token is not None and expires > time.time():
+            return token
+
+        request_token = call_api(self,
+                                 'obtain_request_token',
+                                 None,
+                                 self.bind_session().obtain_request_token)
+        ttl = self.DROPBOX_REQUEST_TOKEN_TTL or REQUEST_TOKEN_TTL
+
+        self.set_token(DROPBOX_REQUEST_TOKEN_KEY, request_token, ttl)
+        flask_session[DROPBOX_REQUEST_TOKEN_EXPIRES_KEY] = time.time() + ttl
+
         return request_token
 
+    def search(self, query, path='/', limit=SEARCH_LIMIT):
+        """
+        Search current user's files and folders by name or path.
+
+        Search is served by local metadata index, see ``Dropbox.index``, so
+        it doesn't make any requests to Dropbox API except index sync. Returns
+        list of metadata of matched entries, best matches first.
+        """
+        return self.index.search(query, path, limit)
+
     @property
     def session(self):
         """
         Initialize or return already initialized ``DropboxSession`` instance.
+
+        .. versionchanged:: 0.4
+           Session is shared by all requests and is never bound to any token,
+           use ``bind_session`` to get session for current user.
+        """
+        if self._session is None:
+            self._session = DropboxSession(self.DROPBOX_KEY,
+                                           self.DROPBOX_SECRET,
+                                           self.DROPBOX_ACCESS_TYPE)
+        return self._session
+
+    def share_url(self, path):
+        """
+        Return shareable link to file or folder at ``path``, see
+        ``DropboxClient.share``.
+
+        Like ``media_url``, link is stored in cache storage until shortly
+        before it expires.
+        """
+        return self._get_link('share', path)
+
+    def set_token(self, name, token, ttl=None):
+        """
+        Store ``token`` under ``name`` key of Flask session. When token store
+        is enabled, token is saved to store for ``ttl`` seconds (``None``
+        means forever) and session gets only its id.
+        """
+        if self.token_store is None:
+            flask_session[name] = [token.key, token.secret]
+            return
+
+        self.delete_token(name)
+        flask_session[name] = \
+            self.token_store.add(token.key, token.secret, ttl)
+
+    def thumbnail(self, path, rev, size='m', format='JPEG'):
+        """
+        Return ``(content, rev)`` pair for thumbnail of image at ``path``.
+
+        Thumbnails are stored in on-disk cache by path, ``rev``, size and
+        format, so only first request of each image revision makes request
+        to Dropbox API. Returned ``rev`` is revision of thumbnailed file, it
+        differs from given one when file was changed since.
+        """
+        key = self.cache_key(THUMBNAIL_CACHE_KEY, path.lower(), rev, size,
+                             format)
+        data = self.thumbnail_cache.get(key)
+
+        if data is not None:
+            return data, rev
+
+        response, metadata = \
+            self.client.thumbnail_and_metadata(path, size, format)
+
+        try:
+            data = response.read()
+        finally:
+            response.close()
+
+        rev = metadata.get('rev') or rev
+        key = self.cache_key(THUMBNAIL_CACHE_KEY, path.lower(), rev, size,
+                             format)
+        self.thumbnail_cache.set(key, data)
+
+        return data, rev
+
+    def upload(self, file_obj, path, overwrite=False, parent_rev=None):
+        """
+        Upload file to Dropbox and return its metadata.
+
+        Files larger than ``DROPBOX_UPLOAD_CHUNK_SIZE`` are uploaded in chunks,
+        so only one chunk is kept in memory. Upload id, offset and digest of
+        acknowledged chunks are stored in cache storage, so broken upload of
+        the same file to the same path would be resumed from last of them.
+        """
+        client = self.client
+        length = get_file_length(file_obj)
+
+        return self._upload(client,
+                            self.cache_storage,
+                            file_obj,
+                            length,
+                            path,
+                            overwrite,
+                            parent_rev)
+
+    def upload_job(self, job_id):
+        """
+        Return state of background upload job started by ``enqueue_upload``
+        or ``None`` if there is no such job for current user.
+
+        State is dict with job ``id``, Dropbox ``path``, file size in
+        ``bytes``, number of ``uploaded`` bytes, ``status`` (``'queued'``,
+        ``'uploading'``, ``'done'`` or ``'failed'``), file ``metadata`` on
+        success and ``error`` message on failure.
+        """
+        item = self.upload_jobs_storage.get(
+            self._make_key(UPLOAD_JOB_CACHE_KEY, [job_id])
+        )
+        token = self.access_token
+
+        if item is None or token is None or item[0] != token.key:
+            return None
+
+        return dict(item[1])
+
+    @property
+    def upload_jobs_storage(self):
+        """
+        Storage of background upload jobs. Same as ``cache_storage`` when it
+        is shared between requests, otherwise in-memory cache of current
+        process.
+        """
+        if isinstance(self.cache_storage, ObjectCache):
+            return self.upload_jobs
+        return self.cache_storage
+
+    def upload_many(self, files, concurrency=None, overwrite=False):
+        """
+        Upload multiple files to Dropbox in parallel.
+
+        ``files`` is list of ``(file_obj, path)`` pairs. Files are uploaded
+        in pool of ``concurrency`` threads (by default
+        ``DROPBOX_UPLOAD_CONCURRENCY``), so total time is close to time of
+        uploading the slowest file.
+
+        Returns list of ``(path, metadata, error)`` tuples in order of
+        ``files``, where ``error`` is exception raised while uploading file
+        or ``None`` on success.
+        """
+        client = self.client
+        storage = self.cache_storage.bind()
+        files = list(files)
+
+        executor = Executor(min(len(files) or 1,
+                                concurrency or
+                                self.DROPBOX_UPLOAD_CONCURRENCY or
+                                UPLOAD_CONCURRENCY))
+        futures = []
+
+        for file_obj, path in files:
+            futures.append(executor.submit(self._upload,
+                                           client,
+                                           storage,
+                                           file_obj,
+                                           get_file_length(file_obj),
+                                           path,
+                                           overwrite))
+
+        executor.shutdown(wait=False)
+        results = []
+
+        for (_, path), future in zip(files, futures):
+            error = future.exception()
+            metadata = future.result() if error is None else None
+            results.append((path, metadata, error))
+
+        return results
+
+    def _upload(self, client, storage, file_obj, length, path,
+                overwrite=False, parent_rev=None, callback=None):
+        """
+        Upload file with given client and cache storage, so could be called
+        outside of request context. ``callback`` is called with
+        ``ChunkedUpload`` instance after each acknowledged chunk.
+
+        State of chunked upload is stored by user, path, length and digest
+        of first chunk, so upload of other content to the same path never
+        resumes it.
+        """
+        chunk_size = self.DROPBOX_UPLOAD_CHUNK_SIZE or UPLOAD_CHUNK_SIZE
+
+        if length <= chunk_size:
+            file_obj.seek(0)
+            metadata = client.put_file(path, file_obj, overwrite, parent_rev)
+            self._forget_written(storage, client, path)
+            return metadata
+
+        def save_state(upload):
+            storage.set(state_key, upload.state, UPLOAD_STATE_TTL)
+
+            if callback is not None:
+                callback(upload)
+
+        file_obj.seek(0)
+        digest = hashlib.sha1(file_obj.read(chunk_size)).hexdigest()
+        state_key = self._make_key(UPLOAD_CACHE_KEY,
+                                   [client.session.token.key,
+                                    path.lower(),
+                                    length,
+                                    digest])
+
+        retries = self.DROPBOX_UPLOAD_RETRIES
+        state = storage.get(state_key) or {}
+
+        upload = ChunkedUpload(
+            client,
+            file_obj,
+            length,
+            chunk_size,
+            upload_id=state.get('upload_id'),
+            offset=state.get('offset', 0),
+            retries=UPLOAD_RETRIES if retries is None else retries,
+            callback=save_state,
+            digest=state.get('digest')
+        )
+
+        try:
+            upload.upload()
+            metadata = call_api(self,
+                                'commit_chunked_upload',
+                                path,
+                                upload.finish,
+                                path,
+                                overwrite,
+                                parent_rev)
+        except ErrorResponse as err:
+            # Upload id is expired or unknown, don't resume it anymore
+            if is_client_error(err):
+                storage.delete(state_key)
+            raise
+
+        storage.delete(state_key)
+        self._forget_written(storage, client, path)
+
+        return metadata
+
+    def _forget_written(self, storage, client, path):
+        """
+        Uploaded file exists now and quota of its owner changed, so remove
+        them from not found paths and account info caches.
+        """
+        token_key = client.session.token.key
+        self._forget_missing(storage, token_key, [path])
+        self._forget_account_info(storage, token_key)
+
+    def _run_upload_job(self, client, storage, jobs_storage, job, filename,
+                        overwrite=False):
+        """
+        Upload spooled file of background upload job, saving job state to
+        ``jobs_storage`` on each change. Spooled file is removed afterwards.
+        """
+        token_key = client.session.token.key
+
+        def progress(upload):
+            job['uploaded'] = upload.offset
+            self._save_upload_job(jobs_storage, token_key, job)
+
+        job['status'] = 'uploading'
+        self._save_upload_job(jobs_storage, token_key, job)
+
+        try:
+            with open(filename, 'rb') as file_obj:
+                metadata = self._upload(client,
+                                        storage,
+                                        file_obj,
+                                        job['bytes'],
+                                        job['path'],
+                                        overwrite,
+                                        callback=progress)
+        except Exception as err:
+            job.update(error=get_error_message(err), status='failed')
+        else:
+            job.update(metadata=metadata,
+                       status='done',
+                       uploaded=job['bytes'])
+        finally:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+        self._save_upload_job(jobs_storage, token_key, job)
+
+    def _save_upload_job(self, storage, token_key, job):
+        """
+        Store copy of background upload job state with key of its owner's
+        access token.
         """
-        if not hasattr(self.cache_storage, SESSION_CACHE_KEY):
-            session = DropboxSession(self.DROPBOX_KEY,
-                                     self.DROPBOX_SECRET,
-                                     self.DROPBOX_ACCESS_TYPE)
-            setattr(self.cache_storage, SESSION_CACHE_KEY, session)
-        return getattr(self.cache_storage, SESSION_CACHE_KEY)
-
-
-# Monkey-patch Dropbox SDK ``OAuthToken`` class to add support of pickling
-# tokens. Without this monkey-patch all tries to save any token in Flask
-# session will cause "TypeError: a class that defines __slots__ without
-# defining __getstate__ cannot be pickled"
-if hasattr(OAuthToken, '__slots__'):
-    OAuthToken.__getstate__ = \
-        lambda instance: dict([(key, getattr(instance, key))
-                               for key in instance.__slots__])
-    OAuthToken.__setstate__ = \
-        lambda instance, data: [setattr(instance, key, value)
-                                for key, value in data.iteritems()
-                                if key in instance.__slots__]
+        storage.set(self._make_key(UPLOAD_JOB_CACHE_KEY, [job['id']]),
+                    (token_key, dict(job)),
+                    UPLOAD_JOB_TTL)
@@ -0,0 +1,92 @@
+"""
+=====================
+flask_dropbox.futures
+=====================
+
+Non-blocking facade for Dropbox client. Calls are run in process-wide
+thread pool and return futures, so view could start many Dropbox API calls
+at once and wait only for the slowest one.
+
+"""
+
+from .client import call_api
+
+
+__all__ = ('FutureClient', 'gather')
+
+
+class FutureClient(object):
+    """
+    Submit Dropbox API calls of ``client`` to ``executor`` and return
+    ``flask_dropbox.executor.Future`` instances for them.
+
+    Calls are made outside of request context, so they are recorded in
+    extension stats, retried and guarded by circuit breaker as usual, but not
+    counted in calls of current request.
+    """
+    def __init__(self, extension, client, executor):
+        self.extension = extension
+        self.executor = executor
+        self._client = client
+
+    def account_info(self):
+        """
+        Fetch account info of current user.
+        """
+        return self.executor.submit(self.client.account_info)
+
+    @property
+    def client(self):
+        assert self._client is not None, 'Please, login with Dropbox first.'
+        return self._client
+
+    def get_file(self, path, rev=None):
+        """
+        Download whole file content. Future result is content string.
+        """
+        client = self.client
+
+        def download():
+            response = client.get_file(path, rev)
+
+            try:
+                return response.read()
+            finally:
+                response.close()
+
+        return self.executor.submit(download)
+
+    def metadata(self, path, list=True, **kwargs):
+        """
+        Fetch metadata of file or folder at ``path``.
+        """
+        return self.executor.submit(self.client.metadata, path, list,
+                                    **kwargs)
+
+    def obtain_access_token(self, request_token):
+        """
+        Exchange authorized request token to access token. Doesn't require
+        logged in user.
+        """
+        session = self.extension.bind_session()
+        return self.executor.submit(call_api,
+                                    self.extension,
+                                    'obtain_access_token',
+                                    None,
+                                    session.obtain_access_token,
+                                    request_token)
+
+    def put_file(self, path, file_obj, overwrite=False, parent_rev=None):
+        """
+        Upload file content to ``path`` in single request.
+        """
+        return self.executor.submit(self.client.put_file, path, file_obj,
+                                    overwrite, parent_rev)
+
+
+def gather(futures, timeout=None):
+    """
+    Wait for all ``futures`` and return list of their results in the same
+    order. First raised exception is reraised.
+    """
+    return [future.result(timeout) for future in futures]
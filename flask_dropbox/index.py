@@ -0,0 +1,321 @@
+"""
+===================
+flask_dropbox.index
+===================
+
+Local index of Dropbox tree kept in sync through delta API.
+
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+from .utils import make_private_file
+
+
+__all__ = ('MetadataIndex', 'normalize_path')
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent);
+CREATE TABLE IF NOT EXISTS state (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS trigrams (
+    trigram TEXT NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (trigram, path)
+);
+CREATE INDEX IF NOT EXISTS trigrams_path ON trigrams (path);
+"""
+
+#: Condition to select entry at path and all its descendants using primary
+#: key index. All descendant paths start with ``path + '/'`` and as ``'0'``
+#: follows ``'/'`` in ASCII, they are less than ``path + '0'``.
+SUBTREE = 'path = ? OR (path > ? AND path < ?)'
+
+
+class MetadataIndex(object):
+    """
+    Index of user's Dropbox tree stored in SQLite database at ``path``.
+
+    Index is built by first ``sync`` call and then updated incrementally with
+    delta API cursor. Lookups are served from local database without any
+    requests to Dropbox API. Paths are case-insensitive, as in Dropbox.
+    """
+    def __init__(self, path):
+        self.path = path
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+            # Index built before search support, fill trigrams for it
+            if conn.execute('SELECT 1 FROM entries LIMIT 1').fetchone() and \
+               not conn.execute('SELECT 1 FROM trigrams LIMIT 1').fetchone():
+                for (path, ) in conn.execute('SELECT path FROM entries'):
+                    self._add_trigrams(conn, path)
+
+    @property
+    def cursor(self):
+        """
+        Delta cursor of last sync or ``None`` if index wasn't synced yet.
+        """
+        return self._get_state('cursor')
+
+    def get(self, path):
+        """
+        Return metadata of file or folder at ``path`` or ``None`` if index
+        doesn't contain it.
+        """
+        path = normalize_path(path)
+
+        if path == '/':
+            return {'bytes': 0, 'is_dir': True, 'path': '/'}
+
+        row = self._connection().execute(
+            'SELECT metadata FROM entries WHERE path = ?', (path, )
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list(self, path='/'):
+        """
+        Return list of metadata of folder contents, ordered by path, or
+        ``None`` if there is no such folder.
+        """
+        path = normalize_path(path)
+        metadata = self.get(path)
+
+        if metadata is None or not metadata.get('is_dir'):
+            return None
+
+        rows = self._connection().execute(
+            'SELECT metadata FROM entries WHERE parent = ? ORDER BY path',
+            (path, )
+        )
+        return [json.loads(row[0]) for row in rows]
+
+    def search(self, query, path='/', limit=20):
+        """
+        Search files and folders by name or path within ``path`` folder.
+
+        Returns list of at most ``limit`` metadata of entries which path
+        contains ``query`` (case-insensitive), ranked by match quality: exact
+        name matches first, then name prefix matches, name matches and path
+        matches. Shorter paths win within same rank.
+
+        Queries of three and more chars are looked up in trigram index, so
+        only entries containing all trigrams of query are checked.
+        """
+        query = query.strip().lower()
+        path = normalize_path(path)
+
+        if not query:
+            return []
+
+        grams = trigrams(query)
+
+        if grams:
+            rows = self._connection().execute(
+                'SELECT path FROM trigrams WHERE trigram IN ({0}) '
+                'GROUP BY path HAVING COUNT(*) = ?'.
+                format(', '.join('?' * len(grams))),
+                list(grams) + [len(grams)]
+            )
+        else:
+            pattern = '%{0}%'.format(query.replace('\\', '\\\\').
+                                     replace('%', '\\%').
+                                     replace('_', '\\_'))
+            rows = self._connection().execute(
+                "SELECT path FROM entries WHERE path LIKE ? ESCAPE '\\'",
+                (pattern, )
+            )
+
+        prefix = path.rstrip('/') + '/'
+        ranked = []
+
+        for (found, ) in rows:
+            if not found.startswith(prefix) or query not in found:
+                continue
+
+            name = found.rsplit('/', 1)[1]
+
+            if name == query:
+                rank = 0
+            elif name.startswith(query):
+                rank = 1
+            elif query in name:
+                rank = 2
+            else:
+                rank = 3
+
+            ranked.append((rank, len(found), found))
+
+        ranked.sort()
+        return [self.get(found) for _, _, found in ranked[:limit]]
+
+    def size(self, path='/'):
+        """
+        Return total size in bytes of all files in folder at ``path`` and its
+        subfolders, or size of file if ``path`` points to file.
+        """
+        path = normalize_path(path)
+
+        if path == '/':
+            query, params = 'SELECT SUM(bytes) FROM entries', ()
+        else:
+            query = 'SELECT SUM(bytes) FROM entries WHERE ' + SUBTREE
+            params = subtree_params(path)
+
+        return self._connection().execute(query, params).fetchone()[0] or 0
+
+    def sync(self, client):
+        """
+        Fetch all changes since last sync with ``client.delta`` and apply them
+        to index. Returns list of changed paths.
+        """
+        changes = []
+
+        with self._lock:
+            cursor = self.cursor
+
+            while True:
+                result = client.delta(cursor)
+                cursor = result['cursor']
+
+                with self._connection() as conn:
+                    if result.get('reset'):
+                        conn.execute('DELETE FROM entries')
+                        conn.execute('DELETE FROM trigrams')
+                        changes.append('/')
+
+                    for path, metadata in result['entries']:
+                        changes.append(self._apply(conn, path, metadata))
+
+                    self._set_state(conn, 'cursor', cursor)
+
+                if not result.get('has_more'):
+                    break
+
+            with self._connection() as conn:
+                self._set_state(conn, 'synced', repr(time.time()))
+
+        return changes
+
+    @property
+    def synced(self):
+        """
+        Timestamp of last sync or ``None`` if index wasn't synced yet.
+        """
+        value = self._get_state('synced')
+        return float(value) if value is not None else None
+
+    def _apply(self, conn, path, metadata):
+        """
+        Apply single delta entry and return its normalized path.
+        """
+        path = normalize_path(path)
+
+        # Deleted entry or file which replaced folder, drop whole subtree
+        if metadata is None or not metadata.get('is_dir'):
+            conn.execute('DELETE FROM entries WHERE ' + SUBTREE,
+                         subtree_params(path))
+            conn.execute('DELETE FROM trigrams WHERE ' + SUBTREE,
+                         subtree_params(path))
+
+        if metadata is None:
+            return path
+
+        # Delta could contain entries without their parent folders
+        parent = parent_path(path)
+
+        while parent != '/':
+            inserted = conn.execute(
+                'INSERT OR IGNORE INTO entries VALUES (?, ?, 1, 0, ?)',
+                (parent,
+                 parent_path(parent),
+                 json.dumps({'bytes': 0, 'is_dir': True, 'path': parent}))
+            ).rowcount
+
+            if inserted:
+                self._add_trigrams(conn, parent)
+
+            parent = parent_path(parent)
+
+        conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                     (path,
+                      parent_path(path),
+                      int(bool(metadata.get('is_dir'))),
+                      metadata.get('bytes') or 0,
+                      json.dumps(metadata)))
+        self._add_trigrams(conn, path)
+
+        return path
+
+    def _add_trigrams(self, conn, path):
+        conn.executemany('INSERT OR IGNORE INTO trigrams VALUES (?, ?)',
+                         [(gram, path) for gram in trigrams(path)])
+
+    def _connection(self):
+        """
+        SQLite connections couldn't be shared between threads, so keep one
+        connection per thread. Database file is readable only by current
+        user, as it contains whole tree of user's Dropbox.
+        """
+        conn = getattr(self._local, 'conn', None)
+
+        if conn is None:
+            make_private_file(self.path)
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10)
+
+        return conn
+
+    def _get_state(self, name):
+        row = self._connection().execute(
+            'SELECT value FROM state WHERE name = ?', (name, )
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, conn, name, value):
+        conn.execute('INSERT OR REPLACE INTO state VALUES (?, ?)',
+                     (name, value))
+
+
+def normalize_path(path):
+    """
+    Convert Dropbox path to lower case form used as key in index.
+    """
+    return '/' + path.strip('/').lower()
+
+
+def parent_path(path):
+    """
+    Return path of parent folder for normalized ``path``.
+    """
+    return path.rsplit('/', 1)[0] or '/'
+
+
+def subtree_params(path):
+    """
+    Return params for ``SUBTREE`` condition.
+    """
+    return (path, path + '/', path + '0')
+
+
+def trigrams(value):
+    """
+    Return set of all three chars substrings of ``value``.
+    """
+    return set([value[i:i + 3] for i in range(len(value) - 2)])
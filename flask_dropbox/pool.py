@@ -0,0 +1,98 @@
+"""
+==================
+flask_dropbox.pool
+==================
+
+Process-wide pool of Dropbox clients keyed by access token.
+
+"""
+
+import threading
+import time
+
+
+__all__ = ('ClientPool', )
+
+
+class ClientPool(object):
+    """
+    Thread-safe pool of ``DropboxClient`` instances bounded by size and idle
+    TTL. Least recently used clients are evicted first.
+    """
+    def __init__(self, max_size=100, ttl=300):
+        """
+        Initialize empty pool. ``ttl`` is the number of seconds client could
+        stay idle in pool, ``0`` or ``None`` disables idle expiration.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, token):
+        return token in self._clients
+
+    def __len__(self):
+        return len(self._clients)
+
+    def clear(self):
+        """
+        Remove all clients from the pool.
+        """
+        with self._lock:
+            self._clients.clear()
+
+    def get(self, token, factory):
+        """
+        Return client for ``token`` from the pool or create new one by calling
+        ``factory`` and put it to the pool.
+        """
+        now = time.time()
+
+        with self._lock:
+            item = self._clients.get(token)
+
+            if item is not None and not self._is_expired(item, now):
+                self._clients[token] = (item[0], now)
+                return item[0]
+
+        # Do not hold the lock while building new client
+        client = factory()
+
+        with self._lock:
+            item = self._clients.get(token)
+
+            if item is not None and not self._is_expired(item, now):
+                client = item[0]
+
+            self._clients[token] = (client, now)
+            self._evict(now)
+
+        return client
+
+    def remove(self, token):
+        """
+        Remove client for ``token`` from the pool if any.
+        """
+        with self._lock:
+            self._clients.pop(token, None)
+
+    def _evict(self, now):
+        """
+        Remove expired clients and then least recently used ones until pool
+        fits ``max_size``. Should be called only with acquired lock.
+        """
+        for token, item in list(self._clients.items()):
+            if self._is_expired(item, now):
+                del self._clients[token]
+
+        if not self.max_size:
+            return
+
+        while len(self._clients) > self.max_size:
+            token = min(self._clients, key=lambda key: self._clients[key][1])
+            del self._clients[token]
+
+    def _is_expired(self, item, now):
+        return bool(self.ttl) and now - item[1] >= self.ttl
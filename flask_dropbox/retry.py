@@ -0,0 +1,155 @@
+"""
+===================
+flask_dropbox.retry
+===================
+
+Retry policy and circuit breaker for Dropbox API calls.
+
+"""
+
+import calendar
+import random
+import socket
+import threading
+import time
+
+from dropbox.rest import ErrorResponse
+from werkzeug.http import parse_date
+
+from .exceptions import CircuitOpenError
+
+
+__all__ = ('CircuitBreaker', 'RetryPolicy', 'get_retry_after')
+
+
+#: Statuses of Dropbox API responses which mean call could succeed later
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CircuitBreaker(object):
+    """
+    Fail fast while Dropbox API is degraded.
+
+    After ``threshold`` consecutive failed calls circuit is opened and all
+    calls fail with ``CircuitOpenError`` without touching Dropbox API for
+    ``timeout`` seconds. Then single trial call is allowed: circuit is closed
+    on its success or opened again on its failure.
+    """
+    def __init__(self, threshold=5, timeout=30):
+        self.threshold = threshold
+        self.timeout = timeout
+
+        self.failures = 0
+        self.opened = None
+
+        self._lock = threading.Lock()
+        self._trial = False
+
+    def before_call(self):
+        """
+        Raise ``CircuitOpenError`` if circuit is open.
+        """
+        with self._lock:
+            if self.opened is None:
+                return
+
+            retry_after = self.opened + self.timeout - time.time()
+
+            if retry_after > 0 or self._trial:
+                raise CircuitOpenError(max(retry_after, 1))
+
+            self._trial = True
+
+    def record_failure(self):
+        """
+        Record failed call, open circuit if there are too many of them.
+        """
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+
+            if self.failures >= self.threshold:
+                self.opened = time.time()
+
+    def record_success(self):
+        """
+        Record successful call and close circuit.
+        """
+        with self._lock:
+            self.failures = 0
+            self.opened = None
+            self._trial = False
+
+    @property
+    def state(self):
+        """
+        Current state of circuit: ``'closed'``, ``'open'`` or
+        ``'half-open'``.
+        """
+        if self.opened is None:
+            return 'closed'
+        if self._trial or self.opened + self.timeout <= time.time():
+            return 'half-open'
+        return 'open'
+
+
+class RetryPolicy(object):
+    """
+    Exponential backoff with full jitter for failed Dropbox API calls.
+    ``Retry-After`` header of error response takes precedence over backoff.
+    """
+    def __init__(self, retries=3, backoff=0.5, max_delay=5, jitter=True):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def delay(self, attempt, error):
+        """
+        Return number of seconds to wait before retrying call failed with
+        ``error`` on ``attempt`` (starting from ``0``), or ``None`` if call
+        shouldn't be retried. Calls are not retried if Dropbox asks to wait
+        longer than ``max_delay`` seconds, so request threads don't hang on
+        degraded Dropbox API.
+        """
+        if attempt >= self.retries or not self.is_retryable(error):
+            return None
+
+        retry_after = get_retry_after(error)
+
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_delay else None
+
+        delay = min(self.max_delay, self.backoff * 2 ** attempt)
+        return random.uniform(0, delay) if self.jitter else delay
+
+    def is_retryable(self, error):
+        """
+        Check whether call failed with ``error`` could succeed later.
+        """
+        if isinstance(error, ErrorResponse):
+            return error.status in RETRY_STATUSES
+        return isinstance(error, socket.error)
+
+
+def get_retry_after(error):
+    """
+    Return number of seconds from ``Retry-After`` header of error response or
+    ``None`` if header is missed or invalid.
+    """
+    headers = dict([(name.lower(), value)
+                    for name, value in getattr(error, 'headers', None) or ()])
+    value = headers.get('retry-after')
+
+    if not value:
+        return None
+
+    if value.isdigit():
+        return int(value)
+
+    date = parse_date(value)
+
+    if date is None:
+        return None
+
+    return max(0, calendar.timegm(date.utctimetuple()) - time.time())
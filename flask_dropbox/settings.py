@@ -1,8 +1,84 @@
-# Cache keys for account info, client and session instances
+# Cache keys for account info, client instances, media and share links,
+# metadata, not found paths, thumbnails, upload states and background upload
+# jobs
 ACCOUNT_INFO_CACHE_KEY = 'dropbox_account_info_cache'
 CLIENT_CACHE_KEY = 'dropbox_client_cache'
-SESSION_CACHE_KEY = 'dropbox_session_cache'
+LINK_CACHE_KEY = 'dropbox_link_cache'
+METADATA_CACHE_KEY = 'dropbox_metadata_cache'
+MISSING_CACHE_KEY = 'dropbox_missing_cache'
+THUMBNAIL_CACHE_KEY = 'dropbox_thumbnail_cache'
+UPLOAD_CACHE_KEY = 'dropbox_upload_cache'
+UPLOAD_JOB_CACHE_KEY = 'dropbox_upload_job_cache'
+
+# Keys to store Dropbox API calls and tokens fetched from token store for
+# current request in ``flask.g``
+REQUEST_CALLS_KEY = 'dropbox_request_calls'
+TOKENS_CACHE_KEY = 'dropbox_tokens_cache'
 
 # Setup where token keys for Dropbox would be stored in Flask session
 DROPBOX_ACCESS_TOKEN_KEY = 'dropbox_access_token'
+DROPBOX_ACCESS_TOKEN_EXPIRES_KEY = 'dropbox_access_token_expires'
 DROPBOX_REQUEST_TOKEN_KEY = 'dropbox_request_token'
+DROPBOX_REQUEST_TOKEN_EXPIRES_KEY = 'dropbox_request_token_expires'
+
+# Default number of seconds to keep account info in cache storage
+ACCOUNT_INFO_TTL = 5 * 60
+
+# Number of seconds before expiration when cached media and share links are
+# not used anymore
+LINK_EXPIRES_MARGIN = 60
+
+# Default number of seconds to remember that path doesn't exist
+MISSING_TTL = 30
+
+# Default number of seconds to reuse request token
+REQUEST_TOKEN_TTL = 600
+
+# Default limits for process-wide Dropbox client pool
+CLIENT_POOL_SIZE = 100
+CLIENT_POOL_TTL = 300
+
+# Default size of chunks to stream downloaded files with
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Default number of files downloaded ahead while streaming folder archive
+ARCHIVE_PREFETCH = 4
+
+# Default number of threads to run calls of ``Dropbox.futures`` client
+FUTURES_WORKERS = 16
+
+# Default size of chunks and number of retries for chunked uploads. Dropbox
+# keeps chunked uploads for 24 hours, so keep their state no longer
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+UPLOAD_CONCURRENCY = 4
+UPLOAD_RETRIES = 3
+UPLOAD_STATE_TTL = 24 * 60 * 60
+
+# Max number of background upload jobs kept in memory, when cache storage is
+# not shared between requests, seconds to keep their results and spooled
+# files, and min number of seconds between removals of stale spooled files
+UPLOAD_JOBS_SIZE = 1000
+UPLOAD_JOB_TTL = 24 * 60 * 60
+UPLOAD_QUEUE_PRUNE_INTERVAL = UPLOAD_JOB_TTL // 24
+
+# Default retry policy and circuit breaker settings for Dropbox API calls
+RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_MAX_DELAY = 5
+CIRCUIT_BREAKER_THRESHOLD = 5
+CIRCUIT_BREAKER_TIMEOUT = 30
+
+# Default and max number of search results
+SEARCH_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+# Default number of open metadata indexes and seconds between their syncs
+INDEX_POOL_SIZE = 100
+INDEX_SYNC_INTERVAL = 30
+
+# Default thumbnails cache size in bytes, seconds browsers could keep
+# thumbnails with known revision, and supported thumbnail sizes and formats
+THUMBNAIL_CACHE_MAX_SIZE = 64 * 1024 * 1024
+THUMBNAIL_MAX_AGE = 7 * 24 * 60 * 60
+THUMBNAIL_SIZES = ('xs', 's', 'm', 'l', 'xl', 'small', 'medium', 'large')
+THUMBNAIL_FORMATS = ('jpeg', 'png')
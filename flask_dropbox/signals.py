@@ -0,0 +1,22 @@
+"""
+=====================
+flask_dropbox.signals
+=====================
+
+Signals sent by Flask-Dropbox. As Flask signals, they work only if
+`blinker <http://pypi.python.org/pypi/blinker>`_ is installed.
+
+"""
+
+from flask.signals import Namespace
+
+
+__all__ = ('api_call', )
+
+
+_signals = Namespace()
+
+#: Sent after each call to Dropbox API made through ``Dropbox`` extension.
+#: Sender is the extension instance, keyword arguments are ``method``,
+#: ``path``, ``status``, ``bytes`` and ``duration`` (in seconds).
+api_call = _signals.signal('dropbox-api-call')
@@ -0,0 +1,151 @@
+"""
+===================
+flask_dropbox.stats
+===================
+
+In-process latency histograms for Dropbox API calls.
+
+"""
+
+import bisect
+import threading
+
+
+__all__ = ('CallStats', 'LatencyHistogram', 'RequestCalls')
+
+
+#: Upper bounds (in seconds) of histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of call durations with fixed buckets.
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.max = None
+        self.min = None
+        self.total = 0.0
+
+    def add(self, duration, error=False):
+        """
+        Add call duration to histogram.
+        """
+        self.counts[bisect.bisect_left(self.buckets, duration)] += 1
+        self.count += 1
+        self.errors += int(bool(error))
+        self.max = duration if self.max is None else max(self.max, duration)
+        self.min = duration if self.min is None else min(self.min, duration)
+        self.total += duration
+
+    def as_dict(self):
+        """
+        Represent histogram as dict, suitable for JSON serialization.
+        """
+        bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+        return {
+            'buckets': dict(zip(bounds, self.counts)),
+            'count': self.count,
+            'errors': self.errors,
+            'max': self.max,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'total': self.total,
+        }
+
+    def percentile(self, value):
+        """
+        Return upper bound of bucket which contains given percentile. For last
+        bucket max duration is returned.
+        """
+        if not self.count:
+            return None
+
+        rank = self.count * value / 100.0
+        seen = 0
+
+        for index, count in enumerate(self.counts):
+            seen += count
+
+            if seen >= rank and count:
+                if index < len(self.buckets):
+                    return self.buckets[index]
+                return self.max
+
+        return self.max
+
+
+class CallStats(object):
+    """
+    Thread-safe registry of latency histograms per Dropbox API method.
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def add(self, method, duration, error=False):
+        """
+        Add duration of ``method`` call.
+        """
+        with self._lock:
+            histogram = self._histograms.get(method)
+
+            if histogram is None:
+                histogram = self._histograms[method] = \
+                    LatencyHistogram(self.buckets)
+
+            histogram.add(duration, error)
+
+    def as_dict(self):
+        """
+        Represent all histograms as dict, suitable for JSON serialization.
+        """
+        with self._lock:
+            return dict([(method, histogram.as_dict())
+                         for method, histogram in self._histograms.items()])
+
+    def clear(self):
+        """
+        Remove all collected histograms.
+        """
+        with self._lock:
+            self._histograms.clear()
+
+
+class RequestCalls(object):
+    """
+    Number and total duration of Dropbox API calls made while processing one
+    request, overall and per method.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.methods = {}
+
+    def add(self, method, duration):
+        """
+        Add duration of ``method`` call.
+        """
+        count, total = self.methods.get(method, (0, 0.0))
+        self.methods[method] = (count + 1, total + duration)
+
+        self.count += 1
+        self.duration += duration
+
+    def summary(self):
+        """
+        Return human readable summary of calls, most called methods first.
+        """
+        methods = sorted(self.methods.items(),
+                         key=lambda item: (-item[1][0], item[0]))
+        return ', '.join(['{0} x {1} ({2:.0f} ms)'.
+                          format(method, count, total * 1000)
+                          for method, (count, total) in methods])
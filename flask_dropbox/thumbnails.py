@@ -0,0 +1,142 @@
+"""
+========================
+flask_dropbox.thumbnails
+========================
+
+On-disk cache for thumbnails downloaded from Dropbox.
+
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+
+from .utils import make_private_dir
+
+
+__all__ = ('ThumbnailCache', )
+
+
+class ThumbnailCache(object):
+    """
+    Store thumbnails as files of ``cache_dir`` directory, bounded by total
+    size of ``max_size`` bytes. Least recently used thumbnails are evicted
+    first, file modification time is used as last access time, so cache
+    directory could be shared by several processes on the same host.
+
+    Directory is created accessible only by current user, ``ValueError`` is
+    raised if existing directory could be written by other users.
+    """
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+
+        make_private_dir(cache_dir)
+
+        self._size = sum([size for _, size, _ in self._list_dir()])
+
+    def clear(self):
+        """
+        Remove all thumbnails from cache.
+        """
+        with self._lock:
+            for filename, _, _ in self._list_dir():
+                self._remove(filename)
+            self._size = 0
+
+    def get(self, key):
+        """
+        Return content of thumbnail for ``key`` or ``None`` if cache doesn't
+        contain it.
+        """
+        filename = self._filename(key)
+
+        try:
+            with open(filename, 'rb') as handler:
+                data = handler.read()
+        except (IOError, OSError):
+            return None
+
+        # Mark thumbnail as recently used
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+
+        return data
+
+    def set(self, key, data):
+        """
+        Store thumbnail content for ``key``, evicting least recently used
+        thumbnails if cache exceeds ``max_size``.
+        """
+        if self.max_size and len(data) > self.max_size:
+            return
+
+        try:
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+
+            with os.fdopen(fd, 'wb') as handler:
+                handler.write(data)
+
+            os.rename(tmp, self._filename(key))
+        except (IOError, OSError):
+            return
+
+        with self._lock:
+            self._size += len(data)
+
+            if self.max_size and self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        """
+        Remove least recently used thumbnails until cache fits ``max_size``.
+        Directory is listed again, as other processes could change it. Should
+        be called only with acquired lock.
+        """
+        items = sorted(self._list_dir(), key=lambda item: item[2])
+        self._size = sum([size for _, size, _ in items])
+
+        for filename, size, _ in items:
+            if self._size <= self.max_size:
+                break
+
+            self._remove(filename)
+            self._size -= size
+
+    def _filename(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return os.path.join(self.cache_dir, hashlib.md5(key).hexdigest())
+
+    def _list_dir(self):
+        """
+        Return list of ``(filename, size, mtime)`` tuples of all cached
+        thumbnails.
+        """
+        items = []
+
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith('.tmp'):
+                continue
+
+            filename = os.path.join(self.cache_dir, filename)
+
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+
+            items.append((filename, stat.st_size, stat.st_mtime))
+
+        return items
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
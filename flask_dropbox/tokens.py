@@ -0,0 +1,299 @@
+"""
+====================
+flask_dropbox.tokens
+====================
+
+Server-side stores for Dropbox access and request tokens. When store is
+enabled, Flask session contains only opaque token id.
+
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+from .utils import make_private_dir, make_private_file
+
+
+__all__ = ('BaseTokenStore', 'FileSystemTokenStore', 'MemoryTokenStore',
+           'SQLiteTokenStore', 'make_token_store')
+
+
+class BaseTokenStore(object):
+    """
+    Base class for all token stores.
+
+    Tokens could be stored with TTL, e.g. request tokens of anonymous users
+    who never finish login or access tokens of abandoned sessions. Expired
+    tokens are not returned and are removed from store at most once in
+    ``prune_interval`` seconds on storing new tokens.
+    """
+    #: Min number of seconds between removals of expired tokens
+    prune_interval = 60
+
+    _pruned = 0
+
+    def add(self, key, secret, ttl=None):
+        """
+        Store token and return its new unique id.
+        """
+        token_id = uuid.uuid4().hex
+        self.set(token_id, key, secret, ttl)
+        return token_id
+
+    def delete(self, token_id):
+        """
+        Remove token with ``token_id`` from store.
+        """
+        raise NotImplementedError
+
+    def get(self, token_id):
+        """
+        Return ``(key, secret)`` pair of token with ``token_id`` or ``None``
+        if store doesn't contain it.
+        """
+        raise NotImplementedError
+
+    def prune(self):
+        """
+        Remove all expired tokens from store.
+        """
+        raise NotImplementedError
+
+    def set(self, token_id, key, secret, ttl=None):
+        """
+        Store token with given ``token_id`` for ``ttl`` seconds, ``None``
+        means token never expires.
+        """
+        raise NotImplementedError
+
+    def touch(self, token_id, ttl):
+        """
+        Extend lifetime of token with ``token_id`` to ``ttl`` seconds from
+        now. Missing or already expired tokens are not restored.
+        """
+        token = self.get(token_id)
+
+        if token is not None:
+            self.set(token_id, token[0], token[1], ttl)
+
+    def _expires(self, ttl):
+        """
+        Convert ``ttl`` to expiration timestamp, ``None`` for never.
+        """
+        return time.time() + ttl if ttl else None
+
+    def _maybe_prune(self):
+        """
+        Remove expired tokens if it wasn't done for ``prune_interval``
+        seconds.
+        """
+        now = time.time()
+
+        if self._pruned + self.prune_interval <= now:
+            self._pruned = now
+            self.prune()
+
+
+class MemoryTokenStore(BaseTokenStore):
+    """
+    Store tokens in memory of current process. Tokens are lost on restart.
+    """
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def delete(self, token_id):
+        with self._lock:
+            self._data.pop(token_id, None)
+
+    def get(self, token_id):
+        item = self._data.get(token_id)
+
+        if item is None or is_expired(item[2]):
+            return None
+
+        return item[:2]
+
+    def prune(self):
+        with self._lock:
+            for token_id, item in list(self._data.items()):
+                if is_expired(item[2]):
+                    del self._data[token_id]
+
+    def set(self, token_id, key, secret, ttl=None):
+        self._maybe_prune()
+
+        with self._lock:
+            self._data[token_id] = (key, secret, self._expires(ttl))
+
+
+class FileSystemTokenStore(BaseTokenStore):
+    """
+    Store each token in separate file of ``path`` directory named by token
+    id, so lookup is single file read. Directory is created accessible only
+    by current user, ``ValueError`` is raised if existing directory could be
+    written by other users.
+    """
+    def __init__(self, path):
+        self.path = path
+        make_private_dir(path)
+
+    def delete(self, token_id):
+        try:
+            os.remove(self._filename(token_id))
+        except (OSError, ValueError):
+            pass
+
+    def get(self, token_id):
+        try:
+            with open(self._filename(token_id), 'rb') as handler:
+                key, secret, expires = json.load(handler)
+        except (IOError, OSError, TypeError, ValueError):
+            return None
+
+        return None if is_expired(expires) else (key, secret)
+
+    def prune(self):
+        for token_id in os.listdir(self.path):
+            try:
+                with open(self._filename(token_id), 'rb') as handler:
+                    expires = json.load(handler)[2]
+            except (IOError, OSError, IndexError, KeyError, TypeError,
+                    ValueError):
+                continue
+
+            if is_expired(expires):
+                self.delete(token_id)
+
+    def set(self, token_id, key, secret, ttl=None):
+        self._maybe_prune()
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+
+        with os.fdopen(fd, 'wb') as handler:
+            json.dump([key, secret, self._expires(ttl)], handler)
+
+        os.rename(tmp, self._filename(token_id))
+
+    def _filename(self, token_id):
+        # Token id comes from client cookie, never let it escape directory
+        if not token_id or not token_id.isalnum():
+            raise ValueError('Invalid token id: {0!r}'.format(token_id))
+        return os.path.join(self.path, token_id)
+
+
+class SQLiteTokenStore(BaseTokenStore):
+    """
+    Store tokens in SQLite database at ``path``. Token id is primary key of
+    the table, so lookup is single indexed fetch. Database could be shared
+    by several processes on the same host.
+
+    Database file is created readable only by current user, ``ValueError``
+    is raised if existing file is owned or readable by other users.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+        make_private_file(path)
+
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS dropbox_tokens ('
+                         'id TEXT PRIMARY KEY, '
+                         'key TEXT NOT NULL, '
+                         'secret TEXT NOT NULL, '
+                         'expires REAL)')
+
+            # Table created before tokens expiration support
+            columns = [row[1] for row in
+                       conn.execute('PRAGMA table_info(dropbox_tokens)')]
+
+            if 'expires' not in columns:
+                conn.execute('ALTER TABLE dropbox_tokens '
+                             'ADD COLUMN expires REAL')
+
+    def delete(self, token_id):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM dropbox_tokens WHERE id = ?',
+                         (token_id, ))
+
+    def get(self, token_id):
+        row = self._connection().execute(
+            'SELECT key, secret FROM dropbox_tokens '
+            'WHERE id = ? AND (expires IS NULL OR expires > ?)',
+            (token_id, time.time())
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def prune(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM dropbox_tokens WHERE expires <= ?',
+                         (time.time(), ))
+
+    def set(self, token_id, key, secret, ttl=None):
+        self._maybe_prune()
+
+        with self._connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO dropbox_tokens '
+                         '(id, key, secret, expires) VALUES (?, ?, ?, ?)',
+                         (token_id, key, secret, self._expires(ttl)))
+
+    def touch(self, token_id, ttl):
+        with self._connection() as conn:
+            conn.execute('UPDATE dropbox_tokens SET expires = ? '
+                         'WHERE id = ? AND (expires IS NULL OR expires > ?)',
+                         (self._expires(ttl), token_id, time.time()))
+
+    def _connection(self):
+        """
+        SQLite connections couldn't be shared between threads, so keep one
+        connection per thread.
+        """
+        conn = getattr(self._local, 'conn', None)
+
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10)
+
+        return conn
+
+
+def is_expired(expires):
+    """
+    Check whether token with ``expires`` timestamp is expired.
+    """
+    return expires is not None and expires <= time.time()
+
+
+def make_token_store(store, path=None):
+    """
+    Create token store from ``DROPBOX_TOKEN_STORE`` value.
+
+    Value could be ``'memory'``, ``'filesystem'``, ``'sqlite'`` or token
+    store instance. ``path`` is directory for filesystem store and database
+    file for SQLite store, by default both are placed in temp directory.
+    """
+    if store == 'memory':
+        return MemoryTokenStore()
+
+    if store == 'filesystem':
+        return FileSystemTokenStore(
+            path or os.path.join(tempfile.gettempdir(), 'flask_dropbox_tokens')
+        )
+
+    if store == 'sqlite':
+        return SQLiteTokenStore(
+            path or os.path.join(tempfile.gettempdir(),
+                                 'flask_dropbox_tokens.db')
+        )
+
+    if isinstance(store, BaseTokenStore):
+        return store
+
+    raise ValueError('Unsupported token store: {0!r}'.format(store))
@@ -0,0 +1,196 @@
+"""
+====================
+flask_dropbox.upload
+====================
+
+Chunked uploads of large files to Dropbox.
+
+"""
+
+import hashlib
+import socket
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+from dropbox.client import format_path
+from dropbox.rest import ErrorResponse
+
+
+__all__ = ('ChunkedUpload', 'get_file_length', 'is_client_error')
+
+
+class ChunkedUpload(object):
+    """
+    Upload file to Dropbox in chunks using ``/chunked_upload`` API endpoint.
+    File should be seekable and is read from its start.
+
+    Unlike ``DropboxClient.ChunkedUploader`` reads only one chunk at a time
+    and retries failed chunks limited number of times. Upload could be
+    resumed later by passing ``upload_id``, ``offset`` and ``digest`` of
+    previous try.
+    """
+    def __init__(self, client, file_obj, length, chunk_size, upload_id=None,
+                 offset=0, retries=3, callback=None, digest=None):
+        """
+        Initialize upload. ``callback`` would be called with upload instance
+        after each acknowledged chunk. ``digest`` is SHA1 hex digest of
+        already uploaded ``offset`` bytes, upload is not resumed if file
+        starts with other content.
+        """
+        self.client = client
+        self.file_obj = file_obj
+        self.length = length
+        self.chunk_size = chunk_size
+        self.upload_id = upload_id
+        self.offset = offset
+        self.retries = retries
+        self.callback = callback
+        self.digest = digest
+
+        self._hash = None
+        self._hashed = 0
+
+    @property
+    def state(self):
+        """
+        Upload state needed to resume it later.
+        """
+        return {'digest': self.digest,
+                'offset': self.offset,
+                'upload_id': self.upload_id}
+
+    def finish(self, path, overwrite=False, parent_rev=None):
+        """
+        Commit uploaded chunks to file at ``path`` and return its metadata.
+        """
+        target = '/commit_chunked_upload/%s%s' % (self.client.session.root,
+                                                  format_path(path))
+        params = {'overwrite': bool(overwrite), 'upload_id': self.upload_id}
+
+        if parent_rev is not None:
+            params['parent_rev'] = parent_rev
+
+        url, params, headers = \
+            self.client.request(target, params, content_server=True)
+        return self.client.rest_client.POST(url, params, headers)
+
+    def upload(self):
+        """
+        Upload all remaining chunks of file.
+
+        Resumed upload starts again from the beginning of file, when already
+        uploaded part doesn't match ``digest`` or when Dropbox doesn't know
+        ``upload_id`` anymore (e.g. it is expired).
+        """
+        self._hash_prefix(self.offset)
+
+        if self.upload_id is not None and self.digest is not None and \
+           self._hash.hexdigest() != self.digest:
+            self._restart()
+
+        errors = 0
+        restarted = False
+
+        while self.offset < self.length:
+            start = self.offset
+            chunk = self.file_obj.read(min(self.chunk_size,
+                                           self.length - self.offset))
+
+            try:
+                self.offset, self.upload_id = self.client.upload_chunk(
+                    StringIO(chunk), len(chunk), self.offset, self.upload_id
+                )
+            except (ErrorResponse, socket.error) as err:
+                # Dropbox API tells the offset it expects on wrong one
+                body = getattr(err, 'body', None)
+                offset = body.get('offset') if isinstance(body, dict) \
+                    else None
+
+                # Retrying with unknown upload id wouldn't help
+                if offset is None and is_client_error(err):
+                    if self.upload_id is None or restarted:
+                        raise
+
+                    restarted = True
+                    self._restart()
+                    continue
+
+                errors += 1
+
+                if errors > self.retries:
+                    raise
+
+                if offset is not None:
+                    self.offset = offset
+
+                self.file_obj.seek(self.offset)
+                continue
+
+            errors = 0
+
+            if start == self._hashed and self.offset == start + len(chunk):
+                self._hash.update(chunk)
+                self._hashed = self.offset
+            else:
+                self._hash_prefix(self.offset)
+
+            self.digest = self._hash.hexdigest()
+
+            if self.callback is not None:
+                self.callback(self)
+
+    def _hash_prefix(self, offset):
+        """
+        Hash first ``offset`` bytes of file, leaving file at ``offset``.
+        """
+        self._hash = hashlib.sha1()
+        self.file_obj.seek(0)
+        remaining = offset
+
+        while remaining > 0:
+            data = self.file_obj.read(min(self.chunk_size, remaining))
+
+            if not data:
+                break
+
+            self._hash.update(data)
+            remaining -= len(data)
+
+        self._hashed = offset
+        self.file_obj.seek(offset)
+
+    def _restart(self):
+        """
+        Forget previous upload and start new one from the beginning of file.
+        """
+        self.upload_id = None
+        self.offset = 0
+        self.digest = None
+        self._hash_prefix(0)
+
+        if self.callback is not None:
+            self.callback(self)
+
+
+def get_file_length(file_obj):
+    """
+    Return length of seekable file-like object without reading it.
+    """
+    position = file_obj.tell()
+    file_obj.seek(0, 2)
+    length = file_obj.tell()
+    file_obj.seek(position)
+    return length
+
+
+def is_client_error(err):
+    """
+    Check whether ``err`` is Dropbox API error caused by request itself
+    (e.g. expired upload id), so repeating the request wouldn't help. Rate
+    limit errors are temporary.
+    """
+    return isinstance(err, ErrorResponse) and \
+        400 <= err.status < 500 and err.status != 429
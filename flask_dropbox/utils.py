@@ -1,8 +1,153 @@
+import errno
+import os
+import socket
+import stat
+import urlparse
+
+from dropbox.client import DropboxClient, format_path
+from dropbox.rest import ErrorResponse, ProperHTTPSConnection, RESTSocketError
 from flask import url_for
 from werkzeug.routing import BuildError as RoutingBuildError
 
 
-__all__ = ('safe_url_for', )
+__all__ = ('dump_error_response', 'get_error_message', 'get_file_range',
+           'load_error_response', 'make_private_dir', 'make_private_file',
+           'parse_file_metadata', 'safe_url_for')
+
+
+def dump_error_response(err):
+    """
+    Represent ``ErrorResponse`` as dict, suitable for storing in cache.
+    """
+    return {'body': err.body,
+            'headers': err.headers,
+            'reason': err.reason,
+            'status': err.status}
+
+
+def get_error_message(err):
+    """
+    Return message of ``err`` exception as unicode string. Non-ASCII byte
+    string messages (e.g. OS errors on localized systems) are decoded as
+    UTF-8 with replacement of broken characters.
+    """
+    try:
+        return unicode(err)
+    except UnicodeError:
+        pass
+
+    try:
+        return str(err).decode('utf-8', 'replace')
+    except UnicodeError:
+        return repr(err).decode('utf-8', 'replace')
+
+
+def get_file_range(client, path, byte_range, rev=None):
+    """
+    Download part of file from Dropbox.
+
+    ``DropboxClient.get_file`` doesn't support ``Range`` header and treats
+    ``206 Partial Content`` response as error, so build request manually.
+    ``byte_range`` is value of ``Range`` header to send.
+
+    Returns raw HTTP response with status ``206`` or ``200`` if Dropbox
+    ignored the range.
+    """
+    target = '/files/%s%s' % (client.session.root, format_path(path))
+    params = {'rev': rev} if rev is not None else {}
+
+    url, params, headers = \
+        client.request(target, params, method='GET', content_server=True)
+    headers['Range'] = byte_range
+
+    impl = getattr(client.rest_client, 'IMPL', None)
+    http_connect = getattr(impl, 'http_connect', None) or ProperHTTPSConnection
+
+    host = urlparse.urlparse(url).hostname
+    conn = http_connect(host, 443)
+
+    try:
+        conn.request('GET', url, headers=headers)
+        response = conn.getresponse()
+    except socket.error as err:
+        raise RESTSocketError(host, err)
+
+    if response.status not in (200, 206):
+        raise ErrorResponse(response)
+
+    return response
+
+
+def load_error_response(data):
+    """
+    Build ``ErrorResponse`` from dict returned by ``dump_error_response``.
+    """
+    err = ErrorResponse.__new__(ErrorResponse)
+    err.body = data['body']
+    err.headers = data['headers']
+    err.reason = data['reason']
+    err.status = data['status']
+
+    body = err.body if isinstance(err.body, dict) else {}
+    err.error_msg = body.get('error')
+    err.user_error_msg = body.get('user_error')
+
+    return err
+
+
+def make_private_dir(path):
+    """
+    Create directory accessible only by current user or check that existing
+    directory at ``path`` is not writable by other users.
+
+    Raise ``ValueError`` if directory is owned by other user or writable by
+    group or others, as its files couldn't be trusted then (e.g. directory
+    in shared temp directory created in advance by other local user).
+    """
+    try:
+        os.makedirs(path, 0700)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+    info = os.stat(path)
+
+    if not stat.S_ISDIR(info.st_mode):
+        raise ValueError('{0!r} is not a directory.'.format(path))
+
+    if hasattr(os, 'getuid') and \
+       (info.st_uid != os.getuid() or info.st_mode & 022):
+        raise ValueError('{0!r} directory is owned or writable by other '
+                         'users, please, use private directory.'.format(path))
+
+
+def make_private_file(path):
+    """
+    Create empty file accessible only by current user or check that
+    existing file at ``path`` is not accessible by other users.
+
+    Raise ``ValueError`` if file is owned by other user or accessible by
+    group or others, e.g. file with secrets in shared temp directory.
+    """
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0600))
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+    info = os.stat(path)
+
+    if hasattr(os, 'getuid') and \
+       (info.st_uid != os.getuid() or info.st_mode & 077):
+        raise ValueError('{0!r} file is owned or accessible by other users, '
+                         'please, use private file.'.format(path))
+
+
+def parse_file_metadata(response):
+    """
+    Read file metadata from ``x-dropbox-metadata`` header of raw response.
+    """
+    return DropboxClient._DropboxClient__parse_metadata_as_dict(response)
 
 
 def safe_url_for(url, *args, **kwargs):
@@ -1,9 +1,85 @@
+import urllib
+import uuid
+
+from collections import deque
+
 from dropbox.rest import ErrorResponse
-from flask import current_app, redirect, render_template, request, session
+from flask import (abort, current_app, jsonify, redirect, render_template,
+                   request)
+from werkzeug.datastructures import Range
+from werkzeug.http import parse_date, parse_range_header
+from werkzeug.wsgi import ClosingIterator, FileWrapper
+
+from .archive import iter_zip
+from .client import call_api
+from .exceptions import CircuitOpenError
+from .settings import (ARCHIVE_PREFETCH, DOWNLOAD_CHUNK_SIZE,
+                       DROPBOX_REQUEST_TOKEN_KEY,
+                       SEARCH_LIMIT, SEARCH_MAX_LIMIT, THUMBNAIL_FORMATS,
+                       THUMBNAIL_MAX_AGE, THUMBNAIL_SIZES)
+from .utils import get_file_range, parse_file_metadata, safe_url_for
+
+
+__all__ = ('archive', 'callback', 'login', 'logout', 'search', 'stats',
+           'stream_file', 'thumbnail', 'upload_status')
+
+
+def archive(path):
+    """
+    Stream ZIP archive of folder at ``path`` with all its subfolders.
+
+    Only the folder itself is listed with ``Dropbox.metadata`` while handling
+    request. Its subfolders are listed and files are downloaded in
+    background threads while archive is streamed, at most
+    ``DROPBOX_ARCHIVE_PREFETCH`` subfolders and files ahead of the one being
+    sent. So first bytes are sent without waiting for listing of the whole
+    tree, and memory usage depends only on prefetch window and chunk size,
+    not on size of folder. Files are stored without compression, ZIP64
+    extensions are used for large files and archives.
+    """
+    dropbox = current_app.extensions['dropbox']
+
+    if not dropbox.is_authenticated:
+        abort(403)
+
+    try:
+        metadata = dropbox.metadata(path)
+    except ErrorResponse as err:
+        if err.status == 404:
+            abort(404)
+        raise
+
+    if not metadata.get('is_dir') or metadata.get('is_deleted'):
+        abort(404)
+
+    root = metadata['path'].rstrip('/').rsplit('/', 1)[-1] or 'Dropbox'
+
+    client = dropbox.client
+    chunk_size = dropbox.DROPBOX_DOWNLOAD_CHUNK_SIZE or DOWNLOAD_CHUNK_SIZE
+    prefetch = dropbox.DROPBOX_ARCHIVE_PREFETCH or ARCHIVE_PREFETCH
+
+    entries = _iter_archive_entries(
+        client,
+        dropbox.executor,
+        _walk_folder(client, dropbox.executor, metadata, root, prefetch),
+        prefetch
+    )
 
-from .compat import OAuthToken
-from .settings import DROPBOX_REQUEST_TOKEN_KEY
-from .utils import safe_url_for
+    response = current_app.response_class(
+        ClosingIterator(iter_zip(entries, chunk_size), entries.close),
+        mimetype='application/zip',
+        direct_passthrough=True
+    )
+
+    filename = (root + '.zip').encode('utf-8')
+    response.headers['Content-Disposition'] = \
+        'attachment; filename="{0}"; filename*=UTF-8\'\'{1}'.format(
+            filename.decode('ascii', 'ignore').encode('ascii').
+            replace('"', ''),
+            urllib.quote(filename)
+        )
+
+    return response
 
 
 def callback():
@@ -33,17 +109,17 @@ def callback():
 
     # oAuth token **should** be equal to stored request token
     try:
-        key, secret = session.get(DROPBOX_REQUEST_TOKEN_KEY) or (None, None)
+        request_token = dropbox.get_token(DROPBOX_REQUEST_TOKEN_KEY)
     except ValueError:
         return render_template(template, error_request_token=True)
 
-    if oauth_token != key:
+    if request_token is None or oauth_token != request_token.key:
         return render_template(template, error_not_equal_tokens=True)
 
     # Do login with current request token
     try:
-        dropbox.login(OAuthToken(key, secret))
-    except ErrorResponse as e:
+        dropbox.login(request_token)
+    except (CircuitOpenError, ErrorResponse) as e:
         return render_template(template, error_response=True, error=e)
 
     # Redirect to resulted page
@@ -51,6 +127,17 @@ def callback():
     return redirect(redirect_to)
 
 
+def login():
+    """
+    Redirect user to Dropbox authorization page.
+
+    Request token is obtained only here, so rendering "Login with Dropbox"
+    links doesn't make any requests to Dropbox API.
+    """
+    dropbox = current_app.extensions['dropbox']
+    return redirect(dropbox.authorize_url)
+
+
 def logout():
     """
     Logout current user from Dropbox.
@@ -62,3 +149,370 @@ def logout():
 
     redirect_to = safe_url_for(dropbox.DROPBOX_LOGOUT_REDIRECT or '/')
     return redirect(redirect_to)
+
+
+def search():
+    """
+    Search current user's files in local metadata index.
+
+    Query is read from ``q`` request arg, optional ``path`` arg limits search
+    to folder and ``limit`` arg sets max number of results. Returns JSON with
+    ranked list of matched files metadata.
+    """
+    dropbox = current_app.extensions['dropbox']
+
+    if not dropbox.is_authenticated:
+        abort(403)
+
+    query = request.args.get('q', '')
+    path = request.args.get('path', '/')
+    limit = request.args.get('limit', SEARCH_LIMIT, type=int)
+
+    results = dropbox.search(query, path, max(1, min(limit, SEARCH_MAX_LIMIT)))
+    return jsonify(query=query, results=results)
+
+
+def stats():
+    """
+    Show latency histograms of Dropbox API calls as JSON.
+
+    Available only in debug mode or when ``DROPBOX_DEBUG_STATS`` config var
+    is enabled, otherwise returns 404 error.
+    """
+    dropbox = current_app.extensions['dropbox']
+
+    if not current_app.debug and not dropbox.DROPBOX_DEBUG_STATS:
+        abort(404)
+
+    return jsonify(dropbox.stats.as_dict())
+
+
+def stream_file(path, rev=None, chunk_size=None):
+    """
+    Stream file from Dropbox to the client.
+
+    File content is sent in chunks of ``chunk_size`` bytes (by default
+    ``DROPBOX_DOWNLOAD_CHUNK_SIZE``) as soon as they are read from Dropbox,
+    so whole file is never buffered in memory. ``Content-Type`` and
+    ``Content-Length`` headers are set from file metadata.
+
+    Supports ``Range`` requests. Requested byte ranges are forwarded to
+    Dropbox API and sent back as ``206 Partial Content`` response, multiple
+    ranges are sent as ``multipart/byteranges`` response.
+
+    File revision is sent as ``ETag`` header. Conditional requests with
+    ``If-None-Match`` header are answered with ``304 Not Modified`` without
+    downloading the file: revision is checked by ``Dropbox.metadata`` call,
+    or not checked at all when ``rev`` is given.
+    """
+    dropbox = current_app.extensions['dropbox']
+    chunk_size = (chunk_size or
+                  dropbox.DROPBOX_DOWNLOAD_CHUNK_SIZE or
+                  DOWNLOAD_CHUNK_SIZE)
+
+    if request.if_none_match:
+        current_rev = rev
+
+        if current_rev is None:
+            metadata = dropbox.metadata(path, list=False)
+
+            if not metadata.get('is_deleted'):
+                current_rev = metadata.get('rev')
+
+        if current_rev is not None and \
+           request.if_none_match.contains_weak(current_rev):
+            response = current_app.response_class(status=304)
+            response.set_etag(current_rev)
+            return response
+
+    client = dropbox.client
+    byte_range = parse_range_header(request.headers.get('Range'))
+
+    if byte_range is None or byte_range.units != 'bytes':
+        file_obj, metadata = client.get_file_and_metadata(path, rev)
+        return _file_response(file_obj, metadata, chunk_size)
+
+    # Request each range from Dropbox separately
+    ranges = [Range('bytes', [item]).to_header() for item in byte_range.ranges]
+
+    try:
+        file_obj = _get_file_range(dropbox, client, path, ranges[0], rev)
+    except ErrorResponse as err:
+        if err.status != 416:
+            raise
+
+        response = current_app.response_class(status=416)
+        content_range = dict(err.headers).get('content-range')
+
+        if content_range:
+            response.headers['Content-Range'] = content_range
+
+        return response
+
+    metadata = parse_file_metadata(file_obj)
+
+    # Dropbox API ignored the range, so send whole file
+    if file_obj.status == 200:
+        return _file_response(file_obj, metadata, chunk_size)
+
+    if len(ranges) == 1:
+        response = _file_response(file_obj, metadata, chunk_size, 206)
+        response.headers['Content-Length'] = \
+            file_obj.getheader('content-length')
+        response.headers['Content-Range'] = file_obj.getheader('content-range')
+        return response
+
+    boundary = uuid.uuid4().hex
+    mimetype = metadata.get('mime_type') or 'application/octet-stream'
+
+    def generate():
+        for index, value in enumerate(ranges):
+            part = file_obj if not index else \
+                _get_file_range(dropbox, client, path, value, rev)
+
+            try:
+                yield ('--{0}\r\nContent-Type: {1}\r\n'
+                       'Content-Range: {2}\r\n\r\n'.
+                       format(boundary,
+                              mimetype,
+                              part.getheader('content-range')))
+
+                for chunk in FileWrapper(part, chunk_size):
+                    yield chunk
+            finally:
+                part.close()
+
+            yield '\r\n'
+
+        yield '--{0}--\r\n'.format(boundary)
+
+    response = current_app.response_class(
+        ClosingIterator(generate(), file_obj.close),
+        status=206,
+        direct_passthrough=True
+    )
+    response.headers['Content-Type'] = \
+        'multipart/byteranges; boundary={0}'.format(boundary)
+
+    if metadata.get('rev'):
+        response.set_etag(metadata['rev'])
+
+    return response
+
+
+def thumbnail(path):
+    """
+    Send thumbnail of image at ``path`` from on-disk thumbnails cache.
+
+    Thumbnail size and format are read from ``size`` (by default ``'m'``)
+    and ``format`` (``'jpeg'`` or ``'png'``) request args. Pass file
+    revision from its metadata as ``rev`` arg, then cached thumbnail and
+    ``If-None-Match`` requests are served without any requests to Dropbox
+    API and browsers keep thumbnail for ``DROPBOX_THUMBNAIL_MAX_AGE``
+    seconds. Without ``rev`` each request makes one ``metadata`` call to
+    Dropbox API to find current file revision and browsers should revalidate
+    thumbnail on each use.
+    """
+    dropbox = current_app.extensions['dropbox']
+
+    if not dropbox.is_authenticated:
+        abort(403)
+
+    size = request.args.get('size', 'm')
+    format = request.args.get('format', 'jpeg').lower()
+    rev = request.args.get('rev')
+
+    if size not in THUMBNAIL_SIZES or format not in THUMBNAIL_FORMATS:
+        abort(400)
+
+    try:
+        if rev is None:
+            metadata = dropbox.metadata(path, list=False)
+
+            if metadata.get('is_deleted') or not metadata.get('thumb_exists'):
+                abort(404)
+
+            rev = metadata['rev']
+
+        etag = '{0}-{1}-{2}'.format(rev, size, format)
+
+        if etag not in request.if_none_match:
+            data, rev = dropbox.thumbnail(path, rev, size, format.upper())
+            etag = '{0}-{1}-{2}'.format(rev, size, format)
+        else:
+            data = None
+    except ErrorResponse as err:
+        if err.status in (404, 415):
+            abort(404)
+        raise
+
+    response = current_app.response_class(data,
+                                          mimetype='image/{0}'.format(format))
+    response.set_etag(etag)
+
+    if request.args.get('rev') is not None:
+        max_age = dropbox.DROPBOX_THUMBNAIL_MAX_AGE
+        response.cache_control.max_age = \
+            THUMBNAIL_MAX_AGE if max_age is None else max_age
+    else:
+        response.cache_control.no_cache = True
+
+    response.cache_control.private = True
+    return response.make_conditional(request)
+
+
+def upload_status(job_id):
+    """
+    Show state of background upload job of current user as JSON, see
+    ``Dropbox.upload_job``.
+    """
+    dropbox = current_app.extensions['dropbox']
+
+    if not dropbox.is_authenticated:
+        abort(403)
+
+    job = dropbox.upload_job(job_id)
+
+    if job is None:
+        abort(404)
+
+    return jsonify(job)
+
+
+def _close_file(future):
+    """
+    Close file response of finished download future.
+    """
+    if future.exception() is None:
+        future.result().close()
+
+
+def _file_response(file_obj, metadata, chunk_size, status=200):
+    """
+    Build streamed response for raw Dropbox file response.
+    """
+    response = current_app.response_class(FileWrapper(file_obj, chunk_size),
+                                          status=status,
+                                          direct_passthrough=True)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Length'] = metadata['bytes']
+    response.headers['Content-Type'] = \
+        metadata.get('mime_type') or 'application/octet-stream'
+
+    if metadata.get('rev'):
+        response.set_etag(metadata['rev'])
+
+    return response
+
+
+def _iter_archive_entries(client, executor, items, prefetch):
+    """
+    Yield ``flask_dropbox.archive.iter_zip`` entries for ``(name, metadata)``
+    items, while downloading next ``prefetch`` files in ``executor``.
+    """
+    items = iter(items)
+    pending = deque()
+
+    def schedule():
+        for name, metadata in items:
+            future = None
+
+            if not metadata.get('is_dir'):
+                future = executor.submit(client.get_file,
+                                         metadata['path'],
+                                         metadata.get('rev'))
+
+            pending.append((name, metadata, future))
+
+            if len(pending) >= prefetch:
+                break
+
+    try:
+        schedule()
+
+        while pending:
+            name, metadata, future = pending.popleft()
+            schedule()
+
+            date_time = parse_date(metadata.get('modified'))
+
+            if future is None:
+                yield (name, date_time, None, 0)
+                continue
+
+            try:
+                file_obj = future.result()
+            except ErrorResponse as err:
+                # File was removed after listing
+                if err.status == 404:
+                    continue
+                raise
+
+            try:
+                yield (name, date_time, file_obj, metadata.get('bytes') or 0)
+            finally:
+                file_obj.close()
+    finally:
+        for _, _, future in pending:
+            if future is not None:
+                future.add_done_callback(_close_file)
+
+
+def _get_file_range(dropbox, client, path, byte_range, rev=None):
+    """
+    Request byte range of file and record the call in extension stats.
+    """
+    return call_api(dropbox,
+                    'get_file',
+                    path,
+                    get_file_range,
+                    client,
+                    path,
+                    byte_range,
+                    rev)
+
+
+def _walk_folder(client, executor, metadata, prefix, prefetch):
+    """
+    Lazily yield ``(name, metadata)`` pairs for all files and subfolders of
+    folder, names are relative paths prefixed with ``prefix``. Subfolders
+    names end with slash.
+
+    Subfolders are listed in ``executor``, at most ``prefetch`` subfolders
+    of each folder ahead of the one being walked.
+    """
+    items = [item for item in metadata.get('contents') or ()
+             if not item.get('is_deleted')]
+    folders = deque([item['path'] for item in items if item.get('is_dir')])
+    pending = {}
+
+    def schedule():
+        while folders and len(pending) < prefetch:
+            path = folders.popleft()
+            pending[path] = executor.submit(client.metadata, path)
+
+    schedule()
+
+    for item in items:
+        name = u'{0}/{1}'.format(prefix, item['path'].rsplit('/', 1)[-1])
+
+        if not item.get('is_dir'):
+            yield name, item
+            continue
+
+        yield name + '/', item
+
+        future = pending.pop(item['path'])
+        schedule()
+
+        try:
+            subfolder = future.result()
+        except ErrorResponse as err:
+            # Folder was removed after listing
+            if err.status == 404:
+                continue
+            raise
+
+        for value in _walk_folder(client, executor, subfolder, name,
+                                  prefetch):
+            yield value
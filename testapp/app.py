@@ -32,3 +32,4 @@ views.add('/session/clear', 'session_clear')
 views.add('/session/dump', 'session_dump')
 views.add('/success/<path:filename>', 'success')
 views.add('/upload', 'upload', methods=('GET', 'POST'))
+views.add('/upload/many', 'upload_many', methods=('GET', 'POST'))
@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+"""
+Benchmark test app against local fake Dropbox API server.
+
+Starts fake Dropbox API server and test app in current process, drives test
+app endpoints with given concurrency levels and reports throughput, p50/p99
+latency and peak RSS. Results are compared with stored baselines, so the
+script exits with non-zero status on performance regressions.
+
+No Dropbox account or network access is needed.
+"""
+
+import BaseHTTPServer
+import Cookie
+import SocketServer
+import hashlib
+import httplib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import urlparse
+import uuid
+
+from optparse import OptionParser
+
+from dropbox.rest import RESTClient
+from werkzeug.http import parse_range_header
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+
+DIRNAME = os.path.abspath(os.path.dirname(__file__))
+rel = lambda *parts: os.path.abspath(os.path.join(DIRNAME, *parts))
+
+BASELINES = rel('bench_baselines.json')
+FILE_SIZE = 256 * 1024
+SCENARIOS = ('callback', 'files', 'download', 'upload')
+
+
+class FakeDropboxHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serve minimal subset of Dropbox API used by test app. Dropbox SDK sends
+    absolute URLs in request line, so both API and content hosts are served
+    by the same handler.
+    """
+    content = os.urandom(FILE_SIZE)
+    latency = 0
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+        parts = url.path.split('/', 3)
+        time.sleep(self.latency)
+
+        if url.path == '/1/account/info':
+            return self.send_json({'display_name': 'Bench User',
+                                   'quota_info': {'normal': 0,
+                                                  'quota': 2 ** 31,
+                                                  'shared': 0},
+                                   'uid': 1})
+
+        if parts[2] == 'metadata':
+            data = self.folder_metadata()
+
+            if query.get('hash') == [data['hash']]:
+                return self.send_json({}, 304)
+
+            return self.send_json(data)
+
+        if parts[2] == 'files':
+            return self.send_file('/' + parts[3].split('/', 1)[1])
+
+        self.send_json({'error': 'Not found'}, 404)
+
+    def do_POST(self):
+        path = urlparse.urlparse(self.path).path
+        self.rfile.read(int(self.headers.get('content-length') or 0))
+        time.sleep(self.latency)
+
+        if path in ('/1/oauth/access_token', '/1/oauth/request_token'):
+            body = 'oauth_token_secret={0}&oauth_token={1}'.\
+                format(uuid.uuid4().hex, uuid.uuid4().hex)
+            return self.send_body(body, 'text/plain')
+
+        self.send_json({'error': 'Not found'}, 404)
+
+    def do_PUT(self):
+        path = urlparse.urlparse(self.path).path
+        length = int(self.headers.get('content-length') or 0)
+        self.rfile.read(length)
+        time.sleep(self.latency)
+
+        if path.startswith('/1/files_put/'):
+            name = '/' + path.split('/', 4)[4]
+            return self.send_json(self.file_metadata(name, length))
+
+        self.send_json({'error': 'Not found'}, 404)
+
+    def file_metadata(self, path, length=FILE_SIZE):
+        return {'bytes': length,
+                'is_dir': False,
+                'mime_type': 'application/octet-stream',
+                'modified': 'Mon, 01 Jul 2013 00:00:00 +0000',
+                'path': path,
+                'rev': '1',
+                'size': '{0} KB'.format(length // 1024)}
+
+    def folder_metadata(self):
+        contents = [self.file_metadata('/file{0}.bin'.format(i))
+                    for i in range(25)]
+        return {'contents': contents,
+                'hash': hashlib.md5(json.dumps(contents)).hexdigest(),
+                'is_dir': True,
+                'path': '/'}
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, body, content_type, status=200, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_file(self, path):
+        metadata = json.dumps(self.file_metadata(path))
+        byte_range = parse_range_header(self.headers.get('range'))
+        headers = {'x-dropbox-metadata': metadata}
+
+        if byte_range is None:
+            return self.send_body(self.content,
+                                  'application/octet-stream',
+                                  headers=headers)
+
+        start, stop = byte_range.range_for_length(len(self.content))
+        headers['Content-Range'] = \
+            'bytes {0}-{1}/{2}'.format(start, stop - 1, len(self.content))
+
+        self.send_body(self.content[start:stop],
+                       'application/octet-stream',
+                       206,
+                       headers)
+
+    def send_json(self, data, status=200):
+        self.send_body(json.dumps(data), 'application/json', status)
+
+
+class FakeDropboxServer(SocketServer.ThreadingMixIn,
+                        BaseHTTPServer.HTTPServer):
+    """
+    Threaded fake Dropbox API server.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """
+    Do not log each request to test app.
+    """
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class BenchClient(object):
+    """
+    Minimal HTTP client for test app, which keeps session cookie.
+    """
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.cookies = {}
+
+    def login(self):
+        """
+        Go through login flow, return duration of callback request.
+        """
+        response = self.request('GET', '/dropbox/login')
+        location = urlparse.urlparse(response.getheader('location'))
+        token = urlparse.parse_qs(location.query)['oauth_token'][0]
+
+        start = time.time()
+        response = self.request('GET',
+                                '/dropbox/callback?oauth_token=' + token)
+        duration = time.time() - start
+
+        assert response.status == 302, response.status
+        return duration
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+
+        if self.cookies:
+            headers['Cookie'] = '; '.join(
+                ['{0}={1}'.format(*item) for item in self.cookies.items()]
+            )
+
+        conn = httplib.HTTPConnection(self.host, self.port)
+
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            response.read()
+        finally:
+            conn.close()
+
+        cookie = Cookie.SimpleCookie(response.getheader('set-cookie') or '')
+
+        for name, morsel in cookie.items():
+            self.cookies[name] = morsel.value
+
+        return response
+
+    def timed(self, method, path, body=None, headers=None, status=200):
+        start = time.time()
+        response = self.request(method, path, body, headers)
+        duration = time.time() - start
+
+        assert response.status == status, response.status
+        return duration
+
+    def upload(self, content):
+        boundary = uuid.uuid4().hex
+        body = ('--{0}\r\nContent-Disposition: form-data; name="file"; '
+                'filename="bench.bin"\r\nContent-Type: '
+                'application/octet-stream\r\n\r\n{1}\r\n--{0}--\r\n'.
+                format(boundary, content))
+        headers = {'Content-Type':
+                   'multipart/form-data; boundary={0}'.format(boundary)}
+        return self.timed('POST', '/upload', body, headers, 302)
+
+
+def compare(results, baselines, tolerance):
+    """
+    Compare results with baselines, return list of regressions. p99 latency
+    is much noisier than p50, so it is allowed to regress twice more.
+    """
+    regressions = []
+
+    for key, result in sorted(results.items()):
+        baseline = baselines.get(key)
+
+        if not baseline:
+            continue
+
+        if result['rps'] < baseline['rps'] * (1 - tolerance):
+            regressions.append('{0}: throughput {1:.1f} < {2:.1f} req/s'.
+                               format(key, result['rps'], baseline['rps']))
+
+        if result['p50'] > baseline['p50'] * (1 + tolerance):
+            regressions.append('{0}: p50 {1:.1f} > {2:.1f} ms'.
+                               format(key, result['p50'], baseline['p50']))
+
+        if result['p99'] > baseline['p99'] * (1 + 2 * tolerance):
+            regressions.append('{0}: p99 {1:.1f} > {2:.1f} ms'.
+                               format(key, result['p99'], baseline['p99']))
+
+    return regressions
+
+
+def percentile(values, value):
+    """
+    Return percentile of sorted list of values.
+    """
+    index = int(round((len(values) - 1) * value / 100.0))
+    return values[index]
+
+
+def run_scenario(name, port, concurrency, requests):
+    """
+    Run ``requests`` requests of scenario in ``concurrency`` threads, return
+    list of request durations and total wall time.
+    """
+    content = os.urandom(FILE_SIZE)
+    durations = []
+    errors = []
+    lock = threading.Lock()
+
+    def work(count):
+        client = BenchClient('127.0.0.1', port)
+        client.login()
+
+        for _ in range(count):
+            try:
+                if name == 'callback':
+                    duration = client.login()
+                elif name == 'files':
+                    duration = client.timed('GET', '/files')
+                elif name == 'download':
+                    duration = client.timed('GET', '/download/file0.bin')
+                else:
+                    duration = client.upload(content)
+            except Exception as err:
+                with lock:
+                    errors.append(err)
+            else:
+                with lock:
+                    durations.append(duration)
+
+    counts = [requests // concurrency + (i < requests % concurrency)
+              for i in range(concurrency)]
+    threads = [threading.Thread(target=work, args=(count, ))
+               for count in counts]
+
+    start = time.time()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise RuntimeError('{0} requests of {1!r} scenario failed, first '
+                           'error: {2!r}'.format(len(errors), name, errors[0]))
+
+    return sorted(durations), time.time() - start
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-c', '--concurrency', default='1,4,16',
+                      help='Comma-separated concurrency levels.')
+    parser.add_option('-n', '--requests', default=200, type='int',
+                      help='Number of requests per scenario and level.')
+    parser.add_option('-s', '--scenarios', default=','.join(SCENARIOS),
+                      help='Comma-separated scenarios to run.')
+    parser.add_option('-l', '--latency', default=0, type='float',
+                      help='Latency of fake Dropbox API, in milliseconds.')
+    parser.add_option('-b', '--baselines', default=BASELINES,
+                      help='Path to baselines file.')
+    parser.add_option('-t', '--tolerance', default=0.3, type='float',
+                      help='Allowed regression against baselines.')
+    parser.add_option('--save', action='store_true', default=False,
+                      help='Store results as new baselines.')
+    options, _ = parser.parse_args(argv)
+
+    # Setup fake Dropbox API server and route all SDK connections to it
+    FakeDropboxHandler.latency = options.latency / 1000.0
+    server = FakeDropboxServer(('127.0.0.1', 0), FakeDropboxHandler)
+    server_port = server.server_address[1]
+
+    RESTClient.IMPL.http_connect = \
+        lambda host, port: httplib.HTTPConnection('127.0.0.1', server_port)
+
+    # Setup test app
+    from testapp.app import app
+
+    app.config['TESTING'] = False
+    app_server = make_server('127.0.0.1',
+                             0,
+                             app,
+                             threaded=True,
+                             request_handler=QuietRequestHandler)
+    app_server.request_queue_size = 128
+    port = app_server.server_address[1]
+
+    for target in (server.serve_forever, app_server.serve_forever):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+
+    results = {}
+
+    print('{0:<24} {1:>10} {2:>10} {3:>10} {4:>12}'.
+          format('scenario', 'req/s', 'p50, ms', 'p99, ms', 'peak RSS, MB'))
+
+    for name in options.scenarios.split(','):
+        for concurrency in map(int, options.concurrency.split(',')):
+            durations, total = \
+                run_scenario(name, port, concurrency, options.requests)
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+            key = '{0}:{1}'.format(name, concurrency)
+            results[key] = {'p50': round(percentile(durations, 50) * 1000, 1),
+                            'p99': round(percentile(durations, 99) * 1000, 1),
+                            'rps': round(len(durations) / total, 1),
+                            'rss': round(rss / 1024.0, 1)}
+
+            print('{0:<24} {rps:>10.1f} {p50:>10.1f} {p99:>10.1f} '
+                  '{rss:>12.1f}'.format(key, **results[key]))
+
+    if options.save:
+        with open(options.baselines, 'w+') as handler:
+            json.dump(results,
+                      handler,
+                      indent=2,
+                      separators=(',', ': '),
+                      sort_keys=True)
+            handler.write('\n')
+
+        print('Baselines saved to {0!r}.'.format(options.baselines))
+        return 0
+
+    if not os.path.isfile(options.baselines):
+        print('No baselines found at {0!r}.'.format(options.baselines))
+        return 0
+
+    with open(options.baselines) as handler:
+        baselines = json.load(handler)
+
+    regressions = compare(results, baselines, options.tolerance)
+
+    if regressions:
+        print('\nRegressions against baselines:')
+
+        for regression in regressions:
+            print('  ' + regression)
+
+        return 1
+
+    print('\nNo regressions against baselines.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,132 +1,1999 @@
 import copy
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+import unittest
+import urllib
+import zipfile
+
+# Simple manipulation to use ``unittest2`` if current Python version is
+# less than 2.7
+if not hasattr(unittest.TestCase, 'assertIn'):
+    import unittest2 as unittest
 
 try:
-    import cPickle as pickle
+    from cStringIO import StringIO
 except ImportError:
-    import pickle
+    from StringIO import StringIO
+
+from datetime import datetime
+from random import choice
+from string import digits, letters
+
+from dropbox.client import DropboxClient
+from dropbox.rest import ErrorResponse, RESTClient
+from dropbox.session import DropboxSession
+from flask import session, url_for
+from flask.ext.dropbox import Dropbox, DropboxBlueprint, archive
+from flask.ext.dropbox.cache import FileSystemCache, MemoryCache, \
+    ObjectCache, WerkzeugCache, make_cache
+from flask.ext.dropbox.client import SingleFlight
+from flask.ext.dropbox.extension import OAuthToken
+from flask.ext.dropbox.pool import ClientPool
+from flask.ext.dropbox.retry import CircuitBreaker, RetryPolicy
+from flask.ext.dropbox.exceptions import CallBudgetExceeded, \
+    CircuitOpenError
+from flask.ext.dropbox.executor import Executor
+from flask.ext.dropbox.futures import gather
+from flask.ext.dropbox.index import MetadataIndex
+from flask.ext.dropbox.signals import api_call
+from flask.ext.dropbox.settings import ACCOUNT_INFO_CACHE_KEY, \
+    CLIENT_CACHE_KEY, DROPBOX_ACCESS_TOKEN_KEY, \
+    DROPBOX_REQUEST_TOKEN_EXPIRES_KEY, DROPBOX_REQUEST_TOKEN_KEY, \
+    UPLOAD_CACHE_KEY
+from flask.ext.dropbox.stats import LatencyHistogram
+from flask.ext.dropbox.thumbnails import ThumbnailCache
+from flask.ext.dropbox.tokens import MemoryTokenStore, make_token_store
+from flask.ext.dropbox.upload import ChunkedUpload
+from flask.ext.dropbox.utils import safe_url_for
+from flask.ext.dropbox.views import _iter_archive_entries, stream_file
+from mock import MagicMock
+from werkzeug.contrib.cache import SimpleCache
+from werkzeug.http import http_date, parse_range_header
+from werkzeug.routing import BuildError as RoutingBuildError
+
+from testapp.app import app, dropbox
+
+
+TEST_ACCOUNT_INFO = {
+    'referral_link': 'https://www.dropbox.com/referrals/TI2MDQ0MDAzO',
+    'display_name': 'Igor Davydenko',
+    'uid': 604400,
+    'country': 'UA',
+    'quota_info': {
+        'shared': 0,
+        'quota': 5637144576,
+        'normal': 4143008,
+    },
+    'email': 'playpauseandstop@gmail.com',
+}
+TEST_MEDIA = {
+    'url': 'https://dl.dropbox.com/0/view/qlfzirhc4zrln/Apps/Lyrics/redis.pdf',
+    'expires': 'Fri, 20 Apr 2012 19:58:37 +0000'
+}
+TEST_METADATA = {
+    'hash': 'cad3db434d253eb9351c9ef4734eac0d',
+    'thumb_exists': False,
+    'bytes': 0,
+    'path': '/',
+    'is_dir': True,
+    'icon': 'folder',
+    'root': 'app_folder',
+    'contents': [
+        {
+            'size': '200.9 KB',
+            'rev': '19070b1ff3',
+            'thumb_exists': False,
+            'bytes': 205736,
+            'modified': 'Fri, 20 Apr 2012 15:53:56 +0000',
+            'mime_type': 'application/pdf',
+            'path': '/redis.pdf',
+            'is_dir': False,
+            'icon': 'page_white_acrobat',
+            'root': 'dropbox',
+            'client_mtime': 'Fri, 20 Apr 2012 15:53:56 +0000',
+            'revision': 1
+        }
+    ],
+    'size': '0 bytes'
+}
+TEST_METADATA_EMPTY = {
+    'hash': 'b00f9ab62e3bfe61736c6d249e729b41',
+    'thumb_exists': False,
+    'bytes': 0,
+    'path': '/',
+    'is_dir': True,
+    'icon': 'folder',
+    'root': 'app_folder',
+    'contents': [],
+    'size': '0 bytes'
+}
+
+
+def make_error_response(status, body='', headers=None):
+    http_resp = MagicMock(status=status, reason='Error')
+    http_resp.read.return_value = body
+    http_resp.getheaders.return_value = headers or []
+    return ErrorResponse(http_resp)
+
+
+class FakeHTTPResponse(object):
+    """
+    Minimal ``httplib.HTTPResponse`` replacement.
+    """
+    def __init__(self, status, body='', headers=None):
+        self.status = status
+        self.reason = 'Reason'
+        self.headers = dict(headers or {})
+        self.body = StringIO(body)
+
+    def close(self):
+        pass
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def getheaders(self):
+        return list(self.headers.items())
+
+    def read(self, size=-1):
+        return self.body.read(size)
+
+
+def make_fake_connection(content, metadata):
+    """
+    Make HTTP connection class which serves ``content`` as Dropbox file and
+    supports ``Range`` header.
+    """
+    class FakeConnection(object):
+
+        def __init__(self, host, port):
+            self.response = None
+
+        def getresponse(self):
+            return self.response
+
+        def request(self, method, url, body=None, headers=None):
+            byte_range = parse_range_header((headers or {}).get('Range'))
+            response_headers = {'x-dropbox-metadata': json.dumps(metadata)}
+
+            if byte_range is None:
+                self.response = \
+                    FakeHTTPResponse(200, content, response_headers)
+                return
+
+            value = byte_range.range_for_length(len(content))
+
+            if value is None:
+                response_headers['content-range'] = \
+                    'bytes */{0}'.format(len(content))
+                self.response = FakeHTTPResponse(416, '', response_headers)
+                return
+
+            start, stop = value
+            content_range = byte_range.make_content_range(len(content))
+            response_headers.update({
+                'content-length': str(stop - start),
+                'content-range': content_range.to_header()
+            })
+            self.response = \
+                FakeHTTPResponse(206, content[start:stop], response_headers)
+
+    return FakeConnection
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        app.config['DROPBOX_CACHE_STORAGE'] = 'self'
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+
+        key = ''.join(choice(letters + digits) for _ in range(12))
+        secret = ''.join(choice(letters + digits) for _ in range(16))
+        self.token = OAuthToken(key, secret)
+
+    def tearDown(self):
+        app.config['TESTING'] = False
+
+
+class TestDropboxArchive(TestCase):
+
+    def setUp(self):
+        super(TestDropboxArchive, self).setUp()
+
+        self.files = {
+            '/Photos/cat.jpg': 'cat' * 100,
+            '/Photos/2013/dog.jpg': 'dog' * 1000,
+            u'/Photos/2013/\u043a\u0456\u0442.txt': '',
+        }
+        self.folders = {
+            '/Photos': ['/Photos/2013', '/Photos/Empty', '/Photos/cat.jpg'],
+            '/Photos/2013': ['/Photos/2013/dog.jpg',
+                             u'/Photos/2013/\u043a\u0456\u0442.txt'],
+            '/Photos/Empty': [],
+        }
+
+        self.old_get_file = DropboxClient.get_file
+        DropboxClient.get_file = MagicMock(side_effect=self.get_file)
+
+        self.old_metadata = DropboxClient.metadata
+        DropboxClient.metadata = MagicMock(side_effect=self.get_metadata)
+
+        with app.test_request_context():
+            self.archive_url = url_for('dropbox.archive', path='Photos')
+
+    def tearDown(self):
+        DropboxClient.get_file = self.old_get_file
+        DropboxClient.metadata = self.old_metadata
+
+        archive.ZIP64_COUNT_LIMIT = 0xFFFF
+        archive.ZIP64_LIMIT = 0xFFFFFFFF
+
+        dropbox.DROPBOX_MAX_CALLS_ACTION = None
+        dropbox.DROPBOX_MAX_CALLS_PER_REQUEST = None
+
+        super(TestDropboxArchive, self).tearDown()
+
+    def get_file(self, path, rev=None):
+        if path not in self.files:
+            raise make_error_response(404)
+        return FakeHTTPResponse(200, self.files[path])
+
+    def get_metadata(self, path, list=True, **kwargs):
+        path = '/' + path.strip('/')
+
+        if path in self.files:
+            return self.make_metadata(path)
+
+        if path not in self.folders:
+            raise make_error_response(404)
+
+        return dict(self.make_metadata(path),
+                    contents=[self.make_metadata(item)
+                              for item in self.folders[path]])
+
+    def make_metadata(self, path):
+        return {'bytes': len(self.files.get(path, '')),
+                'is_dir': path in self.folders,
+                'modified': 'Fri, 20 Apr 2012 15:53:56 +0000',
+                'path': path,
+                'rev': '1'}
+
+    def read_zip(self, data):
+        archive_file = zipfile.ZipFile(StringIO(data))
+        self.assertIsNone(archive_file.testzip())
+        return dict([(info.filename, archive_file.read(info))
+                     for info in archive_file.infolist()])
+
+    def test_archive_view(self):
+        response = self.app.get(self.archive_url)
+        self.assertEqual(response.status_code, 403)
+
+        with self.app.session_transaction() as sess:
+            sess[DROPBOX_ACCESS_TOKEN_KEY] = [self.token.key,
+                                              self.token.secret]
+
+        response = self.app.get(self.archive_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/zip')
+        self.assertIn('filename="Photos.zip"',
+                      response.headers['Content-Disposition'])
+        self.assertEqual(self.read_zip(response.data), {
+            'Photos/2013/': '',
+            'Photos/2013/dog.jpg': self.files['/Photos/2013/dog.jpg'],
+            u'Photos/2013/\u043a\u0456\u0442.txt': '',
+            'Photos/Empty/': '',
+            'Photos/cat.jpg': self.files['/Photos/cat.jpg'],
+        })
+
+        with app.test_request_context():
+            for path in ('Photos/cat.jpg', 'Videos'):
+                url = url_for('dropbox.archive', path=path)
+                self.assertEqual(self.app.get(url).status_code, 404)
+
+    def test_archive_view_lazy_listing(self):
+        self.folders['/'] = ['/Photos']
+
+        with self.app.session_transaction() as sess:
+            sess[DROPBOX_ACCESS_TOKEN_KEY] = [self.token.key,
+                                              self.token.secret]
+
+        with app.test_request_context():
+            url = url_for('dropbox.archive')
+
+        # Subfolders are listed while streaming, out of request budget
+        dropbox.DROPBOX_MAX_CALLS_ACTION = 'raise'
+        dropbox.DROPBOX_MAX_CALLS_PER_REQUEST = 1
+
+        response = self.app.get(url, buffered=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('filename="Dropbox.zip"',
+                      response.headers['Content-Disposition'])
+        self.assertEqual(DropboxClient.metadata.call_count, 1)
+
+        data = self.read_zip(response.data)
+        self.assertEqual(DropboxClient.metadata.call_count, 4)
+        self.assertEqual(sorted(data), [
+            'Dropbox/Photos/',
+            'Dropbox/Photos/2013/',
+            'Dropbox/Photos/2013/dog.jpg',
+            u'Dropbox/Photos/2013/\u043a\u0456\u0442.txt',
+            'Dropbox/Photos/Empty/',
+            'Dropbox/Photos/cat.jpg',
+        ])
+
+    def test_iter_archive_entries(self):
+        executor = MagicMock()
+        executor.submit.side_effect = \
+            lambda func, *args: Executor(1).submit(func, *args)
+
+        client = DropboxClient(None)
+        items = [('Photos/{0}'.format(path.rsplit('/', 1)[1]),
+                  self.make_metadata(path))
+                 for path in ('/Photos/cat.jpg', '/Photos/2013/dog.jpg',
+                              '/Photos/missing.jpg', '/Photos/Empty')]
+
+        entries = _iter_archive_entries(client, executor, items, 1)
+        name, date_time, file_obj, size = next(entries)
+
+        # Only current file and prefetch window are requested
+        self.assertEqual(executor.submit.call_count, 2)
+        self.assertEqual((name, size), ('Photos/cat.jpg', 300))
+        self.assertEqual(date_time, datetime(2012, 4, 20, 15, 53, 56))
+        self.assertEqual(file_obj.read(), self.files['/Photos/cat.jpg'])
+
+        # Removed files are skipped
+        self.assertEqual([entry[0] for entry in entries],
+                         ['Photos/dog.jpg', 'Photos/Empty'])
+        self.assertEqual(executor.submit.call_count, 3)
+
+    def test_iter_zip(self):
+        date_time = datetime(2013, 5, 17, 10, 20, 30)
+        entries = [('dir/', date_time, None, 0),
+                   ('dir/a.txt', date_time, StringIO('a' * 1000), 1000),
+                   ('b.txt', None, StringIO('b'), 1)]
+
+        data = ''.join(archive.iter_zip(entries, 100))
+        info = zipfile.ZipFile(StringIO(data)).getinfo('dir/a.txt')
+
+        self.assertEqual(info.date_time, (2013, 5, 17, 10, 20, 30))
+        self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(self.read_zip(data),
+                         {'dir/': '', 'dir/a.txt': 'a' * 1000, 'b.txt': 'b'})
+
+    def test_iter_zip64(self):
+        archive.ZIP64_COUNT_LIMIT = 2
+        archive.ZIP64_LIMIT = 10
+
+        entries = [('a.txt', None, StringIO('a' * 100), 100),
+                   ('b.txt', None, StringIO('b'), 1),
+                   ('c/', None, None, 0)]
+
+        data = ''.join(archive.iter_zip(entries, 30))
+        self.assertEqual(self.read_zip(data),
+                         {'a.txt': 'a' * 100, 'b.txt': 'b', 'c/': ''})
+
+
+class TestDropboxBlueprint(TestCase):
+
+    def test_init(self):
+        self.assertIn('dropbox', app.blueprints)
+        self.assertEqual(app.blueprints['dropbox'].name, 'dropbox')
+
+        name = 'dropbox_blueprint'
+        import_name = DropboxBlueprint.__module__
+        self.assertRaises(TypeError, DropboxBlueprint, name, import_name)
+
+        blueprint = DropboxBlueprint(name=name,
+                                     import_name=import_name)
+        self.assertEqual(blueprint.name, name)
+
+    def test_view_functions(self):
+        self.assertIn('dropbox.archive', app.view_functions)
+        self.assertIn('dropbox.callback', app.view_functions)
+        self.assertIn('dropbox.login', app.view_functions)
+        self.assertIn('dropbox.logout', app.view_functions)
+        self.assertIn('dropbox.search', app.view_functions)
+        self.assertIn('dropbox.stats', app.view_functions)
+        self.assertIn('dropbox.thumbnail', app.view_functions)
+        self.assertIn('dropbox.upload_status', app.view_functions)
+
+        with app.test_request_context():
+            self.assertEqual(url_for('dropbox.archive', path='a/b'),
+                             '/dropbox/archive/a/b')
+            self.assertEqual(url_for('dropbox.archive'), '/dropbox/archive/')
+            self.assertEqual(url_for('dropbox.callback'), '/dropbox/callback')
+            self.assertEqual(url_for('dropbox.login'), '/dropbox/login')
+            self.assertEqual(url_for('dropbox.logout'), '/dropbox/logout')
+            self.assertEqual(url_for('dropbox.search'), '/dropbox/search')
+            self.assertEqual(url_for('dropbox.stats'), '/dropbox/stats')
+            self.assertEqual(url_for('dropbox.thumbnail', path='a/b.jpg'),
+                             '/dropbox/thumbnails/a/b.jpg')
+            self.assertEqual(url_for('dropbox.upload_status', job_id='abc'),
+                             '/dropbox/uploads/abc')
+
+
+class TestDropboxCache(TestCase):
+
+    def setUp(self):
+        super(TestDropboxCache, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        if hasattr(self, 'old_account_info'):
+            DropboxClient.account_info = self.old_account_info
+        if hasattr(self, 'old_media'):
+            DropboxClient.media = self.old_media
+        if hasattr(self, 'old_metadata'):
+            DropboxClient.metadata = self.old_metadata
+        if hasattr(self, 'old_share'):
+            DropboxClient.share = self.old_share
+        if hasattr(self, 'old_delta'):
+            DropboxClient.delta = self.old_delta
+        if hasattr(self, 'old_put_file'):
+            DropboxClient.put_file = self.old_put_file
+        if hasattr(self, 'old_file_delete'):
+            DropboxClient.file_delete = self.old_file_delete
+
+        app.config.pop('DROPBOX_INDEX_DIR', None)
+        app.config.pop('DROPBOX_MISSING_TTL', None)
+
+        shutil.rmtree(self.cache_dir)
+        app.config['DROPBOX_CACHE_STORAGE'] = None
+        app.extensions['dropbox'] = dropbox
+        super(TestDropboxCache, self).tearDown()
+
+    def check_cache(self, cache):
+        self.assertIsNone(cache.get('key'))
+        self.assertFalse(cache.has('key'))
+
+        cache.set('key', {'value': 1})
+        self.assertEqual(cache.get('key'), {'value': 1})
+        self.assertTrue(cache.has('key'))
+
+        cache.set_many({'first': 1, 'second': 2})
+        self.assertEqual(cache.get_many('first', 'second', 'third'),
+                         [1, 2, None])
+
+        cache.delete('key')
+        self.assertIsNone(cache.get('key'))
+
+        cache.delete_many('first', 'second')
+        self.assertEqual(cache.get_many('first', 'second'), [None, None])
+
+    def test_filesystem_cache(self):
+        cache = FileSystemCache(self.cache_dir, threshold=2)
+        self.check_cache(cache)
+        self.assertFalse(cache.local)
+
+        cache.set('key', 'value', timeout=-1)
+        self.assertIsNone(cache.get('key'))
+
+        for i in range(5):
+            cache.set('key{0}'.format(i), i)
+        self.assertTrue(len(cache._list_dir()) <= 2)
+
+    def test_filesystem_cache_private_dir(self):
+        cache_dir = os.path.join(self.cache_dir, 'private')
+        FileSystemCache(cache_dir)
+        self.assertEqual(os.stat(cache_dir).st_mode & 0777 & ~0700, 0)
+
+        os.chmod(cache_dir, 0777)
+        self.assertRaises(ValueError, FileSystemCache, cache_dir)
+
+    def test_memory_cache(self):
+        cache = MemoryCache(max_size=2)
+        self.check_cache(cache)
+
+        cache.set('key', 'value', timeout=-1)
+        self.assertIsNone(cache.get('key'))
+
+        cache.set('first', 1)
+        cache.set('second', 2)
+        cache.get('first')
+        cache.set('third', 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get_many('first', 'second', 'third'),
+                         [1, None, 3])
+
+    def test_object_cache(self):
+        cache = ObjectCache(type('Storage', (object, ), {})())
+        self.check_cache(cache)
+
+        cache.set('key', 'value', timeout=-1)
+        self.assertIsNone(cache.get('key'))
+        self.assertFalse(hasattr(cache.obj, 'key'))
+
+    def test_werkzeug_cache(self):
+        cache = WerkzeugCache(SimpleCache())
+        self.check_cache(cache)
+        self.assertFalse(cache.local)
+
+    def test_dropbox_metadata_missing(self):
+        app.config['DROPBOX_CACHE_STORAGE'] = 'memory'
+        app.config['DROPBOX_INDEX_DIR'] = self.cache_dir
+        dropbox_obj = Dropbox(app)
+        token = [self.token.key, self.token.secret]
+
+        self.old_metadata = DropboxClient.metadata
+        DropboxClient.metadata = MagicMock(side_effect=make_error_response(
+            404, '{"error": "Path not found"}'
+        ))
+        self.old_put_file = DropboxClient.put_file
+        DropboxClient.put_file = MagicMock(return_value=TEST_METADATA)
+        self.old_delta = DropboxClient.delta
+        DropboxClient.delta = MagicMock(return_value={
+            'cursor': 'c1',
+            'entries': [['/config/b.json', {'is_dir': False,
+                                            'path': '/Config/b.json'}]],
+            'has_more': False,
+            'reset': False
+        })
+
+        def probe(*paths):
+            with app.test_request_context():
+                session[DROPBOX_ACCESS_TOKEN_KEY] = token
+
+                for path in paths:
+                    with self.assertRaises(ErrorResponse) as context:
+                        dropbox_obj.metadata(path)
+
+                    self.assertEqual(context.exception.status, 404)
+                    self.assertEqual(context.exception.error_msg,
+                                     'Path not found')
+
+        probe('/Config', '/Config/a.json', '/Config/b.json')
+        probe('/config', '/config/a.json', '/config/b.json/')
+        self.assertEqual(DropboxClient.metadata.call_count, 3)
+
+        # Writes through extension forget written path and its parents
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            dropbox_obj.client.put_file('/Config/a.json', StringIO('{}'))
+
+        probe('/Config/b.json')
+        probe('/Config', '/Config/a.json')
+        self.assertEqual(DropboxClient.metadata.call_count, 5)
+
+        # And so does delta update
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            dropbox_obj.index
+
+        probe('/Config/b.json')
+        self.assertEqual(DropboxClient.metadata.call_count, 6)
+
+        # Negative caching could be disabled
+        app.config['DROPBOX_MISSING_TTL'] = 0
+        dropbox_obj = Dropbox(app)
+
+        probe('/Config/c.json', '/Config/c.json')
+        self.assertEqual(DropboxClient.metadata.call_count, 8)
+
+    def test_make_cache(self):
+        self.assertIsInstance(make_cache('memory'), MemoryCache)
+        self.assertIsInstance(make_cache(SimpleCache()), WerkzeugCache)
+
+        cache = make_cache('filesystem', cache_dir=self.cache_dir)
+        self.assertIsInstance(cache, FileSystemCache)
+        self.assertEqual(cache.cache_dir, self.cache_dir)
+
+        cache = make_cache('self', dropbox, max_size=10)
+        self.assertIsInstance(cache, MemoryCache)
+        self.assertEqual(cache.max_size, 10)
+
+        storage = type('Storage', (object, ), {})()
+        cache = make_cache(storage, default_timeout=60)
+        self.assertIsInstance(cache, ObjectCache)
+        self.assertIs(cache.obj, storage)
+        self.assertEqual(cache.default_timeout, 60)
+
+    def test_dropbox_cache_storage(self):
+        app.config['DROPBOX_CACHE_STORAGE'] = 'memory'
+        dropbox_obj = Dropbox(app)
+        token = [self.token.key, self.token.secret]
+
+        self.assertIsInstance(dropbox_obj.cache_storage, MemoryCache)
+        self.assertIs(dropbox_obj.objects_storage, dropbox_obj.cache_storage)
+
+        with app.test_request_context():
+            anonymous_key = dropbox_obj.cache_key('key')
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            self.assertNotEqual(dropbox_obj.cache_key('key'), anonymous_key)
+
+            client = dropbox_obj.client
+            self.assertIs(dropbox_obj.client, client)
+
+            dropbox_obj.logout()
+            self.assertIsNone(
+                dropbox_obj.cache_storage.get(
+                    dropbox_obj.cache_key(CLIENT_CACHE_KEY)
+                )
+            )
+
+    def test_dropbox_account_info(self):
+        app.config['DROPBOX_CACHE_STORAGE'] = 'memory'
+        app.config['DROPBOX_ACCOUNT_INFO_TTL'] = 60
+        dropbox_obj = Dropbox(app)
+        token = [self.token.key, self.token.secret]
+
+        self.old_account_info = DropboxClient.account_info
+        DropboxClient.account_info = MagicMock(return_value=TEST_ACCOUNT_INFO)
+
+        for _ in range(2):
+            with app.test_request_context():
+                session[DROPBOX_ACCESS_TOKEN_KEY] = token
+                self.assertEqual(dropbox_obj.account_info, TEST_ACCOUNT_INFO)
+
+        self.assertEqual(DropboxClient.account_info.call_count, 1)
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            dropbox_obj.invalidate_account_info()
+            self.assertEqual(dropbox_obj.account_info, TEST_ACCOUNT_INFO)
+
+        self.assertEqual(DropboxClient.account_info.call_count, 2)
+        del app.config['DROPBOX_ACCOUNT_INFO_TTL']
+
+    def test_dropbox_account_info_writes(self):
+        app.config['DROPBOX_CACHE_STORAGE'] = 'memory'
+        dropbox_obj = Dropbox(app)
+        token = [self.token.key, self.token.secret]
+
+        self.old_account_info = DropboxClient.account_info
+        DropboxClient.account_info = MagicMock(return_value=TEST_ACCOUNT_INFO)
+
+        self.old_file_delete = DropboxClient.file_delete
+        DropboxClient.file_delete = MagicMock(return_value={})
+
+        self.old_put_file = DropboxClient.put_file
+        DropboxClient.put_file = MagicMock(return_value={'bytes': 7})
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            dropbox_obj.account_info
+
+            key = dropbox_obj.cache_key(ACCOUNT_INFO_CACHE_KEY)
+            expires = dropbox_obj.cache_storage._data[key][1]
+            self.assertAlmostEqual(expires, time.time() + 300, delta=5)
+
+            dropbox_obj.client.file_delete('/file.txt')
+            dropbox_obj.account_info
+
+            dropbox_obj.upload(StringIO('content'), '/file.txt')
+            dropbox_obj.account_info
+
+        self.assertEqual(DropboxClient.account_info.call_count, 3)
+
+    def test_dropbox_media_url(self):
+        app.config['DROPBOX_CACHE_STORAGE'] = 'memory'
+        dropbox_obj = Dropbox(app)
+        token = [self.token.key, self.token.secret]
+
+        expires = http_date(time.time() + 3600)
+        self.old_media = DropboxClient.media
+        DropboxClient.media = MagicMock(
+            return_value={'url': TEST_MEDIA['url'], 'expires': expires}
+        )
+        self.old_share = DropboxClient.share
+        DropboxClient.share = MagicMock(
+            return_value={'url': 'https://db.tt/c0mFuu1Y', 'expires': expires}
+        )
+
+        for _ in range(2):
+            with app.test_request_context():
+                session[DROPBOX_ACCESS_TOKEN_KEY] = token
+                self.assertEqual(dropbox_obj.media_url('/redis.pdf'),
+                                 TEST_MEDIA['url'])
+                self.assertEqual(dropbox_obj.share_url('/redis.pdf'),
+                                 'https://db.tt/c0mFuu1Y')
+
+        self.assertEqual(DropboxClient.media.call_count, 1)
+        self.assertEqual(DropboxClient.share.call_count, 1)
+
+        # Links which expire soon are not cached
+        DropboxClient.media.return_value = TEST_MEDIA
+
+        for _ in range(2):
+            with app.test_request_context():
+                session[DROPBOX_ACCESS_TOKEN_KEY] = token
+                self.assertEqual(dropbox_obj.media_url('/lyrics.pdf'),
+                                 TEST_MEDIA['url'])
+
+        self.assertEqual(DropboxClient.media.call_count, 3)
+
+    def test_dropbox_metadata(self):
+        app.config['DROPBOX_CACHE_STORAGE'] = 'memory'
+        dropbox_obj = Dropbox(app)
+        token = [self.token.key, self.token.secret]
+
+        self.old_metadata = DropboxClient.metadata
+        DropboxClient.metadata = MagicMock(return_value=TEST_METADATA)
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            self.assertEqual(dropbox_obj.metadata('/'), TEST_METADATA)
+
+        DropboxClient.metadata = \
+            MagicMock(side_effect=make_error_response(304))
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            self.assertEqual(dropbox_obj.metadata('/'), TEST_METADATA)
+
+        DropboxClient.metadata.assert_called_once_with(
+            '/', True, hash=TEST_METADATA['hash']
+        )
+
+        DropboxClient.metadata = MagicMock(return_value=TEST_METADATA_EMPTY)
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            self.assertEqual(dropbox_obj.metadata('/'), TEST_METADATA_EMPTY)
+
+        DropboxClient.metadata = \
+            MagicMock(side_effect=make_error_response(404))
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            self.assertRaises(ErrorResponse, dropbox_obj.metadata, '/')
+
+
+class TestDropboxClientPool(TestCase):
+
+    def setUp(self):
+        super(TestDropboxClientPool, self).setUp()
+        app.config['DROPBOX_CLIENT_POOL'] = True
+
+    def tearDown(self):
+        app.config['DROPBOX_CLIENT_POOL'] = False
+        app.config['DROPBOX_CLIENT_POOL_TTL'] = None
+        app.extensions['dropbox'] = dropbox
+        super(TestDropboxClientPool, self).tearDown()
+
+    def test_client_pool(self):
+        pool = ClientPool(max_size=2, ttl=0)
+
+        first = pool.get('first', object)
+        self.assertIs(pool.get('first', object), first)
+
+        second = pool.get('second', object)
+        pool.get('first', object)
+        pool.get('third', object)
+
+        self.assertEqual(len(pool), 2)
+        self.assertIn('first', pool)
+        self.assertNotIn('second', pool)
+
+        pool.remove('first')
+        self.assertNotIn('first', pool)
+
+        pool.clear()
+        self.assertEqual(len(pool), 0)
+
+    def test_client_pool_ttl(self):
+        pool = ClientPool(ttl=60)
+
+        first = pool.get('first', object)
+        token, (client, atime) = list(pool._clients.items())[0]
+        pool._clients[token] = (client, atime - 60)
+
+        self.assertIsNot(pool.get('first', object), first)
+
+    def test_dropbox_client_pool(self):
+        dropbox_obj = Dropbox(app)
+        self.assertEqual(dropbox_obj.client_pool.ttl, 300)
+
+        app.config['DROPBOX_CLIENT_POOL_TTL'] = 0
+        self.assertEqual(Dropbox(app).client_pool.ttl, 0)
+
+        dropbox_obj = Dropbox(app)
+        token = [self.token.key, self.token.secret]
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            client = dropbox_obj.client
+            self.assertIn(tuple(token), dropbox_obj.client_pool)
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            dropbox_obj.objects_storage.delete(
+                dropbox_obj.cache_key(CLIENT_CACHE_KEY)
+            )
+            self.assertIs(dropbox_obj.client, client)
+
+            dropbox_obj.logout()
+            self.assertNotIn(tuple(token), dropbox_obj.client_pool)
+
+
+class TestDropboxFutures(TestCase):
+
+    def setUp(self):
+        super(TestDropboxFutures, self).setUp()
+
+        app.config['DROPBOX_FUTURES_WORKERS'] = 8
+        self.dropbox = Dropbox(app)
+
+        self.old_methods = {}
+
+        for name in ('account_info', 'get_file', 'metadata', 'put_file'):
+            self.old_methods[name] = getattr(DropboxClient, name)
+
+        self.old_obtain_access_token = DropboxSession.obtain_access_token
+
+    def tearDown(self):
+        for name, method in self.old_methods.items():
+            setattr(DropboxClient, name, method)
+
+        DropboxSession.obtain_access_token = self.old_obtain_access_token
+
+        del app.config['DROPBOX_FUTURES_WORKERS']
+        app.extensions['dropbox'] = dropbox
+
+        super(TestDropboxFutures, self).tearDown()
+
+    def test_futures(self):
+        def slow_metadata(path, *args, **kwargs):
+            time.sleep(0.1)
+            return {'path': path}
+
+        DropboxClient.account_info = MagicMock(return_value=TEST_ACCOUNT_INFO)
+        DropboxClient.get_file = MagicMock(
+            side_effect=lambda *args: FakeHTTPResponse(200, 'content')
+        )
+        DropboxClient.metadata = MagicMock(side_effect=slow_metadata)
+        DropboxClient.put_file = MagicMock(return_value={'bytes': 7})
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = \
+                [self.token.key, self.token.secret]
+            client = self.dropbox.futures
+
+            start = time.time()
+            futures = [client.metadata('/{0}.txt'.format(i))
+                       for i in range(8)]
+            results = gather(futures)
+
+            # All calls are made at once
+            self.assertLess(time.time() - start, 0.5)
+            self.assertEqual(results,
+                             [{'path': '/{0}.txt'.format(i)}
+                              for i in range(8)])
+
+            self.assertEqual(
+                gather([client.account_info(),
+                        client.get_file('/a.txt'),
+                        client.put_file('/b.txt', StringIO('content'))]),
+                [TEST_ACCOUNT_INFO, 'content', {'bytes': 7}]
+            )
+
+        self.assertEqual(self.dropbox.stats.as_dict()['metadata']['count'], 8)
+
+    def test_futures_errors(self):
+        DropboxClient.metadata = MagicMock(
+            side_effect=make_error_response(404)
+        )
+        DropboxSession.obtain_access_token = MagicMock(return_value=self.token)
+
+        with app.test_request_context():
+            client = self.dropbox.futures
+
+            # Token exchange doesn't require logged in user
+            self.assertEqual(client.obtain_access_token(self.token).result(),
+                             self.token)
+            self.assertRaises(AssertionError, client.metadata, '/')
+
+            session[DROPBOX_ACCESS_TOKEN_KEY] = \
+                [self.token.key, self.token.secret]
+            client = self.dropbox.futures
+
+            future = client.metadata('/missing.txt')
+            self.assertEqual(future.exception().status, 404)
+            self.assertRaises(ErrorResponse, gather, [future])
+
+
+class TestDropboxIndex(TestCase):
+
+    def setUp(self):
+        super(TestDropboxIndex, self).setUp()
+        self.index_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        if hasattr(self, 'old_delta'):
+            DropboxClient.delta = self.old_delta
+
+        app.config.pop('DROPBOX_INDEX_DIR', None)
+        app.config.pop('DROPBOX_INDEX_SYNC_INTERVAL', None)
+        shutil.rmtree(self.index_dir)
+
+        super(TestDropboxIndex, self).tearDown()
+
+    def make_delta(self, entries, cursor, reset=False, has_more=False):
+        return {'cursor': cursor,
+                'entries': entries,
+                'has_more': has_more,
+                'reset': reset}
+
+    def make_metadata(self, path, size=0, is_dir=False):
+        return {'bytes': size, 'is_dir': is_dir, 'path': path}
+
+    def test_search_view(self):
+        app.config['DROPBOX_INDEX_DIR'] = self.index_dir
+        dropbox_obj = Dropbox(app)
+
+        self.old_delta = DropboxClient.delta
+        DropboxClient.delta = MagicMock(return_value=self.make_delta(
+            [('/hello.txt', self.make_metadata('/Hello.txt', 13)),
+             ('/world.txt', self.make_metadata('/World.txt', 13))], 'c1', True
+        ))
+
+        with app.test_request_context():
+            search_url = url_for('dropbox.search')
+
+        try:
+            response = self.app.get(search_url, query_string={'q': 'hello'})
+            self.assertEqual(response.status_code, 403)
+
+            with self.app.session_transaction() as sess:
+                sess[DROPBOX_ACCESS_TOKEN_KEY] = [self.token.key,
+                                                  self.token.secret]
+
+            response = self.app.get(search_url, query_string={'q': 'hello'})
+            self.assertEqual(response.status_code, 200)
+
+            data = json.loads(response.data)
+            self.assertEqual(data['query'], 'hello')
+            self.assertEqual(data['results'],
+                             [self.make_metadata('/Hello.txt', 13)])
+
+            response = self.app.get(search_url,
+                                    query_string={'q': '.txt', 'limit': 1})
+            self.assertEqual(len(json.loads(response.data)['results']), 1)
+        finally:
+            app.extensions['dropbox'] = dropbox
+
+    def test_dropbox_index(self):
+        app.config['DROPBOX_INDEX_DIR'] = self.index_dir
+        app.config['DROPBOX_INDEX_SYNC_INTERVAL'] = 60
+        dropbox_obj = Dropbox(app)
+
+        self.old_delta = DropboxClient.delta
+        DropboxClient.delta = MagicMock(return_value=self.make_delta(
+            [('/hello.txt', self.make_metadata('/Hello.txt', 13))], 'c1', True
+        ))
+
+        for _ in range(2):
+            with app.test_request_context():
+                session[DROPBOX_ACCESS_TOKEN_KEY] = [self.token.key,
+                                                     self.token.secret]
+                index = dropbox_obj.index
+                self.assertEqual(index.get('/HELLO.txt')['bytes'], 13)
+                self.assertEqual(index.size(), 13)
+
+        DropboxClient.delta.assert_called_once_with(None)
+
+        with app.test_request_context():
+            self.assertRaises(AssertionError, getattr, dropbox_obj, 'index')
+
+    def test_dropbox_index_private(self):
+        index_dir = os.path.join(self.index_dir, 'private')
+        app.config['DROPBOX_INDEX_DIR'] = index_dir
+        dropbox_obj = Dropbox(app)
+
+        self.old_delta = DropboxClient.delta
+        DropboxClient.delta = MagicMock(return_value=self.make_delta(
+            [], 'c1', True
+        ))
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = [self.token.key,
+                                                 self.token.secret]
+            index = dropbox_obj.index
+
+        self.assertEqual(os.stat(index_dir).st_mode & 0777 & ~0700, 0)
+        self.assertEqual(os.stat(index.path).st_mode & 0777 & ~0600, 0)
+
+        os.chmod(index.path, 0644)
+        self.assertRaises(ValueError, MetadataIndex, index.path)
+
+        os.chmod(index_dir, 0777)
+        dropbox_obj.indexes.clear()
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = [self.token.key,
+                                                 self.token.secret]
+            self.assertRaises(ValueError, getattr, dropbox_obj, 'index')
+
+    def test_metadata_index_search(self):
+        index = MetadataIndex(os.path.join(self.index_dir, 'index.db'))
+        client = MagicMock()
+        client.delta.return_value = self.make_delta([
+            ('/books/redis.pdf', self.make_metadata('/Books/redis.pdf', 10)),
+            ('/books/redis in action.pdf',
+             self.make_metadata('/Books/Redis in Action.pdf', 20)),
+            ('/redis', self.make_metadata('/Redis', is_dir=True)),
+            ('/redis/notes.txt', self.make_metadata('/Redis/notes.txt', 30)),
+            ('/music/a_b.mp3', self.make_metadata('/Music/a_b.mp3', 40)),
+        ], 'c1', reset=True)
+        index.sync(client)
+
+        self.assertEqual([item['path'] for item in index.search('Redis')],
+                         ['/Redis',
+                          '/Books/redis.pdf',
+                          '/Books/Redis in Action.pdf',
+                          '/Redis/notes.txt'])
+        self.assertEqual([item['path']
+                          for item in index.search('redis', '/books', 1)],
+                         ['/Books/redis.pdf'])
+        self.assertEqual([item['path'] for item in index.search('s/no')],
+                         ['/Redis/notes.txt'])
+        self.assertEqual([item['path'] for item in index.search('_')],
+                         ['/Music/a_b.mp3'])
+        self.assertEqual(index.search('sider'), [])
+        self.assertEqual(index.search('  '), [])
+
+        # Index is updated incrementally
+        client.delta.return_value = self.make_delta([
+            ('/redis', None),
+            ('/redis.txt', self.make_metadata('/redis.txt', 5)),
+        ], 'c2')
+        index.sync(client)
+
+        self.assertEqual([item['path'] for item in index.search('redis')],
+                         ['/redis.txt',
+                          '/Books/redis.pdf',
+                          '/Books/Redis in Action.pdf'])
+
+    def test_metadata_index(self):
+        index = MetadataIndex(os.path.join(self.index_dir, 'index.db'))
+        self.assertIsNone(index.cursor)
+        self.assertIsNone(index.synced)
+
+        client = MagicMock()
+        client.delta.side_effect = [
+            self.make_delta([
+                ('/books', self.make_metadata('/Books', is_dir=True)),
+                ('/books/a.pdf', self.make_metadata('/Books/A.pdf', 100)),
+                ('/books/b.pdf', self.make_metadata('/Books/b.pdf', 200)),
+            ], 'c1', reset=True, has_more=True),
+            self.make_delta([
+                ('/music/rock/song.mp3',
+                 self.make_metadata('/Music/Rock/song.mp3', 300)),
+                ('/booksx.txt', self.make_metadata('/booksx.txt', 400)),
+            ], 'c2'),
+        ]
+
+        changes = index.sync(client)
+        self.assertEqual(changes[0], '/')
+        self.assertEqual(len(changes), 6)
+        self.assertEqual(index.cursor, 'c2')
+        self.assertIsNotNone(index.synced)
+        self.assertEqual([call[0] for call in client.delta.call_args_list],
+                         [(None, ), ('c1', )])
+
+        self.assertEqual(index.get('/BOOKS/a.pdf')['path'], '/Books/A.pdf')
+        self.assertTrue(index.get('/music/rock')['is_dir'])
+        self.assertIsNone(index.get('/missing'))
+
+        self.assertEqual([item['path'] for item in index.list('/')],
+                         ['/Books', '/booksx.txt', '/music'])
+        self.assertEqual([item['path'] for item in index.list('/books/')],
+                         ['/Books/A.pdf', '/Books/b.pdf'])
+        self.assertIsNone(index.list('/books/a.pdf'))
+        self.assertIsNone(index.list('/missing'))
+
+        self.assertEqual(index.size(), 1000)
+        self.assertEqual(index.size('/books'), 300)
+        self.assertEqual(index.size('/music'), 300)
+        self.assertEqual(index.size('/books/b.pdf'), 200)
+
+        # Removing folder removes whole subtree
+        client.delta.side_effect = [self.make_delta([('/books', None)], 'c3')]
+        self.assertEqual(index.sync(client), ['/books'])
+        client.delta.assert_called_with('c2')
+
+        self.assertIsNone(index.get('/books/a.pdf'))
+        self.assertEqual(index.size(), 700)
+        self.assertEqual(index.size('/booksx.txt'), 400)
+
+
+class TestDropboxRetry(TestCase):
+
+    def setUp(self):
+        super(TestDropboxRetry, self).setUp()
+        app.config['DROPBOX_RETRY_BACKOFF'] = 0.001
+
+    def tearDown(self):
+        if hasattr(self, 'old_metadata'):
+            DropboxClient.metadata = self.old_metadata
+        if hasattr(self, 'old_put_file'):
+            DropboxClient.put_file = self.old_put_file
+
+        del app.config['DROPBOX_RETRY_BACKOFF']
+        app.config.pop('DROPBOX_CIRCUIT_BREAKER_THRESHOLD', None)
+        app.extensions['dropbox'] = dropbox
+
+        super(TestDropboxRetry, self).tearDown()
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(threshold=2, timeout=0.05)
+        self.assertEqual(breaker.state, 'closed')
+
+        breaker.before_call()
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+
+        with self.assertRaises(CircuitOpenError) as context:
+            breaker.before_call()
+
+        headers = dict(context.exception.get_headers())
+        self.assertEqual(headers['Retry-After'], '1')
+        self.assertEqual(context.exception.code, 503)
+
+        # Only single trial call is allowed after timeout
+        time.sleep(0.05)
+        self.assertEqual(breaker.state, 'half-open')
+        breaker.before_call()
+        self.assertRaises(CircuitOpenError, breaker.before_call)
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+
+        time.sleep(0.05)
+        breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.before_call()
+
+    def test_dropbox_circuit_breaker(self):
+        app.config['DROPBOX_CIRCUIT_BREAKER_THRESHOLD'] = 2
+        dropbox_obj = Dropbox(app)
+        app.extensions['dropbox'] = dropbox_obj
+
+        self.old_metadata = DropboxClient.metadata
+        DropboxClient.metadata = \
+            MagicMock(side_effect=make_error_response(503))
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = [self.token.key,
+                                                 self.token.secret]
+            self.assertRaises(ErrorResponse, dropbox_obj.metadata, '/')
+
+        self.assertEqual(DropboxClient.metadata.call_count, 2)
+        self.assertEqual(dropbox_obj.circuit_breaker.state, 'open')
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = [self.token.key,
+                                                 self.token.secret]
+            self.assertRaises(CircuitOpenError, dropbox_obj.metadata, '/')
+
+        self.assertEqual(DropboxClient.metadata.call_count, 2)
+
+        # Callback view renders error instead of failing
+        with app.test_request_context():
+            callback_url = url_for('dropbox.callback')
+
+        with self.app.session_transaction() as sess:
+            sess[DROPBOX_REQUEST_TOKEN_KEY] = [self.token.key,
+                                               self.token.secret]
+
+        response = self.app.get(callback_url,
+                                query_string={'oauth_token': self.token.key})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('temporarily unavailable', response.data)
+
+    def test_dropbox_retry(self):
+        dropbox_obj = Dropbox(app)
+        token = [self.token.key, self.token.secret]
+
+        self.old_metadata = DropboxClient.metadata
+        DropboxClient.metadata = MagicMock(side_effect=[
+            make_error_response(503),
+            socket.error('Connection reset by peer'),
+            TEST_METADATA
+        ])
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            self.assertEqual(dropbox_obj.metadata('/'), TEST_METADATA)
+
+        self.assertEqual(DropboxClient.metadata.call_count, 3)
+        self.assertEqual(dropbox_obj.stats.as_dict()['metadata']['count'], 3)
+
+        # Uploads are not retried
+        self.old_put_file = DropboxClient.put_file
+        DropboxClient.put_file = \
+            MagicMock(side_effect=make_error_response(503))
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            self.assertRaises(ErrorResponse,
+                              dropbox_obj.upload,
+                              StringIO('Hello, world!'),
+                              '/hello.txt')
+
+        self.assertEqual(DropboxClient.put_file.call_count, 1)
+
+    def test_retry_policy(self):
+        policy = RetryPolicy(retries=2, backoff=0.5, max_delay=5,
+                             jitter=False)
+
+        error = make_error_response(503)
+        self.assertEqual(policy.delay(0, error), 0.5)
+        self.assertEqual(policy.delay(1, error), 1)
+        self.assertIsNone(policy.delay(2, error))
+
+        self.assertEqual(policy.delay(0, socket.error()), 0.5)
+        self.assertIsNone(policy.delay(0, make_error_response(404)))
+        self.assertIsNone(policy.delay(0, ValueError()))
+
+        error = make_error_response(429, headers=[('retry-after', '3')])
+        self.assertEqual(policy.delay(0, error), 3)
+
+        error = make_error_response(429, headers=[('retry-after', '60')])
+        self.assertIsNone(policy.delay(0, error))
+
+        policy = RetryPolicy(retries=10, backoff=0.5, max_delay=5)
+
+        for attempt in range(10):
+            delay = policy.delay(attempt, make_error_response(500))
+            self.assertTrue(0 <= delay <= min(5, 0.5 * 2 ** attempt))
+
+
+class TestDropboxSingleFlight(TestCase):
+
+    def setUp(self):
+        super(TestDropboxSingleFlight, self).setUp()
+
+        self.old_metadata = DropboxClient.metadata
+        self.old_obtain_access_token = DropboxSession.obtain_access_token
+
+    def tearDown(self):
+        DropboxClient.metadata = self.old_metadata
+        DropboxSession.obtain_access_token = self.old_obtain_access_token
+
+        app.config.pop('DROPBOX_COALESCE_CALLS', None)
+        app.extensions['dropbox'] = dropbox
+
+        super(TestDropboxSingleFlight, self).tearDown()
+
+    def run_threads(self, func, number=5):
+        results = []
+
+        def target():
+            results.append(func())
+
+        threads = [threading.Thread(target=target) for _ in range(number)]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def slow(self, result):
+        def func(*args, **kwargs):
+            time.sleep(0.1)
+
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return func
+
+    def test_single_flight(self):
+        single_flight = SingleFlight()
+        func = MagicMock(side_effect=self.slow({'path': '/'}))
+
+        results = self.run_threads(lambda: single_flight.do('key', func))
+        self.assertEqual(func.call_count, 1)
+        self.assertEqual(results, [{'path': '/'}] * 5)
+        self.assertEqual(len(single_flight), 0)
+
+        # Each caller gets its own copy of result
+        self.assertEqual(len(set(map(id, results))), 5)
+
+        # Errors are shared too
+        func = MagicMock(side_effect=self.slow(ValueError('Broken')))
+
+        def call():
+            try:
+                single_flight.do('key', func)
+            except ValueError as err:
+                return str(err)
+
+        self.assertEqual(self.run_threads(call), ['Broken'] * 5)
+        self.assertEqual(func.call_count, 1)
+
+        # Sequential calls and unhashable keys are not coalesced
+        func = MagicMock(return_value=1)
+        single_flight.do('key', func)
+        single_flight.do('key', func)
+        single_flight.do(['key'], func)
+        self.assertEqual(func.call_count, 3)
+
+    def test_dropbox_coalesce_calls(self):
+        dropbox_obj = Dropbox(app)
+        DropboxClient.metadata = \
+            MagicMock(side_effect=self.slow(TEST_METADATA))
+
+        def call(path):
+            with app.test_request_context():
+                app.preprocess_request()
+                session[DROPBOX_ACCESS_TOKEN_KEY] = \
+                    [self.token.key, self.token.secret]
+                return (dropbox_obj.client.metadata(path),
+                        dropbox_obj.request_calls.count)
+
+        self.assertEqual(self.run_threads(lambda: call('/')),
+                         [(TEST_METADATA, 1)] * 5)
+        self.assertEqual(DropboxClient.metadata.call_count, 1)
+
+        DropboxClient.metadata.reset_mock()
+        self.run_threads(lambda: call(choice(letters + digits)), 2)
+        self.assertEqual(DropboxClient.metadata.call_count, 2)
+
+        # Coalescing could be disabled
+        app.config['DROPBOX_COALESCE_CALLS'] = False
+        dropbox_obj = Dropbox(app)
+
+        DropboxClient.metadata.reset_mock()
+        self.run_threads(lambda: call('/'))
+        self.assertEqual(DropboxClient.metadata.call_count, 5)
+
+    def test_dropbox_login(self):
+        dropbox_obj = Dropbox(app)
+        DropboxSession.obtain_access_token = \
+            MagicMock(side_effect=self.slow(self.token))
+        request_token = OAuthToken('request', 'secret')
+
+        def login():
+            with app.test_request_context():
+                dropbox_obj.login(request_token)
+                return dropbox_obj.access_token.key
+
+        self.assertEqual(self.run_threads(login), [self.token.key] * 5)
+        self.assertEqual(DropboxSession.obtain_access_token.call_count, 1)
+
+
+class TestDropboxStats(TestCase):
+
+    def setUp(self):
+        super(TestDropboxStats, self).setUp()
+        dropbox.stats.clear()
+
+    def tearDown(self):
+        if hasattr(self, 'old_account_info'):
+            DropboxClient.account_info = self.old_account_info
+        if hasattr(self, 'old_metadata'):
+            DropboxClient.metadata = self.old_metadata
+
+        app.config['DROPBOX_DEBUG_STATS'] = dropbox.DROPBOX_DEBUG_STATS = None
+        dropbox.DROPBOX_MAX_CALLS_ACTION = None
+        dropbox.DROPBOX_MAX_CALLS_PER_REQUEST = None
+
+        if 'warning' in vars(app.logger):
+            del app.logger.warning
+
+        dropbox.stats.clear()
+
+        with app.test_request_context():
+            dropbox.logout()
+
+        super(TestDropboxStats, self).tearDown()
+
+    def test_api_call_signal(self):
+        calls = []
+
+        def receiver(sender, **kwargs):
+            calls.append((sender, kwargs))
+
+        self.old_account_info = DropboxClient.account_info
+        DropboxClient.account_info = MagicMock(return_value=TEST_ACCOUNT_INFO)
+
+        self.old_metadata = DropboxClient.metadata
+        DropboxClient.metadata = \
+            MagicMock(side_effect=make_error_response(404))
+
+        with api_call.connected_to(receiver):
+            with app.test_request_context():
+                session[DROPBOX_ACCESS_TOKEN_KEY] = [self.token.key,
+                                                     self.token.secret]
+                self.assertEqual(dropbox.account_info, TEST_ACCOUNT_INFO)
+                self.assertRaises(ErrorResponse,
+                                  dropbox.client.metadata,
+                                  '/Books')
+
+        self.assertEqual(len(calls), 2)
+
+        sender, kwargs = calls[0]
+        self.assertIs(sender, dropbox)
+        self.assertEqual(kwargs['method'], 'account_info')
+        self.assertIsNone(kwargs['path'])
+        self.assertEqual(kwargs['status'], 200)
+        self.assertIsNone(kwargs['bytes'])
+        self.assertGreaterEqual(kwargs['duration'], 0)
+
+        sender, kwargs = calls[1]
+        self.assertEqual(kwargs['method'], 'metadata')
+        self.assertEqual(kwargs['path'], '/Books')
+        self.assertEqual(kwargs['status'], 404)
+
+        stats = dropbox.stats.as_dict()
+        self.assertEqual(sorted(stats.keys()), ['account_info', 'metadata'])
+        self.assertEqual(stats['account_info']['count'], 1)
+        self.assertEqual(stats['account_info']['errors'], 0)
+        self.assertEqual(stats['metadata']['errors'], 1)
+
+    def test_latency_histogram(self):
+        histogram = LatencyHistogram((0.1, 1))
+        self.assertIsNone(histogram.percentile(50))
+
+        for duration in (0.05, 0.05, 0.5, 2):
+            histogram.add(duration)
+
+        histogram.add(0.07, error=True)
+        data = histogram.as_dict()
+
+        self.assertEqual(data['count'], 5)
+        self.assertEqual(data['errors'], 1)
+        self.assertEqual(data['buckets'], {'0.1': 3, '1': 1, '+Inf': 1})
+        self.assertEqual(data['min'], 0.05)
+        self.assertEqual(data['max'], 2)
+        self.assertEqual(data['p50'], 0.1)
+        self.assertEqual(data['p99'], 2)
+
+    def test_request_calls(self):
+        self.old_metadata = DropboxClient.metadata
+        DropboxClient.metadata = MagicMock(return_value=TEST_METADATA)
+
+        dropbox.DROPBOX_DEBUG_STATS = True
+        dropbox.DROPBOX_MAX_CALLS_PER_REQUEST = 2
+        app.logger.warning = MagicMock()
+
+        with app.test_request_context():
+            self.assertIsNone(dropbox.request_calls)
+            app.preprocess_request()
+
+            session[DROPBOX_ACCESS_TOKEN_KEY] = [self.token.key,
+                                                 self.token.secret]
+
+            for path in ('/', '/Books', '/Music'):
+                dropbox.client.metadata(path)
+
+            calls = dropbox.request_calls
+            self.assertEqual(calls.count, 3)
+            self.assertEqual(calls.methods.keys(), ['metadata'])
+            self.assertTrue(calls.summary().startswith('metadata x 3 '))
+
+            response = app.process_response(app.response_class())
+            self.assertEqual(response.headers['X-Dropbox-Calls'], '3')
+            self.assertIn('X-Dropbox-Time', response.headers)
+
+        self.assertEqual(app.logger.warning.call_count, 1)
+
+        dropbox.DROPBOX_MAX_CALLS_ACTION = 'raise'
+
+        with app.test_request_context():
+            app.preprocess_request()
+
+            session[DROPBOX_ACCESS_TOKEN_KEY] = [self.token.key,
+                                                 self.token.secret]
+
+            dropbox.client.metadata('/')
+            dropbox.client.metadata('/Books')
+            self.assertRaises(CallBudgetExceeded,
+                              dropbox.client.metadata,
+                              '/Music')
+
+        self.assertEqual(DropboxClient.metadata.call_count, 5)
+
+    def test_stats_view(self):
+        with app.test_request_context():
+            stats_url = url_for('dropbox.stats')
+
+        response = self.app.get(stats_url)
+        self.assertEqual(response.status_code, 404)
+
+        dropbox.stats.add('metadata', 0.2)
+        dropbox.DROPBOX_DEBUG_STATS = True
+
+        response = self.app.get(stats_url)
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.data)
+        self.assertEqual(data.keys(), ['metadata'])
+        self.assertEqual(data['metadata']['count'], 1)
+
+
+class TestDropboxThumbnails(TestCase):
+
+    def setUp(self):
+        super(TestDropboxThumbnails, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+
+        app.config['DROPBOX_THUMBNAIL_CACHE_DIR'] = self.cache_dir
+        self.dropbox = Dropbox(app)
+
+        self.old_metadata = DropboxClient.metadata
+        DropboxClient.metadata = MagicMock(return_value={
+            'path': '/Photos/cat.jpg', 'rev': 'a1', 'thumb_exists': True
+        })
+
+        self.old_thumbnail_and_metadata = DropboxClient.thumbnail_and_metadata
+        DropboxClient.thumbnail_and_metadata = MagicMock(
+            side_effect=lambda *args: (FakeHTTPResponse(200, 'thumbnail'),
+                                       {'rev': 'a1'})
+        )
+
+        with app.test_request_context():
+            self.thumbnail_url = url_for('dropbox.thumbnail',
+                                         path='Photos/cat.jpg')
+
+        with self.app.session_transaction() as sess:
+            sess[DROPBOX_ACCESS_TOKEN_KEY] = [self.token.key,
+                                              self.token.secret]
 
-import unittest
-import urllib
+    def tearDown(self):
+        DropboxClient.metadata = self.old_metadata
+        DropboxClient.thumbnail_and_metadata = \
+            self.old_thumbnail_and_metadata
 
-# Simple manipulation to use ``unittest2`` if current Python version is
-# less than 2.7
-if not hasattr(unittest.TestCase, 'assertIn'):
-    import unittest2 as unittest
+        app.config.pop('DROPBOX_THUMBNAIL_CACHE_DIR', None)
+        app.extensions['dropbox'] = dropbox
+        shutil.rmtree(self.cache_dir)
 
-try:
-    from cStringIO import StringIO
-except ImportError:
-    from StringIO import StringIO
+        super(TestDropboxThumbnails, self).tearDown()
 
-from random import choice
-from string import digits, letters
+    def test_thumbnail_cache(self):
+        cache = ThumbnailCache(self.cache_dir, 10)
 
-from dropbox.client import DropboxClient
-from dropbox.rest import ErrorResponse
-from dropbox.session import DropboxSession
-from flask import session, url_for
-from flask.ext.dropbox import Dropbox, DropboxBlueprint
-from flask.ext.dropbox.extension import OAuthToken
-from flask.ext.dropbox.settings import DROPBOX_ACCESS_TOKEN_KEY, \
-    DROPBOX_REQUEST_TOKEN_KEY
-from flask.ext.dropbox.utils import safe_url_for
-from mock import MagicMock
-from werkzeug.routing import BuildError as RoutingBuildError
+        cache.set('a', '1234')
+        cache.set('b', '1234')
+        self.assertEqual(cache.get('a'), '1234')
 
-from testapp.app import app, dropbox
+        # Make "a" most recently used
+        os.utime(cache._filename('b'), (time.time() - 60, ) * 2)
 
+        cache.set('c', '1234')
+        self.assertEqual(cache.get('a'), '1234')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), '1234')
 
-TEST_ACCOUNT_INFO = {
-    'referral_link': 'https://www.dropbox.com/referrals/TI2MDQ0MDAzO',
-    'display_name': 'Igor Davydenko',
-    'uid': 604400,
-    'country': 'UA',
-    'quota_info': {
-        'shared': 0,
-        'quota': 5637144576,
-        'normal': 4143008,
-    },
-    'email': 'playpauseandstop@gmail.com',
-}
-TEST_MEDIA = {
-    'url': 'https://dl.dropbox.com/0/view/qlfzirhc4zrln/Apps/Lyrics/redis.pdf',
-    'expires': 'Fri, 20 Apr 2012 19:58:37 +0000'
-}
-TEST_METADATA = {
-    'hash': 'cad3db434d253eb9351c9ef4734eac0d',
-    'thumb_exists': False,
-    'bytes': 0,
-    'path': '/',
-    'is_dir': True,
-    'icon': 'folder',
-    'root': 'app_folder',
-    'contents': [
-        {
-            'size': '200.9 KB',
-            'rev': '19070b1ff3',
-            'thumb_exists': False,
-            'bytes': 205736,
-            'modified': 'Fri, 20 Apr 2012 15:53:56 +0000',
-            'mime_type': 'application/pdf',
-            'path': '/redis.pdf',
-            'is_dir': False,
-            'icon': 'page_white_acrobat',
-            'root': 'dropbox',
-            'client_mtime': 'Fri, 20 Apr 2012 15:53:56 +0000',
-            'revision': 1
-        }
-    ],
-    'size': '0 bytes'
-}
-TEST_METADATA_EMPTY = {
-    'hash': 'b00f9ab62e3bfe61736c6d249e729b41',
-    'thumb_exists': False,
-    'bytes': 0,
-    'path': '/',
-    'is_dir': True,
-    'icon': 'folder',
-    'root': 'app_folder',
-    'contents': [],
-    'size': '0 bytes'
-}
+        # Values larger than cache are never stored
+        cache.set('d', 'x' * 11)
+        self.assertIsNone(cache.get('d'))
 
+        # Cache size is restored from directory
+        self.assertEqual(ThumbnailCache(self.cache_dir, 10)._size, 8)
+
+        cache.clear()
+        self.assertIsNone(cache.get('a'))
+
+    def test_thumbnail_cache_private_dir(self):
+        cache_dir = os.path.join(self.cache_dir, 'private')
+        ThumbnailCache(cache_dir, 10)
+        self.assertEqual(os.stat(cache_dir).st_mode & 0777 & ~0700, 0)
+
+        os.chmod(cache_dir, 0777)
+        self.assertRaises(ValueError, ThumbnailCache, cache_dir, 10)
+
+    def test_thumbnail_view(self):
+        url = self.thumbnail_url + '?rev=a1'
+
+        response = self.app.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, 'thumbnail')
+        self.assertEqual(response.mimetype, 'image/jpeg')
+        self.assertEqual(response.headers['ETag'], '"a1-m-jpeg"')
+        self.assertIn('max-age=604800', response.headers['Cache-Control'])
+        self.assertIn('private', response.headers['Cache-Control'])
+
+        DropboxClient.thumbnail_and_metadata.assert_called_once_with(
+            'Photos/cat.jpg', 'm', 'JPEG'
+        )
+
+        # Second request is served from disk cache
+        response = self.app.get(url)
+        self.assertEqual(response.data, 'thumbnail')
+        self.assertEqual(DropboxClient.thumbnail_and_metadata.call_count, 1)
+
+        # Browser cache is revalidated without touching Dropbox API
+        response = self.app.get(url,
+                                headers={'If-None-Match': '"a1-m-jpeg"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, '')
+        self.assertEqual(DropboxClient.thumbnail_and_metadata.call_count, 1)
+        self.assertFalse(DropboxClient.metadata.called)
+
+        # Other size is other thumbnail
+        response = self.app.get(url + '&size=xl&format=png')
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertEqual(response.headers['ETag'], '"a1-xl-png"')
+        self.assertEqual(DropboxClient.thumbnail_and_metadata.call_count, 2)
+
+    def test_thumbnail_view_errors(self):
+        response = self.app.get(self.thumbnail_url + '?size=huge')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.app.get(self.thumbnail_url + '?format=gif')
+        self.assertEqual(response.status_code, 400)
+
+        DropboxClient.metadata.return_value = {'thumb_exists': False}
+        response = self.app.get(self.thumbnail_url)
+        self.assertEqual(response.status_code, 404)
+
+        DropboxClient.thumbnail_and_metadata.side_effect = \
+            make_error_response(415)
+        response = self.app.get(self.thumbnail_url + '?rev=a1')
+        self.assertEqual(response.status_code, 404)
+
+        with self.app.session_transaction() as sess:
+            del sess[DROPBOX_ACCESS_TOKEN_KEY]
+
+        response = self.app.get(self.thumbnail_url + '?rev=a1')
+        self.assertEqual(response.status_code, 403)
+
+    def test_thumbnail_view_without_rev(self):
+        response = self.app.get(self.thumbnail_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], '"a1-m-jpeg"')
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+        self.assertEqual(DropboxClient.metadata.call_count, 1)
+
+        # File was changed, so new thumbnail is fetched
+        DropboxClient.metadata.return_value = {'rev': 'b2',
+                                               'thumb_exists': True}
+        DropboxClient.thumbnail_and_metadata.side_effect = \
+            lambda *args: (FakeHTTPResponse(200, 'new'), {'rev': 'b2'})
+
+        response = self.app.get(self.thumbnail_url,
+                                headers={'If-None-Match': '"a1-m-jpeg"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, 'new')
+        self.assertEqual(response.headers['ETag'], '"b2-m-jpeg"')
 
-class TestCase(unittest.TestCase):
+
+class TestDropboxUpload(TestCase):
 
     def setUp(self):
-        app.config['DROPBOX_CACHE_STORAGE'] = 'self'
-        app.config['TESTING'] = True
-        self.app = app.test_client()
+        super(TestDropboxUpload, self).setUp()
 
-        key = ''.join(choice(letters + digits) for _ in range(12))
-        secret = ''.join(choice(letters + digits) for _ in range(16))
-        self.token = OAuthToken(key, secret)
+        app.config['DROPBOX_CACHE_STORAGE'] = 'memory'
+        app.config['DROPBOX_UPLOAD_CHUNK_SIZE'] = 10
+        app.config['DROPBOX_UPLOAD_RETRIES'] = 1
+
+        self.content = ''.join(choice(letters + digits) for _ in range(45))
+        self.uploaded = []
+
+        self.old_finish = ChunkedUpload.finish
+        ChunkedUpload.finish = MagicMock(return_value=TEST_METADATA)
+
+        self.old_put_file = DropboxClient.put_file
+        DropboxClient.put_file = MagicMock(return_value=TEST_METADATA)
+
+        self.old_upload_chunk = DropboxClient.upload_chunk
 
     def tearDown(self):
-        app.config['TESTING'] = False
+        ChunkedUpload.finish = self.old_finish
+        DropboxClient.put_file = self.old_put_file
+        DropboxClient.upload_chunk = self.old_upload_chunk
 
+        del app.config['DROPBOX_UPLOAD_CHUNK_SIZE']
+        del app.config['DROPBOX_UPLOAD_RETRIES']
+        app.config.pop('DROPBOX_UPLOAD_QUEUE_DIR', None)
 
-class TestDropboxBlueprint(TestCase):
+        app.extensions['dropbox'] = dropbox
+        super(TestDropboxUpload, self).tearDown()
 
-    def test_init(self):
-        self.assertIn('dropbox', app.blueprints)
-        self.assertEqual(app.blueprints['dropbox'].name, 'dropbox')
+    def mock_upload_chunk(self, fail_at=None, fail_times=0):
+        failures = [fail_times]
 
-        name = 'dropbox_blueprint'
-        import_name = DropboxBlueprint.__module__
-        self.assertRaises(TypeError, DropboxBlueprint, name, import_name)
+        def upload_chunk(file_obj, length, offset=0, upload_id=None):
+            if offset == fail_at and failures[0]:
+                failures[0] -= 1
+                raise socket.error('Connection reset by peer')
 
-        blueprint = DropboxBlueprint(name=name,
-                                     import_name=import_name)
-        self.assertEqual(blueprint.name, name)
+            data = file_obj.read()
+            self.assertEqual(len(data), length)
+            self.uploaded.append((offset, upload_id, data))
+            return offset + length, 'upload-id'
 
-    def test_view_functions(self):
-        self.assertIn('dropbox.callback', app.view_functions)
-        self.assertIn('dropbox.logout', app.view_functions)
+        DropboxClient.upload_chunk = MagicMock(side_effect=upload_chunk)
+
+    def wait_upload_job(self, url):
+        for _ in range(100):
+            job = json.loads(self.app.get(url).data)
+
+            if job['status'] in ('done', 'failed'):
+                return job
+
+            time.sleep(0.01)
+
+        self.fail('Upload job is not finished in time.')
+
+    def test_upload_queue(self):
+        queue_dir = tempfile.mkdtemp()
+        app.config['DROPBOX_UPLOAD_QUEUE_DIR'] = queue_dir
+
+        dropbox_obj = Dropbox(app)
+        self.mock_upload_chunk(fail_at=20, fail_times=1)
+
+        # Files left by restarted process are removed
+        stale = os.path.join(queue_dir, 'stale.upload')
+        open(stale, 'wb').close()
+        os.utime(stale, (0, 0))
+
+        # Small files are uploaded with single request, let it fail
+        DropboxClient.put_file.side_effect = make_error_response(507)
+
+        try:
+            with self.app.session_transaction() as sess:
+                sess[DROPBOX_ACCESS_TOKEN_KEY] = [self.token.key,
+                                                  self.token.secret]
+
+            with app.test_request_context():
+                session[DROPBOX_ACCESS_TOKEN_KEY] = \
+                    [self.token.key, self.token.secret]
+
+                job_id = dropbox_obj.enqueue_upload(StringIO(self.content),
+                                                    '/a.txt')
+                failed_id = dropbox_obj.enqueue_upload(StringIO('error'),
+                                                       '/b.txt')
+                self.assertEqual(dropbox_obj.upload_job(job_id)['path'],
+                                 '/a.txt')
+                self.assertIsNone(dropbox_obj.upload_job('unknown'))
+
+                url = url_for('dropbox.upload_status', job_id=job_id)
+                failed_url = url_for('dropbox.upload_status',
+                                     job_id=failed_id)
+
+            job = self.wait_upload_job(url)
+            self.assertEqual(job['status'], 'done')
+            self.assertEqual(job['bytes'], 45)
+            self.assertEqual(job['uploaded'], 45)
+            self.assertEqual(job['metadata'], TEST_METADATA)
+            self.assertEqual(''.join(item[2] for item in self.uploaded),
+                             self.content)
+
+            job = self.wait_upload_job(failed_url)
+            self.assertEqual(job['status'], 'failed')
+            self.assertIn('507', job['error'])
+            self.assertIsNone(job['metadata'])
+
+            # Spooled files are removed, stale ones at most once in
+            # UPLOAD_QUEUE_PRUNE_INTERVAL seconds
+            self.assertEqual(os.listdir(queue_dir), [])
+
+            open(stale, 'wb').close()
+            os.utime(stale, (0, 0))
+
+            dropbox_obj._prune_upload_queue(queue_dir)
+            self.assertEqual(os.listdir(queue_dir), ['stale.upload'])
+
+            dropbox_obj._upload_queue_pruned = 0
+            dropbox_obj._prune_upload_queue(queue_dir)
+            self.assertEqual(os.listdir(queue_dir), [])
+
+            # Jobs of other users are not shown
+            with self.app.session_transaction() as sess:
+                sess[DROPBOX_ACCESS_TOKEN_KEY] = ['other', 'secret']
+
+            self.assertEqual(self.app.get(url).status_code, 404)
+
+            with self.app.session_transaction() as sess:
+                del sess[DROPBOX_ACCESS_TOKEN_KEY]
+
+            self.assertEqual(self.app.get(url).status_code, 403)
+
+            # Jobs are kept in cache storage shared between processes
+            self.assertIs(dropbox_obj.upload_jobs_storage,
+                          dropbox_obj.cache_storage)
+            app.config['DROPBOX_CACHE_STORAGE'] = None
+            self.assertIs(Dropbox(app).upload_jobs_storage,
+                          app.extensions['dropbox'].upload_jobs)
+        finally:
+            shutil.rmtree(queue_dir)
+
+    def test_upload_queue_error_message(self):
+        queue_dir = tempfile.mkdtemp()
+        app.config['DROPBOX_UPLOAD_QUEUE_DIR'] = queue_dir
+
+        dropbox_obj = Dropbox(app)
+
+        # Non-ASCII byte string message, like OS errors on localized systems
+        message = u'\u041d\u0435\u0442 \u043c\u0435\u0441\u0442\u0430'
+        DropboxClient.put_file.side_effect = \
+            IOError(28, message.encode('utf-8'))
+
+        try:
+            with self.app.session_transaction() as sess:
+                sess[DROPBOX_ACCESS_TOKEN_KEY] = [self.token.key,
+                                                  self.token.secret]
+
+            with app.test_request_context():
+                session[DROPBOX_ACCESS_TOKEN_KEY] = \
+                    [self.token.key, self.token.secret]
+
+                job_id = dropbox_obj.enqueue_upload(StringIO('error'),
+                                                    '/a.txt')
+                url = url_for('dropbox.upload_status', job_id=job_id)
+
+            job = self.wait_upload_job(url)
+            self.assertEqual(job['status'], 'failed')
+            self.assertEqual(job['error'], u'[Errno 28] ' + message)
+            self.assertEqual(os.listdir(queue_dir), [])
+        finally:
+            shutil.rmtree(queue_dir)
+
+    def test_upload_small_file(self):
+        dropbox_obj = Dropbox(app)
 
         with app.test_request_context():
-            self.assertEqual(url_for('dropbox.callback'), '/dropbox/callback')
-            self.assertEqual(url_for('dropbox.logout'), '/dropbox/logout')
+            session[DROPBOX_ACCESS_TOKEN_KEY] = \
+                [self.token.key, self.token.secret]
+            result = dropbox_obj.upload(StringIO(self.content[:10]), '/a.txt')
+
+        self.assertEqual(result, TEST_METADATA)
+        self.assertEqual(DropboxClient.put_file.call_count, 1)
+
+    def test_upload_chunked(self):
+        dropbox_obj = Dropbox(app)
+        self.mock_upload_chunk(fail_at=20, fail_times=1)
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = \
+                [self.token.key, self.token.secret]
+            result = dropbox_obj.upload(StringIO(self.content), '/a.txt')
+
+        self.assertEqual(result, TEST_METADATA)
+        self.assertEqual(''.join(item[2] for item in self.uploaded),
+                         self.content)
+        self.assertEqual([item[0] for item in self.uploaded],
+                         [0, 10, 20, 30, 40])
+        ChunkedUpload.finish.assert_called_once_with('/a.txt', False, None)
+
+    def test_upload_chunked_resume(self):
+        dropbox_obj = Dropbox(app)
+        self.mock_upload_chunk(fail_at=30, fail_times=2)
+        token = [self.token.key, self.token.secret]
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            self.assertRaises(socket.error,
+                              dropbox_obj.upload,
+                              StringIO(self.content),
+                              '/a.txt')
+
+        self.assertEqual(len(self.uploaded), 3)
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            dropbox_obj.upload(StringIO(self.content), '/a.txt')
+
+        self.assertEqual(''.join(item[2] for item in self.uploaded),
+                         self.content)
+        self.assertEqual(self.uploaded[3][:2], (30, 'upload-id'))
+
+    def test_upload_chunked_resume_other_content(self):
+        dropbox_obj = Dropbox(app)
+        self.mock_upload_chunk(fail_at=30, fail_times=2)
+        token = [self.token.key, self.token.secret]
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            self.assertRaises(socket.error,
+                              dropbox_obj.upload,
+                              StringIO(self.content),
+                              '/a.txt')
+
+        # Same length and first chunk, but other content of second chunk
+        content = self.content[:10] + self.content[10:][::-1]
+        del self.uploaded[:]
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            dropbox_obj.upload(StringIO(content), '/a.txt')
+
+        self.assertEqual(self.uploaded[0][:2], (0, None))
+        self.assertEqual(''.join(item[2] for item in self.uploaded), content)
+
+    def test_upload_chunked_resume_expired(self):
+        dropbox_obj = Dropbox(app)
+        self.mock_upload_chunk(fail_at=30, fail_times=2)
+        token = [self.token.key, self.token.secret]
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            self.assertRaises(socket.error,
+                              dropbox_obj.upload,
+                              StringIO(self.content),
+                              '/a.txt')
+
+        upload_chunk = DropboxClient.upload_chunk.side_effect
+        expired = [make_error_response(404)]
+        del self.uploaded[:]
+
+        def expire_upload_chunk(file_obj, length, offset=0, upload_id=None):
+            if upload_id is not None and expired:
+                raise expired.pop()
+            return upload_chunk(file_obj, length, offset, upload_id)
+
+        DropboxClient.upload_chunk.side_effect = expire_upload_chunk
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            dropbox_obj.upload(StringIO(self.content), '/a.txt')
+
+        self.assertEqual(self.uploaded[0][:2], (0, None))
+        self.assertEqual(''.join(item[2] for item in self.uploaded),
+                         self.content)
+
+        # Commit of expired upload forgets its state
+        ChunkedUpload.finish.side_effect = make_error_response(404)
+        del self.uploaded[:]
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            self.assertRaises(ErrorResponse,
+                              dropbox_obj.upload,
+                              StringIO(self.content),
+                              '/a.txt')
+
+        self.assertFalse([key for key in dropbox_obj.cache_storage._data
+                          if key.startswith(UPLOAD_CACHE_KEY)])
+
+    def test_upload_many(self):
+        dropbox_obj = Dropbox(app)
+        error = make_error_response(507)
+
+        def put_file(path, file_obj, overwrite=False, parent_rev=None):
+            time.sleep(0.1)
+            if path == '/bad.txt':
+                raise error
+            return dict(TEST_METADATA, path=path)
+
+        DropboxClient.put_file = MagicMock(side_effect=put_file)
+        files = [(StringIO(self.content[:10]), '/{0}.txt'.format(i))
+                 for i in range(5)]
+        files.insert(2, (StringIO(self.content[:10]), '/bad.txt'))
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = \
+                [self.token.key, self.token.secret]
+
+            start = time.time()
+            results = dropbox_obj.upload_many(files, concurrency=6)
+            self.assertTrue(time.time() - start < 0.5)
+
+        self.assertEqual([item[0] for item in results],
+                         [item[1] for item in files])
+        self.assertIs(results[2][2], error)
+        self.assertIsNone(results[2][1])
+
+        for path, metadata, error in results[:2] + results[3:]:
+            self.assertEqual(metadata['path'], path)
+            self.assertIsNone(error)
+
+    def test_executor(self):
+        executor = Executor(2)
+        futures = executor.map(lambda value: 10 / value, [1, 2, 0, 5])
+        executor.shutdown()
+
+        self.assertEqual(len(executor._threads), 2)
+        self.assertEqual(futures[0].result(), 10)
+        self.assertEqual(futures[3].result(), 2)
+        self.assertIsInstance(futures[2].exception(), ZeroDivisionError)
+        self.assertRaises(ZeroDivisionError, futures[2].result)
 
 
 class TestDropboxUtils(TestCase):
@@ -155,7 +2022,7 @@ class TestDropboxUtils(TestCase):
         dropbox_obj = Dropbox(app)
 
         with app.test_request_context():
-            self.assertIn(quoted_url, dropbox_obj.login_url)
+            self.assertIn(quoted_url, dropbox_obj.authorize_url)
 
     def test_dropbox_init(self):
         dropbox_obj = Dropbox(app)
@@ -206,17 +2073,158 @@ class TestDropboxUtils(TestCase):
         self.assertRaises(ErrorResponse, session.obtain_request_token)
 
     def test_dropbox_login_url(self):
+        old_obtain_request_token = DropboxSession.obtain_request_token
+        DropboxSession.obtain_request_token = \
+            MagicMock(return_value=self.token)
+
+        try:
+            with app.test_request_context():
+                callback_url = url_for('dropbox.callback', _external=True)
+                quoted_url = urllib.urlencode({'oauth_callback': callback_url})
+
+                self.assertEqual(dropbox.login_url, url_for('dropbox.login'))
+                self.assertEqual(
+                    DropboxSession.obtain_request_token.call_count, 0
+                )
+
+                first_url = dropbox.authorize_url
+                self.assertIn(quoted_url, first_url)
+
+                second_url = dropbox.authorize_url
+                self.assertEqual(first_url, second_url)
+                self.assertEqual(
+                    DropboxSession.obtain_request_token.call_count, 1
+                )
+
+                session[DROPBOX_REQUEST_TOKEN_EXPIRES_KEY] = time.time()
+                dropbox.authorize_url
+                self.assertEqual(
+                    DropboxSession.obtain_request_token.call_count, 2
+                )
+        finally:
+            DropboxSession.obtain_request_token = old_obtain_request_token
+
+    def test_dropbox_session(self):
+        dropbox_obj = Dropbox(app)
+        token = [self.token.key, self.token.secret]
+
+        shared = dropbox_obj.session
+        self.assertIs(dropbox_obj.session, shared)
+
         with app.test_request_context():
-            callback_url = url_for('dropbox.callback', _external=True)
-            quoted_url = urllib.urlencode({'oauth_callback': callback_url})
+            session[DROPBOX_ACCESS_TOKEN_KEY] = token
+            client = dropbox_obj.client
+
+        self.assertIsNot(client.session, shared)
+        self.assertEqual(client.session.token.key, self.token.key)
+        self.assertEqual(client.session.consumer_creds.key,
+                         app.config['DROPBOX_KEY'])
+        self.assertIsNone(shared.token)
+
+        app.extensions['dropbox'] = dropbox
 
-            first_url = dropbox.login_url
-            self.assertIn(quoted_url, first_url)
+    def test_dropbox_token_store(self):
+        cache_dir = tempfile.mkdtemp()
+        app.config['DROPBOX_TOKEN_STORE'] = 'sqlite'
+        app.config['DROPBOX_TOKEN_STORE_PATH'] = \
+            os.path.join(cache_dir, 'tokens.db')
 
-            second_url = dropbox.login_url
-            self.assertIn(quoted_url, second_url)
+        dropbox_obj = Dropbox(app)
+        access_token = OAuthToken('access-key', 'access-secret')
+
+        self.old_obtain_access_token = DropboxSession.obtain_access_token
+        DropboxSession.obtain_access_token = \
+            MagicMock(return_value=access_token)
+
+        try:
+            with app.test_request_context():
+                dropbox_obj.set_token(DROPBOX_REQUEST_TOKEN_KEY, self.token)
+                token_id = session[DROPBOX_REQUEST_TOKEN_KEY]
+                self.assertIsInstance(token_id, basestring)
+                self.assertNotIn(self.token.key, token_id)
+
+                token = dropbox_obj.get_token(DROPBOX_REQUEST_TOKEN_KEY)
+                self.assertEqual(token.key, self.token.key)
+                self.assertEqual(token.secret, self.token.secret)
+
+                self.assertFalse(dropbox_obj.is_authenticated)
+                dropbox_obj.login(token)
+
+                self.assertTrue(dropbox_obj.is_authenticated)
+                self.assertNotIn(DROPBOX_REQUEST_TOKEN_KEY, session)
+                self.assertIsNone(dropbox_obj.token_store.get(token_id))
+
+                token_id = session[DROPBOX_ACCESS_TOKEN_KEY]
+                self.assertEqual(dropbox_obj.token_store.get(token_id),
+                                 ('access-key', 'access-secret'))
+                self.assertEqual(dropbox_obj.client.session.token.key,
+                                 'access-key')
+
+                dropbox_obj.logout()
+                self.assertFalse(dropbox_obj.is_authenticated)
+                self.assertIsNone(dropbox_obj.token_store.get(token_id))
+
+                # Unknown token ids are ignored
+                session[DROPBOX_ACCESS_TOKEN_KEY] = 'does-not-exist'
+                self.assertFalse(dropbox_obj.is_authenticated)
+        finally:
+            DropboxSession.obtain_access_token = self.old_obtain_access_token
+            del app.config['DROPBOX_TOKEN_STORE']
+            del app.config['DROPBOX_TOKEN_STORE_PATH']
+            app.extensions['dropbox'] = dropbox
+            shutil.rmtree(cache_dir)
+
+    def test_dropbox_access_token_ttl(self):
+        app.config['DROPBOX_TOKEN_STORE'] = 'memory'
+        app.config['DROPBOX_ACCESS_TOKEN_TTL'] = 0.2
 
-            self.assertNotEqual(first_url, second_url)
+        dropbox_obj = Dropbox(app)
+        dropbox_obj.token_store.prune_interval = 0
+        store = dropbox_obj.token_store
+
+        self.old_obtain_access_token = DropboxSession.obtain_access_token
+        DropboxSession.obtain_access_token = \
+            MagicMock(side_effect=[OAuthToken('active', 'secret'),
+                                   OAuthToken('abandoned', 'secret')])
+
+        try:
+            with app.test_request_context():
+                dropbox_obj.login(self.token)
+                active_session = dict(session)
+
+            with app.test_request_context():
+                dropbox_obj.login(self.token)
+                abandoned_id = session[DROPBOX_ACCESS_TOKEN_KEY]
+
+            self.assertEqual(len(store), 2)
+
+            # Active session refreshes its token on use, abandoned one
+            # expires and is pruned on next store write
+            for _ in range(3):
+                time.sleep(0.15)
+
+                with app.test_request_context():
+                    session.update(active_session)
+                    self.assertTrue(dropbox_obj.is_authenticated)
+                    active_session = dict(session)
+
+            self.assertIsNone(store.get(abandoned_id))
+            store.add('key', 'secret', ttl=60)
+            self.assertEqual(len(store), 2)
+
+            app.config['DROPBOX_ACCESS_TOKEN_TTL'] = None
+            dropbox_obj = Dropbox(app)
+
+            with app.test_request_context():
+                self.assertEqual(
+                    dropbox_obj._get_access_token_ttl(),
+                    app.permanent_session_lifetime.total_seconds()
+                )
+        finally:
+            DropboxSession.obtain_access_token = self.old_obtain_access_token
+            del app.config['DROPBOX_TOKEN_STORE']
+            del app.config['DROPBOX_ACCESS_TOKEN_TTL']
+            app.extensions['dropbox'] = dropbox
 
     def test_dropbox_logout_not_logged_in(self):
         with app.test_request_context():
@@ -234,7 +2242,7 @@ class TestDropboxUtils(TestCase):
 
         rules = filter(lambda rule: rule.endpoint.startswith('dropbox.'),
                        app.url_map._rules)
-        self.assertEqual(len(rules), 2)
+        self.assertEqual(len(rules), 9)
 
         dropbox_obj = Dropbox(app)
         self.assertRaises(AssertionError,
@@ -246,7 +2254,7 @@ class TestDropboxUtils(TestCase):
 
         rules = filter(lambda rule: rule.endpoint.startswith('dropbox.'),
                        app.url_map._rules)
-        self.assertEqual(len(rules), 4)
+        self.assertEqual(len(rules), 18)
 
         self.assertIn('dropbox', app.blueprints)
         app.blueprints['dropbox'] = old_blueprint
@@ -257,12 +2265,58 @@ class TestDropboxUtils(TestCase):
             self.assertRaises(RoutingBuildError, url_for, 'does_not_exist')
             self.assertEqual(safe_url_for('does_not_exist'), 'does_not_exist')
 
-    def test_token_pickable(self):
-        dump = pickle.dumps(self.token)
-        token = pickle.loads(dump)
+    def test_token_store(self):
+        cache_dir = tempfile.mkdtemp()
+
+        try:
+            stores = (
+                make_token_store('memory'),
+                make_token_store('filesystem', cache_dir),
+                make_token_store('sqlite', os.path.join(cache_dir, 'db')),
+            )
+
+            for store in stores:
+                token_id = store.add(self.token.key, self.token.secret)
+                self.assertNotIn(self.token.key, token_id)
+                self.assertEqual(store.get(token_id),
+                                 (self.token.key, self.token.secret))
 
-        self.assertEqual(self.token.key, token.key)
-        self.assertEqual(self.token.secret, token.secret)
+                store.set(token_id, 'key', 'secret')
+                self.assertEqual(store.get(token_id), ('key', 'secret'))
+
+                store.delete(token_id)
+                self.assertIsNone(store.get(token_id))
+                self.assertIsNone(store.get('does-not-exist'))
+
+                # Expired tokens are not returned and are pruned
+                token_id = store.add('key', 'secret', ttl=-1)
+                self.assertIsNone(store.get(token_id))
+
+                store.set('alive', 'key', 'secret', ttl=60)
+                store.prune()
+                self.assertEqual(store.get('alive'), ('key', 'secret'))
+
+                # Touching extends lifetime, but doesn't restore tokens
+                store.touch('alive', 120)
+                self.assertEqual(store.get('alive'), ('key', 'secret'))
+                store.touch(token_id, 60)
+                self.assertIsNone(store.get(token_id))
+
+                if isinstance(store, MemoryTokenStore):
+                    self.assertEqual(len(store), 1)
+
+            self.assertIsNone(stores[1].get('../db'))
+            self.assertEqual(sorted(os.listdir(cache_dir)), ['alive', 'db'])
+            self.assertIs(make_token_store(stores[0]), stores[0])
+            self.assertRaises(ValueError, make_token_store, 'redis')
+
+            # Secrets are not readable by other users
+            self.assertEqual(os.stat(stores[2].path).st_mode & 0077, 0)
+            os.chmod(stores[2].path, 0644)
+            self.assertRaises(ValueError, make_token_store, 'sqlite',
+                              stores[2].path)
+        finally:
+            shutil.rmtree(cache_dir)
 
 
 class TestDropboxViews(TestCase):
@@ -279,6 +2333,7 @@ class TestDropboxViews(TestCase):
             self.media_url = url_for('media', filename=filename)
             self.success_url = url_for('success', filename=filename)
             self.upload_url = url_for('upload')
+            self.upload_many_url = url_for('upload_many')
 
         self.old_build_authorize_url = DropboxSession.build_authorize_url
 
@@ -295,7 +2350,7 @@ class TestDropboxViews(TestCase):
         DropboxSession.obtain_request_token = self.old_obtain_request_token
 
         old_methods = ('account_info', 'file_delete', 'get_file_and_metadata',
-                       'media', 'metadata')
+                       'media', 'metadata', 'put_file')
 
         for method in old_methods:
             attr = 'old_' + method
@@ -311,6 +2366,7 @@ class TestDropboxViews(TestCase):
     def test_callback(self):
         with app.test_request_context():
             callback_url = url_for('dropbox.callback')
+            login_url = url_for('dropbox.login')
 
         response = self.app.get(callback_url)
         self.assertEqual(response.status_code, 200)
@@ -319,6 +2375,9 @@ class TestDropboxViews(TestCase):
             "Dropbox API didn't return valid oAuth token.", response.data
         )
 
+        # Obtain request token same way as user does
+        self.app.get(login_url)
+
         token = self.token.key
         response = self.app.get(callback_url + '?oauth_token=%s' % token[::-1])
         self.assertEqual(response.status_code, 200)
@@ -336,6 +2395,23 @@ class TestDropboxViews(TestCase):
             response.data
         )
 
+    def test_login(self):
+        with app.test_request_context():
+            login_url = url_for('dropbox.login')
+
+        response = self.app.get(login_url)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.headers['Location'],
+                         'https://www.dropbox.com/login')
+
+        with self.app.session_transaction() as sess:
+            self.assertEqual(sess[DROPBOX_REQUEST_TOKEN_KEY],
+                             [self.token.key, self.token.secret])
+
+        response = self.app.get(login_url)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(DropboxSession.obtain_request_token.call_count, 1)
+
     def test_delete(self):
         response = self.app.get(self.delete_url)
         token = [self.token.key, self.token.secret]
@@ -373,7 +2449,132 @@ class TestDropboxViews(TestCase):
         response = self.app.get(self.download_url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.headers['Content-Type'], 'application/pdf')
+        self.assertEqual(response.headers['Content-Length'], '205736')
+        self.assertEqual(response.data, '')
+
+    def test_stream_file(self):
+        content = ''.join(choice(letters + digits) for _ in range(1000))
+        metadata = dict(TEST_METADATA['contents'][0], bytes=len(content))
+
+        self.old_get_file_and_metadata = DropboxClient.get_file_and_metadata
+        DropboxClient.get_file_and_metadata = \
+            MagicMock(return_value=(StringIO(content), metadata))
+
+        with app.test_request_context():
+            session[DROPBOX_ACCESS_TOKEN_KEY] = \
+                [self.token.key, self.token.secret]
+            response = stream_file('/' + self.filename, chunk_size=100)
+
+            self.assertTrue(response.is_streamed)
+            self.assertEqual(response.headers['Content-Length'], '1000')
+            self.assertEqual(response.headers['Content-Type'],
+                             'application/pdf')
+
+            chunks = list(response.response)
+            self.assertEqual(len(chunks), 10)
+            self.assertEqual(''.join(chunks), content)
+
+    def test_stream_file_etag(self):
+        content = ''.join(choice(letters + digits) for _ in range(1000))
+        metadata = dict(TEST_METADATA['contents'][0], bytes=len(content))
+        etag = '"{0}"'.format(metadata['rev'])
+
+        self.old_get_file_and_metadata = DropboxClient.get_file_and_metadata
+        DropboxClient.get_file_and_metadata = \
+            MagicMock(side_effect=lambda *args: (StringIO(content), metadata))
+        self.old_metadata = DropboxClient.metadata
+        DropboxClient.metadata = MagicMock(return_value=metadata)
+
+        with self.app.session_transaction() as sess:
+            sess[DROPBOX_ACCESS_TOKEN_KEY] = [self.token.key,
+                                              self.token.secret]
+
+        response = self.app.get(self.download_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertFalse(DropboxClient.metadata.called)
+
+        # Not modified file is checked by metadata only
+        response = self.app.get(self.download_url,
+                                headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
         self.assertEqual(response.data, '')
+        self.assertEqual(DropboxClient.metadata.call_count, 1)
+        self.assertEqual(DropboxClient.get_file_and_metadata.call_count, 1)
+
+        # Modified file is downloaded again
+        response = self.app.get(self.download_url,
+                                headers={'If-None-Match': '"1234567890"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, content)
+        self.assertEqual(DropboxClient.get_file_and_metadata.call_count, 2)
+
+        # Known revision is not checked at all
+        with app.test_request_context(headers={'If-None-Match': etag}):
+            session[DROPBOX_ACCESS_TOKEN_KEY] = \
+                [self.token.key, self.token.secret]
+            response = stream_file('/' + self.filename, metadata['rev'])
+            self.assertEqual(response.status_code, 304)
+
+        self.assertEqual(DropboxClient.metadata.call_count, 2)
+        self.assertEqual(DropboxClient.get_file_and_metadata.call_count, 2)
+
+    def test_stream_file_range(self):
+        content = ''.join(choice(letters + digits) for _ in range(1000))
+        metadata = dict(TEST_METADATA['contents'][0], bytes=len(content))
+
+        old_http_connect = RESTClient.IMPL.http_connect
+        RESTClient.IMPL.http_connect = make_fake_connection(content, metadata)
+        token = [self.token.key, self.token.secret]
+
+        try:
+            headers = {'Range': 'bytes=10-19'}
+            with app.test_request_context(headers=headers):
+                session[DROPBOX_ACCESS_TOKEN_KEY] = token
+                response = stream_file('/' + self.filename)
+
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response.headers['Content-Length'], '10')
+                self.assertEqual(response.headers['Content-Range'],
+                                 'bytes 10-19/1000')
+                self.assertEqual(''.join(response.response), content[10:20])
+
+            headers = {'Range': 'bytes=990-'}
+            with app.test_request_context(headers=headers):
+                session[DROPBOX_ACCESS_TOKEN_KEY] = token
+                response = stream_file('/' + self.filename)
+
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response.headers['Content-Range'],
+                                 'bytes 990-999/1000')
+                self.assertEqual(''.join(response.response), content[990:])
+
+            headers = {'Range': 'bytes=0-4,-5'}
+            with app.test_request_context(headers=headers):
+                session[DROPBOX_ACCESS_TOKEN_KEY] = token
+                response = stream_file('/' + self.filename)
+
+                self.assertEqual(response.status_code, 206)
+                self.assertTrue(response.headers['Content-Type'].
+                                startswith('multipart/byteranges; boundary='))
+
+                data = ''.join(response.response)
+                self.assertIn('Content-Range: bytes 0-4/1000\r\n\r\n' +
+                              content[:5], data)
+                self.assertIn('Content-Range: bytes 995-999/1000\r\n\r\n' +
+                              content[995:], data)
+
+            headers = {'Range': 'bytes=2000-'}
+            with app.test_request_context(headers=headers):
+                session[DROPBOX_ACCESS_TOKEN_KEY] = token
+                response = stream_file('/' + self.filename)
+
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(response.headers['Content-Range'],
+                                 'bytes */1000')
+        finally:
+            RESTClient.IMPL.http_connect = old_http_connect
 
     def test_home(self):
         response = self.app.get(self.home_url)
@@ -460,3 +2661,32 @@ class TestDropboxViews(TestCase):
         response = self.app.get(self.upload_url)
         self.assertEqual(response.status_code, 200)
         self.assertIn('Upload</button>', response.data)
+
+    def test_upload_many(self):
+        response = self.app.get(self.upload_many_url)
+        token = [self.token.key, self.token.secret]
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.headers['Location'], 'http://localhost/')
+
+        # ``Authenticate`` with Dropbox API
+        with self.app.session_transaction() as sess:
+            sess[DROPBOX_ACCESS_TOKEN_KEY] = token
+
+        response = self.app.get(self.upload_many_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('<input multiple name="files" type="file">',
+                      response.data)
+
+        # Mock ``put_file`` method
+        self.old_put_file = DropboxClient.put_file
+        DropboxClient.put_file = MagicMock(
+            side_effect=lambda path, *args: dict(TEST_METADATA, path=path)
+        )
+
+        data = {'files': [(StringIO('first'), 'first.txt'),
+                          (StringIO('second'), 'second.txt')]}
+        response = self.app.post(self.upload_many_url, data=data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Uploaded as <strong>/first.txt</strong>', response.data)
+        self.assertIn('Uploaded as <strong>/second.txt</strong>',
+                      response.data)
@@ -1,5 +1,6 @@
 from flask import (make_response, redirect, render_template, request, session,
                    url_for)
+from flask.ext.dropbox.views import stream_file
 from werkzeug import secure_filename
 
 from testapp.app import dropbox
@@ -15,6 +16,7 @@ def delete(filename):
         return redirect(url_for('home'))
 
     dropbox.client.file_delete('/' + filename)
+
     return redirect(url_for('files'))
 
 
@@ -27,18 +29,12 @@ def download(filename, media=False):
     if not dropbox.is_authenticated:
         return redirect(url_for('home'))
 
-    client = dropbox.client
     filename = '/' + filename
 
     if media:
-        data = client.media(filename)
-        return redirect(data['url'])
-
-    file_obj, metadata = client.get_file_and_metadata(filename)
+        return redirect(dropbox.media_url(filename))
 
-    response = make_response(''.join(file_obj.read()))
-    response.headers['Content-Type'] = metadata['mime_type']
-    return response
+    return stream_file(filename)
 
 
 def home():
@@ -61,12 +57,13 @@ def files():
     if not dropbox.is_authenticated:
         return redirect(url_for('home'))
 
-    client = dropbox.client
-    data = client.metadata('/')
+    data = dropbox.metadata('/')
     info = dropbox.account_info
 
-    for item in data['contents']:
-        item['path'] = item['path'].lstrip('/')
+    # Do not modify cached metadata
+    contents = [dict(item, path=item['path'].lstrip('/'))
+                for item in data['contents']]
+    data = dict(data, contents=contents)
 
     return render_template('files.html', data=data, info=info)
 
@@ -113,13 +110,39 @@ def upload():
         file_obj = request.files['file']
 
         if file_obj:
-            client = dropbox.client
             filename = secure_filename(file_obj.filename)
 
+            # Upload file in background and show upload status
+            if request.form.get('background'):
+                job_id = dropbox.enqueue_upload(file_obj, '/' + filename)
+                return redirect(url_for('dropbox.upload_status',
+                                        job_id=job_id))
+
             # Actual uploading process
-            result = client.put_file('/' + filename, file_obj.read())
+            result = dropbox.upload(file_obj, '/' + filename)
 
             path = result['path'].lstrip('/')
             return redirect(url_for('success', filename=path))
 
     return render_template('upload.html')
+
+
+def upload_many():
+    """
+    Upload multiple files to Dropbox in parallel.
+
+    If user not logged in - redirects to "Home" page.
+    """
+    if not dropbox.is_authenticated:
+        return redirect(url_for('home'))
+
+    results = None
+
+    if request.method == 'POST':
+        files = [(file_obj, '/' + secure_filename(file_obj.filename))
+                 for file_obj in request.files.getlist('files') if file_obj]
+
+        if files:
+            results = dropbox.upload_many(files)
+
+    return render_template('upload_many.html', results=results)